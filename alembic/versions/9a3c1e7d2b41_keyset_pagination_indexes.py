@@ -0,0 +1,33 @@
+"""keyset pagination indexes
+
+Revision ID: 9a3c1e7d2b41
+Revises: 4f74855656cc
+Create Date: 2026-10-18 10:12:04.118630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3c1e7d2b41'
+down_revision = '4f74855656cc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_wallet_transactions_wallet_id_date_id', 'wallet_transactions',
+                    ['wallet_id', 'transaction_date', 'id'])
+    op.create_index('ix_credit_wallet_history_wallet_id_date_id', 'credit_wallet_history',
+                    ['credit_wallet_id', 'date', 'id'])
+    op.create_index('ix_activities_log_organization_id_created_at_id', 'activities_log',
+                    ['organization_id', 'created_at', 'id'])
+    op.create_index('ix_notifications_date_created_id', 'notifications', ['date_created', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_notifications_date_created_id', table_name='notifications')
+    op.drop_index('ix_activities_log_organization_id_created_at_id', table_name='activities_log')
+    op.drop_index('ix_credit_wallet_history_wallet_id_date_id', table_name='credit_wallet_history')
+    op.drop_index('ix_wallet_transactions_wallet_id_date_id', table_name='wallet_transactions')
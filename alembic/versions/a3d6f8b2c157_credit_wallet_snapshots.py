@@ -0,0 +1,38 @@
+"""credit wallet snapshots
+
+Revision ID: a3d6f8b2c157
+Revises: f1b9e5c7a024
+Create Date: 2026-10-18 15:02:36.914527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d6f8b2c157'
+down_revision = 'f1b9e5c7a024'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'credit_wallet_snapshots',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('credit_wallet_id', sa.String(length=255), sa.ForeignKey('credit_wallets.id'), nullable=True),
+        sa.Column('date', sa.DateTime(), nullable=True),
+        sa.Column('history_id', sa.String(length=255), nullable=True),
+        sa.Column('balance', sa.Float(), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_credit_wallet_snapshots_id', 'credit_wallet_snapshots', ['id'])
+    op.create_index('ix_credit_wallet_snapshots_wallet_id_date_history_id', 'credit_wallet_snapshots',
+                    ['credit_wallet_id', 'date', 'history_id'])
+
+
+def downgrade():
+    op.drop_index('ix_credit_wallet_snapshots_wallet_id_date_history_id', table_name='credit_wallet_snapshots')
+    op.drop_index('ix_credit_wallet_snapshots_id', table_name='credit_wallet_snapshots')
+    op.drop_table('credit_wallet_snapshots')
@@ -0,0 +1,48 @@
+"""notification retention
+
+Revision ID: a8d4e6c2f917
+Revises: f3c9e1b7a425
+Create Date: 2026-10-18 20:12:37.540219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d4e6c2f917'
+down_revision = 'f3c9e1b7a425'
+branch_labels = None
+depends_on = None
+
+# the single column indexes left out of the trimmed index set of notifications
+dropped_indexes = ['id', 'creator', 'content', 'reference', 'recipient']
+
+
+def upgrade():
+    op.create_table(
+        'notifications_archive',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('creator', sa.String(length=100), nullable=True),
+        sa.Column('content', sa.String(length=255), nullable=True),
+        sa.Column('has_read', sa.Boolean(), nullable=True),
+        sa.Column('reference', sa.String(length=100), nullable=True),
+        sa.Column('recipient', sa.String(length=255), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.Column('last_updated', sa.DateTime(), nullable=True),
+        sa.Column('date_archived', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_notifications_archive_recipient_date_created', 'notifications_archive',
+                    ['recipient', 'date_created', 'id'])
+    op.create_index('ix_notifications_archive_date_archived', 'notifications_archive', ['date_archived'])
+    for column in dropped_indexes:
+        op.drop_index('ix_notifications_' + column, table_name='notifications')
+
+
+def downgrade():
+    for column in dropped_indexes:
+        op.create_index('ix_notifications_' + column, 'notifications', [column])
+    op.drop_index('ix_notifications_archive_date_archived', table_name='notifications_archive')
+    op.drop_index('ix_notifications_archive_recipient_date_created', table_name='notifications_archive')
+    op.drop_table('notifications_archive')
@@ -0,0 +1,37 @@
+"""unique organization wallets
+
+Revision ID: b5f2d8e4a619
+Revises: a8d4e6c2f917
+Create Date: 2026-10-18 21:05:48.362904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5f2d8e4a619'
+down_revision = 'a8d4e6c2f917'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    wallets = sa.table('wallets', sa.column('organization_id', sa.String()), sa.column('currency_code', sa.String()))
+    duplicates = op.get_bind().execute(
+        sa.select(wallets.c.organization_id, wallets.c.currency_code)
+            .group_by(wallets.c.organization_id, wallets.c.currency_code)
+            .having(sa.func.count() > 1)).all()
+    if duplicates:
+        # their balances and transactions need merging by hand first
+        raise RuntimeError("Organizations have more than one wallet in a currency: %s" % (
+            ", ".join("%s %s" % (organization_id, currency) for organization_id, currency in duplicates)))
+
+    with op.batch_alter_table('wallets') as batch_op:
+        batch_op.create_unique_constraint('uq_wallets_organization_id_currency_code',
+                                          ['organization_id', 'currency_code'])
+
+
+def downgrade():
+    with op.batch_alter_table('wallets') as batch_op:
+        batch_op.drop_constraint('uq_wallets_organization_id_currency_code', type_='unique')
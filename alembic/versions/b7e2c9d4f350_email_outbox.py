@@ -0,0 +1,46 @@
+"""email outbox
+
+Revision ID: b7e2c9d4f350
+Revises: a3d6f8b2c157
+Create Date: 2026-10-18 16:02:37.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2c9d4f350'
+down_revision = 'a3d6f8b2c157'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('email_id', sa.String(length=255), nullable=True),
+        sa.Column('subject', sa.String(length=255), nullable=True),
+        sa.Column('recipients', sa.Text(), nullable=True),
+        sa.Column('template', sa.String(length=255), nullable=True),
+        sa.Column('template_body', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('claim_id', sa.String(length=255), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.Column('date_sent', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_email_outbox_id', 'email_outbox', ['id'])
+    op.create_index('ix_email_outbox_status_next_attempt_at', 'email_outbox', ['status', 'next_attempt_at'])
+    op.create_index('ix_email_outbox_claim_id', 'email_outbox', ['claim_id'])
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_claim_id', table_name='email_outbox')
+    op.drop_index('ix_email_outbox_status_next_attempt_at', table_name='email_outbox')
+    op.drop_index('ix_email_outbox_id', table_name='email_outbox')
+    op.drop_table('email_outbox')
@@ -0,0 +1,31 @@
+"""materialized wallet balances
+
+Revision ID: c2e8f4a91d3b
+Revises: 9a3c1e7d2b41
+Create Date: 2026-10-18 11:02:47.530912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e8f4a91d3b'
+down_revision = '9a3c1e7d2b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # wallets.balance used to be recomputed on every read, so the stored
+    # value may be stale. Seed it from the settled transactions.
+    op.execute(
+        "UPDATE wallets SET balance = COALESCE(("
+        "SELECT ROUND(SUM(wallet_transactions.amount), 2) FROM wallet_transactions "
+        "WHERE wallet_transactions.wallet_id = wallets.id AND wallet_transactions.status = true"
+        "), 0)"
+    )
+
+
+def downgrade():
+    pass
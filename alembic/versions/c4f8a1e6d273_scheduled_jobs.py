@@ -0,0 +1,43 @@
+"""scheduled jobs
+
+Revision ID: c4f8a1e6d273
+Revises: b7e2c9d4f350
+Create Date: 2026-10-18 16:48:12.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f8a1e6d273'
+down_revision = 'b7e2c9d4f350'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scheduled_jobs',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('job_type', sa.String(length=100), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('run_at', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('claim_id', sa.String(length=255), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.Column('last_updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_scheduled_jobs_id', 'scheduled_jobs', ['id'])
+    op.create_index('ix_scheduled_jobs_status_run_at', 'scheduled_jobs', ['status', 'run_at'])
+    op.create_index('ix_scheduled_jobs_claim_id', 'scheduled_jobs', ['claim_id'])
+
+
+def downgrade():
+    op.drop_index('ix_scheduled_jobs_claim_id', table_name='scheduled_jobs')
+    op.drop_index('ix_scheduled_jobs_status_run_at', table_name='scheduled_jobs')
+    op.drop_index('ix_scheduled_jobs_id', table_name='scheduled_jobs')
+    op.drop_table('scheduled_jobs')
@@ -0,0 +1,37 @@
+"""wallet balance shards
+
+Revision ID: d5a7b3e1f902
+Revises: c2e8f4a91d3b
+Create Date: 2026-10-18 12:14:05.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a7b3e1f902'
+down_revision = 'c2e8f4a91d3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'wallet_balance_shards',
+        sa.Column('wallet_id', sa.String(length=255), sa.ForeignKey('wallets.id'), nullable=False),
+        sa.Column('shard', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('balance', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('wallet_id', 'shard'),
+    )
+
+
+def downgrade():
+    # fold the shards back into the wallets they belong to
+    op.execute(
+        "UPDATE wallets SET balance = COALESCE(balance, 0) + COALESCE(("
+        "SELECT SUM(wallet_balance_shards.balance) FROM wallet_balance_shards "
+        "WHERE wallet_balance_shards.wallet_id = wallets.id"
+        "), 0)"
+    )
+    op.drop_table('wallet_balance_shards')
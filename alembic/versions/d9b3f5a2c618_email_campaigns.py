@@ -0,0 +1,51 @@
+"""email campaigns
+
+Revision ID: d9b3f5a2c618
+Revises: c4f8a1e6d273
+Create Date: 2026-10-18 17:31:45.206381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b3f5a2c618'
+down_revision = 'c4f8a1e6d273'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_campaigns',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('organization_id', sa.String(length=255), nullable=True),
+        sa.Column('subject', sa.String(length=255), nullable=True),
+        sa.Column('template', sa.String(length=255), nullable=True),
+        sa.Column('template_body', sa.Text(), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_email_campaigns_id', 'email_campaigns', ['id'])
+    op.create_index('ix_email_campaigns_organization_id', 'email_campaigns', ['organization_id'])
+    op.create_table(
+        'email_campaign_recipients',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('campaign_id', sa.String(length=255), nullable=True),
+        sa.Column('email', sa.String(length=255), nullable=True),
+        sa.Column('status', sa.String(length=10), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_email_campaign_recipients_campaign_id_status', 'email_campaign_recipients',
+                    ['campaign_id', 'status'])
+    op.add_column('email_outbox', sa.Column('campaign_id', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    op.drop_column('email_outbox', 'campaign_id')
+    op.drop_index('ix_email_campaign_recipients_campaign_id_status', table_name='email_campaign_recipients')
+    op.drop_table('email_campaign_recipients')
+    op.drop_index('ix_email_campaigns_organization_id', table_name='email_campaigns')
+    op.drop_index('ix_email_campaigns_id', table_name='email_campaigns')
+    op.drop_table('email_campaigns')
@@ -0,0 +1,130 @@
+"""compact email archive
+
+Revision ID: e2a7c5f3b816
+Revises: d9b3f5a2c618
+Create Date: 2026-10-18 18:12:20.331957
+
+"""
+import hashlib
+import json
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c5f3b816'
+down_revision = 'd9b3f5a2c618'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+# the columns of the email table before this revision, all indexed
+DETAIL_COLUMNS = ['title', 'first_name', 'body', 'amount', 'due_date', 'link', 'extra_link', 'receipt_id',
+                  'invoice_id', 'description', 'sender', 'promo_product_name', 'promo_product_description',
+                  'promo_product_price', 'product_name', 'product_description', 'product_price',
+                  'extra_product_name', 'extra_product_description', 'extra_product_price', 'sender_address',
+                  'sender_city', 'sender_state']
+INDEXED_COLUMNS = ['id', 'subject'] + DETAIL_COLUMNS
+
+wide_email = sa.table('email_wide', sa.column('id', sa.String()), sa.column('subject', sa.String()),
+                      sa.column('recipient', sa.PickleType()), sa.column('date_created', sa.DateTime()),
+                      *(sa.column(name, sa.String()) for name in DETAIL_COLUMNS))
+compact_email = sa.table('email_compact', sa.column('id', sa.String()), sa.column('subject', sa.String()),
+                         sa.column('recipient_hash', sa.String()), sa.column('template', sa.String()),
+                         sa.column('date_created', sa.DateTime()), sa.column('payload', sa.LargeBinary()))
+
+
+def recipient_hash(recipients):
+    normalized = ",".join(sorted(recipient.strip().lower() for recipient in recipients))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def encode_payload(details):
+    details = {key: value for key, value in details.items() if value is not None}
+    return zlib.compress(json.dumps(details, default=str, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_payload(payload):
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+def create_wide_table():
+    op.create_table(
+        'email_wide',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('subject', sa.String(length=255), nullable=True),
+        sa.Column('recipient', sa.PickleType(), nullable=True),
+        *(sa.Column(name, sa.String(length=255), nullable=True) for name in DETAIL_COLUMNS),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def create_compact_table():
+    op.create_table(
+        'email_compact',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('subject', sa.String(length=255), nullable=True),
+        sa.Column('recipient_hash', sa.String(length=64), nullable=True),
+        sa.Column('template', sa.String(length=255), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.Column('payload', sa.LargeBinary(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def copy_rows(source, target, convert):
+    """Copies source to target BATCH_SIZE rows at a time, in id order"""
+    connection = op.get_bind()
+    last_id = None
+    while True:
+        query = sa.select(source).order_by(source.c.id).limit(BATCH_SIZE)
+        if last_id is not None:
+            query = query.where(source.c.id > last_id)
+        rows = connection.execute(query).mappings().all()
+        if not rows:
+            return
+        connection.execute(target.insert(), [convert(row) for row in rows])
+        last_id = rows[-1]["id"]
+
+
+def to_compact(row):
+    recipients = list(row["recipient"] or [])
+    details = {"recipient": recipients, **{name: row[name] for name in DETAIL_COLUMNS}}
+    if row["date_created"] is not None:
+        details["date_created"] = row["date_created"]
+    return {"id": row["id"], "subject": row["subject"], "recipient_hash": recipient_hash(recipients),
+            "template": None, "date_created": row["date_created"], "payload": encode_payload(details)}
+
+
+def to_wide(row):
+    details = decode_payload(row["payload"])
+    return {"id": row["id"], "subject": row["subject"], "recipient": details.get("recipient", []),
+            "date_created": row["date_created"], **{name: details.get(name) for name in DETAIL_COLUMNS}}
+
+
+def upgrade():
+    for name in INDEXED_COLUMNS:
+        op.drop_index('ix_email_' + name, table_name='email')
+    op.rename_table('email', 'email_wide')
+    create_compact_table()
+    copy_rows(wide_email, compact_email, to_compact)
+    op.drop_table('email_wide')
+    op.rename_table('email_compact', 'email')
+    op.create_index('ix_email_recipient_hash', 'email', ['recipient_hash'])
+    op.create_index('ix_email_date_created', 'email', ['date_created'])
+
+
+def downgrade():
+    op.drop_index('ix_email_date_created', table_name='email')
+    op.drop_index('ix_email_recipient_hash', table_name='email')
+    op.rename_table('email', 'email_compact')
+    create_wide_table()
+    copy_rows(compact_email, wide_email, to_wide)
+    op.drop_table('email_compact')
+    op.rename_table('email_wide', 'email')
+    for name in INDEXED_COLUMNS:
+        op.create_index('ix_email_' + name, 'email', [name])
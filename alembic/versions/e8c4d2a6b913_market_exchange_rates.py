@@ -0,0 +1,39 @@
+"""market exchange rates
+
+Revision ID: e8c4d2a6b913
+Revises: d5a7b3e1f902
+Create Date: 2026-10-18 13:05:41.602118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8c4d2a6b913'
+down_revision = 'd5a7b3e1f902'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # nothing kept a currency from having several rows. Keep one of each.
+    connection = op.get_bind()
+    seen = set()
+    for id, currency_code in connection.execute(sa.text(
+            "SELECT id, currency_code FROM credit_wallet_conversions ORDER BY currency_code, id")):
+        if currency_code in seen:
+            connection.execute(sa.text("DELETE FROM credit_wallet_conversions WHERE id = :id"), {"id": id})
+        seen.add(currency_code)
+
+    with op.batch_alter_table('credit_wallet_conversions') as batch_op:
+        batch_op.add_column(sa.Column('is_market_rate', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('last_updated', sa.DateTime(), nullable=True))
+        batch_op.create_unique_constraint('uq_credit_wallet_conversions_currency_code', ['currency_code'])
+
+
+def downgrade():
+    with op.batch_alter_table('credit_wallet_conversions') as batch_op:
+        batch_op.drop_constraint('uq_credit_wallet_conversions_currency_code', type_='unique')
+        batch_op.drop_column('last_updated')
+        batch_op.drop_column('is_market_rate')
@@ -0,0 +1,42 @@
+"""payment events
+
+Revision ID: f1b9e5c7a024
+Revises: e8c4d2a6b913
+Create Date: 2026-10-18 14:21:10.743295
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b9e5c7a024'
+down_revision = 'e8c4d2a6b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'payment_events',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('provider', sa.String(length=50), nullable=True),
+        sa.Column('provider_transaction_id', sa.String(length=255), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.Column('last_updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('provider', 'provider_transaction_id', name='uq_payment_events_provider_transaction'),
+    )
+    op.create_index('ix_payment_events_id', 'payment_events', ['id'])
+    op.create_index('ix_payment_events_status_next_attempt_at', 'payment_events', ['status', 'next_attempt_at'])
+
+
+def downgrade():
+    op.drop_index('ix_payment_events_status_next_attempt_at', table_name='payment_events')
+    op.drop_index('ix_payment_events_id', table_name='payment_events')
+    op.drop_table('payment_events')
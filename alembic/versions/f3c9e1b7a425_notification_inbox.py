@@ -0,0 +1,42 @@
+"""notification inbox
+
+Revision ID: f3c9e1b7a425
+Revises: e2a7c5f3b816
+Create Date: 2026-10-18 18:47:03.118652
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9e1b7a425'
+down_revision = 'e2a7c5f3b816'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_notifications_recipient_has_read_date_created', 'notifications',
+                    ['recipient', 'has_read', 'date_created', 'id'])
+    op.create_index('ix_notifications_recipient_date_created', 'notifications', ['recipient', 'date_created', 'id'])
+    op.create_table(
+        'notification_counters',
+        sa.Column('recipient', sa.String(length=255), nullable=False),
+        sa.Column('unread', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('recipient'),
+    )
+    notifications = sa.table('notifications', sa.column('recipient', sa.String()), sa.column('has_read', sa.Boolean()))
+    counters = sa.table('notification_counters', sa.column('recipient', sa.String()), sa.column('unread', sa.Integer()))
+    op.execute(counters.insert().from_select(
+        ['recipient', 'unread'],
+        sa.select(notifications.c.recipient, sa.func.count())
+            .where(notifications.c.recipient.isnot(None))
+            .where(sa.or_(notifications.c.has_read.is_(None), notifications.c.has_read == sa.false()))
+            .group_by(notifications.c.recipient)))
+
+
+def downgrade():
+    op.drop_table('notification_counters')
+    op.drop_index('ix_notifications_recipient_date_created', table_name='notifications')
+    op.drop_index('ix_notifications_recipient_has_read_date_created', table_name='notifications')
@@ -15,7 +15,9 @@ from bigfastapi.models.activities_log_models import Activitieslog as ActivitiesM
 from fastapi import APIRouter, Depends, status, HTTPException
 from bigfastapi.models.organisation_models import Organization
 from fastapi.responses import JSONResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from bigfastapi.utils.utils import cursor_page, cursor_query
 import requests
 
 
@@ -50,6 +52,8 @@ def addActivitiesLog(
 @app.get("/logs/details")
 def getActivitiesLog(
     organization_id: str,
+    cursor: str = None,
+    limit: int = _fastapi.Query(None, ge=1, le=100),
     db: Session = Depends(get_db),
     user: str = _fastapi.Depends(is_authenticated),
 
@@ -60,6 +64,9 @@ def getActivitiesLog(
         return JSONResponse({"message": "Organization does not exist"},
                             status_code=status.HTTP_400_BAD_REQUEST)
 
+    if cursor is not None or limit is not None:
+        return getOrganizationActivitiesLogPage(organization_id, cursor, limit or 50, db)
+
     logs = getOrganizationActivitiesLog(organization_id, db)
 
     return logs
@@ -138,3 +145,25 @@ def getOrganizationActivitiesLog(organization_id, db):
         setattr(log, 'organization', organization)
     
     return logCollection
+
+def getOrganizationActivitiesLogPage(organization_id, cursor, limit, db):
+    # same as getOrganizationActivitiesLog, one keyset page at a time
+    query = cursor_query(
+        select(ActivitiesModel)
+        .where(ActivitiesModel.organization_id == organization_id)
+        .where(ActivitiesModel.is_deleted == False),
+        ActivitiesModel.created_at, ActivitiesModel.id, cursor, limit)
+    page = cursor_page(db.execute(query).scalars().all(), ActivitiesModel.created_at, ActivitiesModel.id, limit)
+    organization = db.query(Organization).filter(Organization.id == organization_id).first()
+
+    logCollection = list(map(ActivitiesSchema.from_orm, page["items"]))
+    users = (db.query(userModel.User)
+        .filter(userModel.User.id.in_({log.user_id for log in logCollection})))
+    usersById = {userInfo.id: userInfo for userInfo in users}
+
+    for log in logCollection:
+        setattr(log, 'user', usersById.get(log.user_id))
+        setattr(log, 'organization', organization)
+
+    page["items"] = logCollection
+    return page
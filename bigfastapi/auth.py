@@ -2,16 +2,16 @@ import fastapi
 from fastapi import FastAPI, Request, APIRouter, BackgroundTasks, HTTPException, status
 from fastapi.openapi.models import HTTPBearer
 import fastapi.security as _security
-import passlib.hash as _hash
 from .models import auth_models, user_models
 from .schemas import auth_schemas, users_schemas
 from passlib.context import CryptContext
-from bigfastapi.utils import settings, utils
+from bigfastapi.utils import settings, utils, passwords
 from bigfastapi.db import database as _database
 from fastapi.security import OAuth2PasswordBearer
 from uuid import uuid4
-from bigfastapi.db.database import get_db
-import sqlalchemy.orm as orm
+from bigfastapi.db.database import get_async_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .auth_api import create_access_token
 # from authlib.integrations.starlette_client import OAuth, OAuthError
 from starlette.config import Config
@@ -29,7 +29,7 @@ app = APIRouter(tags=["Auth"])
 
 
 @app.post("/auth/signup", status_code=201)
-async def create_user(user: auth_schemas.UserCreate, db: orm.Session = fastapi.Depends(get_db)):
+async def create_user(user: auth_schemas.UserCreate, db: AsyncSession = fastapi.Depends(get_async_db)):
 
     """intro-This endpoint allows creation of a new user. To create a new user, you need to send a post request to the /auth/signup endpoint with a body of request containing details of the new user.
     paramDesc-
@@ -88,7 +88,7 @@ async def create_user(user: auth_schemas.UserCreate, db: orm.Session = fastapi.D
 
 
 @app.post("/auth/login", status_code=200)
-async def login(user: auth_schemas.UserLogin, db: orm.Session = fastapi.Depends(get_db)):
+async def login(user: auth_schemas.UserLogin, db: AsyncSession = fastapi.Depends(get_async_db)):
     """intro-This endpoint allows you to login an existing user, to login a user you need to make a post request to the /auth/login endpoint with a required body of requst as specified below
 
     paramDesc-
@@ -107,7 +107,7 @@ async def login(user: auth_schemas.UserLogin, db: orm.Session = fastapi.Depends(
         userinfo = await find_user_email(user.email, db)
         if userinfo["user"] is None:
             raise fastapi.HTTPException(status_code=403, detail="Invalid Credentials")
-        veri = userinfo["user"].verify_password(user.password)
+        veri = await userinfo["user"].verify_password(user.password)
         if not veri:
             raise fastapi.HTTPException(status_code=403, detail="Invalid Credentials")    
         access_token = await create_access_token(data = {"user_id": userinfo["user"].id }, db=db)  
@@ -119,7 +119,7 @@ async def login(user: auth_schemas.UserLogin, db: orm.Session = fastapi.Depends(
         userinfo = await find_user_phone(user.phone_number, user.country_code, db)
         if userinfo["user"] is None:
             raise fastapi.HTTPException(status_code=403, detail="Invalid Credentials")
-        veri = userinfo["user"].verify_password(user.password)
+        veri = await userinfo["user"].verify_password(user.password)
         if not veri:
             raise fastapi.HTTPException(status_code=403, detail="Invalid Credentials")    
         access_token = await create_access_token(data = {"user_id": userinfo["user"].id }, db=db)  
@@ -127,9 +127,9 @@ async def login(user: auth_schemas.UserLogin, db: orm.Session = fastapi.Depends(
 
 
 
-async def create_user(user: auth_schemas.UserCreate, db: orm.Session):
+async def create_user(user: auth_schemas.UserCreate, db: AsyncSession):
     user_obj = user_models.User(
-        id = uuid4().hex, email=user.email, password=_hash.sha256_crypt.hash(user.password),
+        id = uuid4().hex, email=user.email, password=await passwords.hash_password(user.password),
         first_name=user.first_name, last_name=user.last_name, phone_number=user.phone_number,
         is_active=True, is_verified = True, country_code=user.country_code, is_deleted=False,
         country=user.country, state= user.state, google_id = user.google_id, google_image= user.google_image,
@@ -137,19 +137,19 @@ async def create_user(user: auth_schemas.UserCreate, db: orm.Session):
     )
     
     db.add(user_obj)
-    db.commit()
-    db.refresh(user_obj)
+    await db.commit()
+    await db.refresh(user_obj)
     return auth_schemas.UserCreateOut.from_orm(user_obj)
 
 
 
-async def find_user_email(email, db: orm.Session):
-    found_user = db.query(user_models.User).filter(user_models.User.email == email).first()
+async def find_user_email(email, db: AsyncSession):
+    found_user = (await db.execute(select(user_models.User).where(user_models.User.email == email))).scalars().first()
     return {"user": found_user, "response_user": auth_schemas.UserCreateOut.from_orm(found_user)}
 
 
-async def find_user_phone(phone_number, country_code, db: orm.Session):
-    found_user = db.query(user_models.User).filter(user_models.User.phone_number == phone_number and user_models.User.country_code == country_code).first()
+async def find_user_phone(phone_number, country_code, db: AsyncSession):
+    found_user = (await db.execute(select(user_models.User).where(user_models.User.phone_number == phone_number and user_models.User.country_code == country_code))).scalars().first()
     return {"user": found_user, "response_user": auth_schemas.UserCreateOut.from_orm(found_user)}
 
 
@@ -1,20 +1,21 @@
 import fastapi
 from fastapi import Request, APIRouter, BackgroundTasks
 import jwt as _jwt
-import passlib.hash as _hash
 from datetime import datetime, timedelta
 from .models import auth_models, user_models
 from .schemas import auth_schemas, users_schemas
 from passlib.context import CryptContext
-from bigfastapi.utils import settings
+from bigfastapi.utils import settings, passwords
 from bigfastapi.db import database as _database
 from fastapi.security import OAuth2PasswordBearer
 from uuid import uuid4
 import random
+import time
 from jose import JWTError, jwt
-from bigfastapi.db.database import get_db
-import sqlalchemy.orm as orm
-from .email import send_email_user
+from bigfastapi.db.database import get_async_db
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.ext.asyncio import AsyncSession
 # from .users import get_user
 
 app = APIRouter()
@@ -26,7 +27,7 @@ JWT_SECRET = settings.JWT_SECRET
 ALGORITHM = 'HS256'
 
 
-async def create_access_token(data: dict, db: orm.Session):
+async def create_access_token(data: dict, db: AsyncSession):
     to_encode = data.copy()
 
     expire = datetime.utcnow() + timedelta(minutes=1440)
@@ -35,39 +36,99 @@ async def create_access_token(data: dict, db: orm.Session):
     token_obj = auth_models.Token(
         id=uuid4().hex, user_id=data["user_id"], token=encoded_jwt)
     db.add(token_obj)
-    db.commit()
-    db.refresh(token_obj)
+    await db.commit()
+    await db.refresh(token_obj)
     return encoded_jwt
 
 
-def verify_access_token(token: str, credentials_exception, db: orm.Session):
+# Tokens known to exist in the tokens table, and the column values of the
+# users they belong to (without the password hash), so authenticated requests
+# normally run no queries. The caches are per process: an entry is dropped
+# straight away only when this process updates a user or deletes a token
+# through the ORM. Bulk UPDATE/DELETE statements and writes made by other
+# workers are seen once the entry expires, at most AUTH_CACHE_SECONDS later,
+# so a logged out token or deactivated user is trusted for up to that long.
+# Set AUTH_CACHE_SECONDS to 0 to turn the caches off.
+_token_cache = {}
+_user_cache = {}
+
+
+def _cache_get(cache: dict, key: str):
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] < time.monotonic():
+        cache.pop(key, None)
+        return None
+    return entry[1]
+
+
+def _cache_set(cache: dict, key: str, value):
+    if settings.AUTH_CACHE_SECONDS <= 0:
+        return
+    if len(cache) >= settings.AUTH_CACHE_SIZE:
+        cache.clear()
+    cache[key] = (time.monotonic() + settings.AUTH_CACHE_SECONDS, value)
+
+
+# A user served from the cache has no password loaded; load it with
+# `await db.refresh(user, ["password"])` before checking it.
+async def get_cached_user(id: str, db: AsyncSession):
+    values = _cache_get(_user_cache, id)
+    if values is None:
+        user = await db.get(user_models.User, id)
+        if user is not None:
+            _cache_set(_user_cache, id, {
+                column.key: getattr(user, column.key)
+                for column in inspect(user_models.User).column_attrs
+                if column.key != "password"})
+        return user
+
+    user = user_models.User(**values)
+    make_transient_to_detached(user)
+    return await db.merge(user, load=False)
+
+
+@event.listens_for(user_models.User, "after_update")
+@event.listens_for(user_models.User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    _user_cache.pop(target.id, None)
+
+
+@event.listens_for(auth_models.Token, "after_delete")
+def _invalidate_cached_token(mapper, connection, target):
+    _token_cache.pop(target.token, None)
+
+
+async def verify_access_token(token: str, credentials_exception, db: AsyncSession):
     try:
         # check if token still exist
-        check_token = db.query(auth_models.Token).filter(
-            auth_models.Token.token == token).first()
-        if check_token == None:
-            raise fastapi.HTTPException(
-                status_code=403, detail="Invalid Credentials")
+        if _cache_get(_token_cache, token) is None:
+            check_token = (await db.execute(select(auth_models.Token).where(
+                auth_models.Token.token == token))).scalars().first()
+            if check_token == None:
+                raise fastapi.HTTPException(
+                    status_code=403, detail="Invalid Credentials")
         payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
         id: str = payload.get("user_id")
-        user = db.query(user_models.User).filter(
-            user_models.User.id == id).first()
-        email = user.email
         if id is None:
             raise credentials_exception
-        token_data = auth_schemas.TokenData(email=email, id=id)
+        user = await get_cached_user(id, db)
+        if user is None:
+            raise credentials_exception
+        _cache_set(_token_cache, token, id)
+        token_data = auth_schemas.TokenData(email=user.email, id=id)
     except JWTError:
         raise credentials_exception
 
     return token_data
 
 
-def is_authenticated(token: str = fastapi.Depends(oauth2_scheme), db: orm.Session = fastapi.Depends(get_db)):
+async def is_authenticated(token: str = fastapi.Depends(oauth2_scheme), db: AsyncSession = fastapi.Depends(get_async_db)):
     credentials_exception = fastapi.HTTPException(status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
                                                   detail=f"Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    token = verify_access_token(token, credentials_exception, db)
-    user = db.query(user_models.User).filter(
-        user_models.User.id == token.id).first()
+    token = await verify_access_token(token, credentials_exception, db)
+    user = await get_cached_user(token.id, db)
     return user
 
 
@@ -86,94 +147,93 @@ def generate_code(new_length: int = None):
 
 async def create_verification_code(user: user_models.User, length: int = None):
     user_obj = users_schemas.User.from_orm(user)
-    db = _database.SessionLocal()
-    code = ""
-    db_code = await get_code_by_userid(user_id=user_obj.id, db=db)
-    if db_code:
-        db.delete(db_code)
-        db.commit()
-        code = generate_code(length)
-        code_obj = auth_models.VerificationCode(
-            id=uuid4().hex, user_id=user_obj.id, code=code)
-        db.add(code_obj)
-        db.commit()
-        db.refresh(code_obj)
-    else:
-        code = generate_code(length)
-        code_obj = auth_models.VerificationCode(
-            id=uuid4().hex, user_id=user_obj.id, code=code)
-        db.add(code_obj)
-        db.commit()
-        db.refresh(code_obj)
+    async with _database.AsyncSessionLocal() as db:
+        code = ""
+        db_code = await get_code_by_userid(user_id=user_obj.id, db=db)
+        if db_code:
+            await db.delete(db_code)
+            await db.commit()
+            code = generate_code(length)
+            code_obj = auth_models.VerificationCode(
+                id=uuid4().hex, user_id=user_obj.id, code=code)
+            db.add(code_obj)
+            await db.commit()
+            await db.refresh(code_obj)
+        else:
+            code = generate_code(length)
+            code_obj = auth_models.VerificationCode(
+                id=uuid4().hex, user_id=user_obj.id, code=code)
+            db.add(code_obj)
+            await db.commit()
+            await db.refresh(code_obj)
 
     return {"code": code}
 
 
 async def create_forgot_pasword_code(user: users_schemas.UserRecoverPassword, length: int = None):
-    db = _database.SessionLocal()
-    user_obj = await get_user(db, email=user.email)
-    print(user_obj)
-    code = ""
-
-    db_code = db.query(auth_models.PasswordResetCode).filter(
-        auth_models.PasswordResetCode.user_id == user_obj.id).first()
-    if db_code:
-        db.delete(db_code)
-        db.commit()
-        code = generate_code(length)
-        code_obj = auth_models.PasswordResetCode(
-            id=uuid4().hex, user_id=user_obj.id, code=code)
-        db.add(code_obj)
-        db.commit()
-        db.refresh(code_obj)
-    else:
-        code = generate_code(length)
-        code_obj = auth_models.PasswordResetCode(
-            id=uuid4().hex, user_id=user_obj.id, code=code)
-        db.add(code_obj)
-        db.commit()
-        db.refresh(code_obj)
+    async with _database.AsyncSessionLocal() as db:
+        user_obj = await get_user(db, email=user.email)
+        code = ""
+
+        db_code = (await db.execute(select(auth_models.PasswordResetCode).where(
+            auth_models.PasswordResetCode.user_id == user_obj.id))).scalars().first()
+        if db_code:
+            await db.delete(db_code)
+            await db.commit()
+            code = generate_code(length)
+            code_obj = auth_models.PasswordResetCode(
+                id=uuid4().hex, user_id=user_obj.id, code=code)
+            db.add(code_obj)
+            await db.commit()
+            await db.refresh(code_obj)
+        else:
+            code = generate_code(length)
+            code_obj = auth_models.PasswordResetCode(
+                id=uuid4().hex, user_id=user_obj.id, code=code)
+            db.add(code_obj)
+            await db.commit()
+            await db.refresh(code_obj)
 
     return code
 
 
-async def get_token_by_userid(user_id: str, db: orm.Session):
-    return db.query(auth_models.Token).filter(auth_models.Token.user_id == user_id).first()
+async def get_token_by_userid(user_id: str, db: AsyncSession):
+    return (await db.execute(select(auth_models.Token).where(auth_models.Token.user_id == user_id))).scalars().first()
 
 
-async def generate_verification_token(user_id: str, db: orm.Session):
+async def generate_verification_token(user_id: str, db: AsyncSession):
     payload = {'user_id': user_id}
     token = _jwt.encode(payload, JWT_SECRET, ALGORITHM)
     token_obj = auth_models.VerificationToken(
         id=uuid4().hex, user_id=user_id, token=token)
     db.add(token_obj)
-    db.commit()
-    db.refresh(token_obj)
+    await db.commit()
+    await db.refresh(token_obj)
     return token
 
 
 async def create_verification_token(user: user_models.User):
     user_obj = users_schemas.User.from_orm(user)
-    db = _database.SessionLocal()
-    token = ""
-
-    db_token = db.query(auth_models.VerificationToken).filter(
-        auth_models.VerificationToken.user_id == user_obj.id).first()
-    if db_token:
-        validate_resp = await verify_access_token(db_token.token)
-        if not validate_resp["status"]:
-            db.delete(db_token)
-            db.commit()
-            token = await generate_verification_token(user_obj.id, db)
+    async with _database.AsyncSessionLocal() as db:
+        token = ""
+
+        db_token = (await db.execute(select(auth_models.VerificationToken).where(
+            auth_models.VerificationToken.user_id == user_obj.id))).scalars().first()
+        if db_token:
+            validate_resp = await verify_access_token(db_token.token)
+            if not validate_resp["status"]:
+                await db.delete(db_token)
+                await db.commit()
+                token = await generate_verification_token(user_obj.id, db)
+            else:
+                token = (db_token.token)
         else:
-            token = (db_token.token)
-    else:
-        token = await generate_verification_token(user_obj.id, db)
+            token = await generate_verification_token(user_obj.id, db)
 
     return {"token": token}
 
 
-async def generate_passwordreset_token(data: dict, db: orm.Session):
+async def generate_passwordreset_token(data: dict, db: AsyncSession):
     to_encode = data.copy()
 
     expire = datetime.utcnow() + timedelta(minutes=1440)
@@ -182,89 +242,88 @@ async def generate_passwordreset_token(data: dict, db: orm.Session):
     token_obj = auth_models.PasswordResetToken(
         id=uuid4().hex, user_id=data["user_id"], token=encoded_jwt)
     db.add(token_obj)
-    db.commit()
-    db.refresh(token_obj)
+    await db.commit()
+    await db.refresh(token_obj)
     return encoded_jwt
 
 
 async def create_passwordreset_token(user: user_models.User):
     user_obj = users_schemas.User.from_orm(user)
-    db = _database.SessionLocal()
-    token = ""
-
-    db_token = db.query(auth_models.VerificationToken).filter(
-        auth_models.VerificationToken.user_id == user_obj.id).first()
-    if db_token:
-        validate_resp = await verify_access_token(db_token.token)
-        if not validate_resp["status"]:
-            db.delete(db_token)
-            db.commit()
-            token = await generate_verification_token(user_obj.id, db)
+    async with _database.AsyncSessionLocal() as db:
+        token = ""
+
+        db_token = (await db.execute(select(auth_models.VerificationToken).where(
+            auth_models.VerificationToken.user_id == user_obj.id))).scalars().first()
+        if db_token:
+            validate_resp = await verify_access_token(db_token.token)
+            if not validate_resp["status"]:
+                await db.delete(db_token)
+                await db.commit()
+                token = await generate_verification_token(user_obj.id, db)
+            else:
+                token = (db_token.token)
         else:
-            token = (db_token.token)
-    else:
-        token = await generate_verification_token(user_obj.id, db)
+            token = await generate_verification_token(user_obj.id, db)
 
     return {"token": token}
 
 
 async def logout(user: users_schemas.User):
-    db = _database.SessionLocal()
-    db_token = await get_token_by_userid(user_id=user.id, db=db)
-    print(db_token)
-    db.delete(db_token)
-    db.commit()
+    async with _database.AsyncSessionLocal() as db:
+        db_token = await get_token_by_userid(user_id=user.id, db=db)
+        await db.delete(db_token)
+        await db.commit()
     return True
 
 
-async def password_change_code(password: users_schemas.UserPasswordUpdate, code: str, db: orm.Session):
+async def password_change_code(password: users_schemas.UserPasswordUpdate, code: str, db: AsyncSession):
 
     code_db = await get_password_reset_code_from_db(code, db)
     if code_db:
         user = await get_user(db=db, id=code_db.user_id)
-        user.password = _hash.sha256_crypt.hash(password.password)
-        db.commit()
-        db.refresh(user)
+        user.password = await passwords.hash_password(password.password)
+        await db.commit()
+        await db.refresh(user)
 
-        db.delete(code_db)
-        db.commit()
+        await db.delete(code_db)
+        await db.commit()
         return {"message": "password change successful"}
 
 
 async def verify_user_token(token: str):
-    db = _database.SessionLocal()
-    validate_resp = await verify_access_token(token)
-    if not validate_resp["status"]:
-        raise fastapi.HTTPException(
-            status_code=401, detail=validate_resp["data"]
-        )
+    async with _database.AsyncSessionLocal() as db:
+        validate_resp = await verify_access_token(token)
+        if not validate_resp["status"]:
+            raise fastapi.HTTPException(
+                status_code=401, detail=validate_resp["data"]
+            )
 
-    user = await get_user(db=db, id=validate_resp["data"]["user_id"])
-    user.is_verified = True
+        user = await get_user(db=db, id=validate_resp["data"]["user_id"])
+        user.is_verified = True
 
-    db.commit()
-    db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
 
-    return users_schemas.User.from_orm(user)
+        return users_schemas.User.from_orm(user)
 
 
-async def password_change_token(password: users_schemas.UserPasswordUpdate, token: str, db: orm.Session):
+async def password_change_token(password: users_schemas.UserPasswordUpdate, token: str, db: AsyncSession):
     validate_resp = await verify_access_token(token)
     if not validate_resp["status"]:
         raise fastapi.HTTPException(
             status_code=401, detail=validate_resp["data"]
         )
 
-    token_db = db.query(auth_models.PasswordResetToken).filter(
-        auth_models.PasswordResetToken.token == token).first()
+    token_db = (await db.execute(select(auth_models.PasswordResetToken).where(
+        auth_models.PasswordResetToken.token == token))).scalars().first()
     if token_db:
         user = await get_user(db=db, id=validate_resp["data"]["user_id"])
-        user.password = _hash.sha256_crypt.hash(password.password)
-        db.commit()
-        db.refresh(user)
+        user.password = await passwords.hash_password(password.password)
+        await db.commit()
+        await db.refresh(user)
 
-        db.delete(token_db)
-        db.commit()
+        await db.delete(token_db)
+        await db.commit()
         return {"message": "password change successful"}
     else:
         raise fastapi.HTTPException(status_code=401, detail="Invalid Token")
@@ -273,13 +332,17 @@ async def password_change_token(password: users_schemas.UserPasswordUpdate, toke
 ######################### DEFAULT AUTH MAIL SERVICES #####################################
 
 
+async def send_email_user(*args, **kwargs):
+    # imported when used, as bigfastapi.email depends on is_authenticated
+    from .email import send_email_user
+    return await send_email_user(*args, **kwargs)
+
 async def send_code_password_reset_email(
-    email: str, db: orm.Session, codelength: int = None
+    email: str, db: AsyncSession, codelength: int = None
 ):
     user = await get_user(db, email=email)
     if user:
         code = await create_forgot_pasword_code(user, codelength)
-        print(code)
         await send_email_user(email, user, template='password_reset.html', title="Password Reset", code=code)
         return code
     else:
@@ -288,7 +351,7 @@ async def send_code_password_reset_email(
 
 
 async def resend_code_verification_mail(
-    email: str, db: orm.Session, codelength: int = None
+    email: str, db: AsyncSession, codelength: int = None
 ):
     user = await get_user(db, email=email)
     if user:
@@ -301,7 +364,7 @@ async def resend_code_verification_mail(
 
 
 async def send_token_password_reset_email(
-    email: str, redirect_url: str, db: orm.Session
+    email: str, redirect_url: str, db: AsyncSession
 ):
     user = await get_user(db, email=email)
     if user:
@@ -315,7 +378,7 @@ async def send_token_password_reset_email(
 
 
 async def resend_token_verification_mail(
-    email: str, redirect_url: str, db: orm.Session
+    email: str, redirect_url: str, db: AsyncSession
 ):
     user = await get_user(db, email=email)
     if user:
@@ -328,22 +391,23 @@ async def resend_token_verification_mail(
             status_code=401, detail="Email not registered")
 
 
-async def get_code_by_userid(user_id: str, db: orm.Session):
-    return db.query(auth_models.VerificationCode).filter(auth_models.VerificationCode.user_id == user_id).first()
+async def get_code_by_userid(user_id: str, db: AsyncSession):
+    return (await db.execute(select(auth_models.VerificationCode).where(
+        auth_models.VerificationCode.user_id == user_id))).scalars().first()
 
 
-async def get_password_reset_code_from_db(code: str, db: orm.Session):
-    return db.query(auth_models.PasswordResetCode).filter(auth_models.PasswordResetCode.code == code).first()
+async def get_password_reset_code_from_db(code: str, db: AsyncSession):
+    return (await db.execute(select(auth_models.PasswordResetCode).where(
+        auth_models.PasswordResetCode.code == code))).scalars().first()
 
 
 # function to get user by email or id
-async def get_user(db: orm.Session, email: str = "", id: str = ""):
+async def get_user(db: AsyncSession, email: str = "", id: str = ""):
     response = ""
     if id != "":
-        response = db.query(user_models.User).filter(
-            user_models.User.id == id).first()
+        response = await db.get(user_models.User, id)
     if email != "":
-        response = db.query(user_models.User).filter(
-            user_models.User.email == email).first()
+        response = (await db.execute(select(user_models.User).where(
+            user_models.User.email == email))).scalars().first()
 
     return response
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from bigfastapi.schemas import bank_schemas, users_schemas
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_async_read_db, get_db
 import sqlalchemy.orm as Session
 from bigfastapi.models import bank_models
 from uuid import uuid4
@@ -8,7 +8,10 @@ from .auth_api import is_authenticated
 from fastapi.responses import JSONResponse
 import pkg_resources
 import json
-from fastapi_pagination import Page, add_pagination, paginate
+from fastapi_pagination import Page, add_pagination
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .utils.utils import paginate_query
 
 router = APIRouter()
 
@@ -78,20 +81,20 @@ async def add_bank_detail(bank: bank_schemas.AddBank,
 @router.get("/banks", status_code=status.HTTP_200_OK,
             response_model=Page[bank_schemas.BankResponse])
 async def get_all_banks(user: users_schemas.User = Depends(is_authenticated),
-    db:Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_async_read_db)):
 
     """Fetches all available bank details in the database.
     Args:
         user: authenticates that the user is a logged in user
-        db (Session): The database for storing the article object
+        db (AsyncSession): The database for storing the article object
     Returns:
         HTTP_200_OK (list of all registered bank details)
     Raises
         HTTP_424_FAILED_DEPENDENCY: failed to fetch banks
     """
-    banks = db.query(bank_models.BankModels).all()
-    banks_list = list(map(bank_schemas.BankResponse.from_orm, banks))
-    return paginate(banks_list)
+    banks = select(bank_models.BankModels).order_by(
+        bank_models.BankModels.date_created, bank_models.BankModels.id)
+    return await paginate_query(db, banks)
 
 
 
@@ -10,7 +10,7 @@ from .schemas import users_schemas as user_schema
 from .schemas import blog_schemas as schema
 from .models import blog_models as model
 
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_db, get_read_db
 
 app = APIRouter(tags=["Blog"])
 
@@ -52,7 +52,7 @@ def get_blog(blog_id: str, db: orm.Session = fastapi.Depends(get_db), ):
     return db.query(model.Blog).filter(model.Blog.id == blog_id).first()
 
 @app.get("/blogs", response_model=List[schema.Blog])
-def get_all_blogs(db: orm.Session = fastapi.Depends(get_db)):
+def get_all_blogs(db: orm.Session = fastapi.Depends(get_read_db)):
 
     """intro-This endpoint allows you to retreive all blog posts in the database. To retreive all blog posts, you need to make a get request to the /blog endpoint.
     
@@ -14,36 +14,34 @@ After that, the following endpoints will become available:
 """
 
 
-import json
-import pkg_resources
-from fastapi.responses import JSONResponse
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, Response, status
 from .schemas.countries_schemas import Country, State
+from .utils.country_data import get_country_data
 
 
 app = APIRouter(tags=["Countries"])
 
-COUNTRIES_DATA_PATH = pkg_resources.resource_filename('bigfastapi', 'data/')
+
+def cached_response(request: Request, response: tuple):
+    """Sends a pre-serialized (body, etag) response, or 304 if the client already has it"""
+    body, etag = response
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 
 @app.get("/countries", response_model=Country, status_code=200)
-def get_countries():
+def get_countries(request: Request):
     """intro-This endpoint returns a list of all countries in the world and their respective states. To get this data you need to make a get request to the /countries endpoint.
 
     returnDesc-On sucessful request, it returns
         returnBody- "an array country objects".
     """
-    with open(COUNTRIES_DATA_PATH + "/countries.json") as file:
-        countries = json.load(file)
-        for country in countries:
-            del country["states"]
-            del country["dial_code"]
-            del country["sample_phone_format"]
-    return JSONResponse(status_code=status.HTTP_200_OK, content=countries)
+    return cached_response(request, get_country_data().countries_response)
 
 
 @app.get("/countries/{country_code}/states", response_model=State, status_code=200)
-def get_country_states(country_code: str):
+def get_country_states(country_code: str, request: Request):
     """intro-This endpoint returns a list of all states in a queried country. To get this data you need to make a get request to the /countries/{country_code}/states endpoint.
     
     paramDesc-On get request, the url takes a query parameter "country_code" i.e /countries/{country_code}/states:
@@ -52,27 +50,16 @@ def get_country_states(country_code: str):
     returnDesc-On sucessful request, it returns
         returnBody- "an array of states".
     """
-    with open(COUNTRIES_DATA_PATH + "/countries.json") as file:
-        countries = json.load(file)
-        country_data = list(
-            filter(
-                lambda data: data["iso2"].casefold() == country_code.casefold()
-                or data["iso3"].casefold() == country_code.casefold(),
-                countries,
-            )
-        )
-        if country_data:
-            data = country_data[0]
-            del data["dial_code"]
-            del data["sample_phone_format"]
-            return JSONResponse(status_code=status.HTTP_200_OK, content=data)
+    response = get_country_data().states_response(country_code)
+    if response is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Country not found"
         )
+    return cached_response(request, response)
 
 
 @app.get("/countries/codes", response_model=Country, status_code=200)
-def get_countries_dial_codes(country_code: str = None):
+def get_countries_dial_codes(request: Request, country_code: str = None):
     """intro-This endpoint returns a list of all countries and thier respective codes including dial codes and sample phone formats. To get, you need to make a get request to the /countries/codes enpoint
     
     paramDesc-To query for a particular country, you need to make a get request to /countries/codes?country_code={country_code}
@@ -81,37 +68,12 @@ def get_countries_dial_codes(country_code: str = None):
     returnDesc-On sucessful request, it returns
         returnBody- an array of countries and their codes.
     """
-    with open(COUNTRIES_DATA_PATH + "/countries.json") as file:
-        countries = json.load(file)
-        if country_code:
-            country_search = list(
-                filter(
-                lambda data: data["iso2"].casefold() == country_code.casefold()
-                or data["iso3"].casefold() == country_code.casefold(),
-                countries,
-            )
-        )
-            country_found = country_search[0] if country_search != [] else {}
-            if country_found:
-                if country_found["dial_code"] == "":
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail="Country not found",
-                    )
-                del country_found["states"]
-                del country_found["flag_url"]
-                del country_found["flag_unicode"]
-                return JSONResponse(
-                    status_code=status.HTTP_200_OK, content=country_found
-                )
+    if country_code:
+        response = get_country_data().code_response(country_code)
+        if response is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Country not found"
             )
+        return cached_response(request, response)
 
-        for country_data in countries:
-            if country_data["dial_code"] == "":
-                del country_data
-            del country_data["states"]
-            del country_data["flag_url"]
-            del country_data["flag_unicode"]
-        return JSONResponse(status_code=status.HTTP_200_OK, content=countries)
+    return cached_response(request, get_country_data().codes_response)
@@ -1,36 +1,49 @@
+import asyncio
 import datetime as _dt
+import hmac
+import json
+import logging
 import time
+from typing import List, Union
 from uuid import uuid4
 
 import fastapi
-import requests
-import sqlalchemy.orm as _orm
 import stripe
 from decouple import config
 from fastapi import APIRouter
-from fastapi_pagination import Page, paginate, add_pagination
-from sqlalchemy import desc
+from fastapi_pagination import Page, add_pagination
+from fastapi_utils.tasks import repeat_every
+from sqlalchemy import case, desc, func, insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.responses import RedirectResponse
 
-from bigfastapi.db.database import get_db
+from bigfastapi.db import database
+from bigfastapi.db.database import get_async_db
 from .auth_api import is_authenticated
 from .models import credit_wallet_models as model, organisation_models, credit_wallet_conversion_models, wallet_models, \
-    wallet_transaction_models, credit_wallet_history_models
+    wallet_transaction_models, credit_wallet_history_models, payment_event_models
 from .schemas import credit_wallet_schemas as schema, credit_wallet_conversion_schemas
 from .schemas import users_schemas
+from .schemas.pagination_schemas import CursorPage
 from .schemas.wallet_schemas import PaymentProvider
-from .utils.utils import generate_payment_link
-from .wallet import update_wallet
+from .utils import http_client, settings
+from .utils.exchange_rates import rate_cache, refresh_market_rates
+from .utils.utils import date_bucket, generate_payment_link, paginate_cursor, paginate_query
+from .wallet import post_wallet_transactions
 
 app = APIRouter(tags=["CreditWallet"], )
+app.on_event("shutdown")(http_client.close_client)
+
+logger = logging.getLogger(__name__)
 
 
 @app.post("/credits/rates", response_model=credit_wallet_conversion_schemas.CreditWalletConversion)
 async def add_rate(
         body: credit_wallet_conversion_schemas.CreditWalletConversion,
         user: users_schemas.User = fastapi.Depends(is_authenticated),
-        db: _orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
 ):
     if user.is_superuser:
         conversion = await _get_credit_wallet_conversion(currency=body.currency_code, db=db)
@@ -43,8 +56,9 @@ async def add_rate(
                                                                       currency_code=body.currency_code)
 
         db.add(rate)
-        db.commit()
-        db.refresh(rate)
+        await db.commit()
+        await db.refresh(rate)
+        rate_cache.set(rate)
 
         return rate
     else:
@@ -55,27 +69,28 @@ async def add_rate(
 @app.get("/credits/rates", response_model=Page[credit_wallet_conversion_schemas.CreditWalletConversion])
 async def get_rates(
         user: users_schemas.User = fastapi.Depends(is_authenticated),
-        db: _orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
 ):
-    rates = db.query(credit_wallet_conversion_models.CreditWalletConversion)
-    return paginate(list(rates))
+    rates = select(credit_wallet_conversion_models.CreditWalletConversion).order_by(
+        credit_wallet_conversion_models.CreditWalletConversion.currency_code)
+    return await paginate_query(db, rates)
 
 
 @app.get("/credits/rates/{currency}", response_model=credit_wallet_conversion_schemas.CreditWalletConversion)
 async def get_rate(
         currency: str,
         user: users_schemas.User = fastapi.Depends(is_authenticated),
-        db: _orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
 ):
-    rate = db.query(credit_wallet_conversion_models.CreditWalletConversion).filter_by(
-        currency_code=currency).first()
+    """Returns the conversion rate of a currency
+
+    Market rates are refreshed in the background every
+    EXCHANGE_RATE_REFRESH_SECONDS when FREECURRENCY_API_KEY is set.
+    """
+    rate = await rate_cache.get(currency=currency, db=db)
     if rate is None:
-        freeCurrencyApiKey = config("FREECURRENCY_API_KEY")
-        if freeCurrencyApiKey.strip() == '':
-            raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                        detail="Currency " + currency + " does not have a conversion rate")
-        else:
-            rate = await _get_market_rate(currency=currency, db=db)
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="Currency " + currency + " does not have a conversion rate")
 
     return rate
 
@@ -85,32 +100,38 @@ async def update_rate(
         currency: str,
         body: credit_wallet_conversion_schemas.UpdateCreditWalletConversion,
         user: users_schemas.User = fastapi.Depends(is_authenticated),
-        db: _orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
 ):
-    rate = db.query(credit_wallet_conversion_models.CreditWalletConversion).filter_by(
-        currency_code=currency).first()
+    rate = await _get_credit_wallet_conversion(currency=currency, db=db)
     if rate is None:
         raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                     detail="Currency " + currency + " does not have a conversion rate")
     else:
         rate.rate = body.rate
-        db.commit()
-        db.refresh(rate)
+        # the market refresh leaves rates set by hand alone
+        rate.is_market_rate = False
+        rate.last_updated = _dt.datetime.utcnow()
+        await db.commit()
+        await db.refresh(rate)
+        rate_cache.set(rate)
 
         return rate
 
 
 @app.get("/credits/callback/stripe")
 async def verify_stripe_payment(status: str, tx_ref: str, transaction_id: str,
-                                db: _orm.Session = fastapi.Depends(get_db)):
-    stripe.api_key = config('STRIPE_SEC_KEY')
-    session = stripe.checkout.Session.retrieve(transaction_id)
+                                db: AsyncSession = fastapi.Depends(get_async_db)):
+    if settings.PAYMENT_CALLBACKS_QUEUED:
+        return await _queue_callback(provider=PaymentProvider.STRIPE, status=status, tx_ref=tx_ref,
+                                     transaction_id=transaction_id, db=db)
+
+    session = await http_client.call_stripe(stripe.checkout.Session.retrieve, transaction_id)
     frontendUrl = session.metadata.redirect_url
     if status == 'successful' and session.url is None:
         rootUrl = config('API_URL')
         retryLink = rootUrl + '/credits/callback&tx_ref=' + tx_ref + '&transaction_id=' + transaction_id
         ref = session.client_reference_id
-        wallet_transaction = db.query(wallet_transaction_models.WalletTransaction).filter_by(id=ref).first()
+        wallet_transaction = await db.get(wallet_transaction_models.WalletTransaction, ref)
         if wallet_transaction is not None:
             ref = wallet_transaction.transaction_ref
 
@@ -122,32 +143,18 @@ async def verify_stripe_payment(status: str, tx_ref: str, transaction_id: str,
             user_id, organization_id, _ = ref.split('-')
             amount = session.amount_total
             currency = session.currency.upper()
-            wallet = await _get_wallet(organization_id=organization_id, currency=currency, db=db)
             if currency == "NGN":
                 amount /= 100
 
             try:
-                # add money to wallet
-                await update_wallet(wallet=wallet, amount=amount, db=db, currency=currency,
-                                    wallet_transaction_id=wallet_transaction.id,
-                                    reason="Stripe: " + currency + " " + str(amount) + " Top Up")
-
-                conversion = await _get_credit_wallet_conversion(currency=currency, db=db)
-                credits_to_add = round(amount / conversion.rate)
-
-                # debit money from wallet to buy credits
-                reference = str(credits_to_add) + ' credits Top Up'
-                await update_wallet(wallet=wallet, amount=-amount, db=db, currency=currency,
-                                    reason=organization_id + ": " + reference)
-
-                # update credit here
-                await _update_credit_wallet(organization_id=organization_id, reference=reference,
-                                            credits_to_add=credits_to_add,
-                                            db=db)
+                await _settle_payment(wallet_transaction_id=wallet_transaction.id, organization_id=organization_id,
+                                      amount=amount, currency=currency, provider="Stripe", db=db)
 
                 response = RedirectResponse(url=frontendUrl + '?status=success&message=Credit refilled')
                 return response
-            except fastapi.HTTPException:
+            except fastapi.HTTPException as e:
+                if e.status_code == status.HTTP_409_CONFLICT:
+                    return RedirectResponse(url=frontendUrl + '?status=error&message=Transaction already processed')
                 response = RedirectResponse(
                     url=frontendUrl + '?status=error&message=An error occurred while refilling your credit. '
                                       'Please try again&link=' + retryLink)
@@ -169,14 +176,17 @@ async def verify_flutterwave_payment(
         status: str,
         tx_ref: str,
         transaction_id='',
-        db: _orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
 ):
+    if settings.PAYMENT_CALLBACKS_QUEUED:
+        return await _queue_callback(provider=PaymentProvider.FLUTTERWAVE, status=status, tx_ref=tx_ref,
+                                     transaction_id=transaction_id, db=db)
+
     frontendUrl = config("FRONTEND_URL")
     if status == 'successful':
-        flutterwaveKey = config('FLUTTERWAVE_SEC_KEY')
-        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer ' + flutterwaveKey}
-        url = 'https://api.flutterwave.com/v3/transactions/' + transaction_id + '/verify'
-        verificationRequest = requests.get(url, headers=headers)
+        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer ' + settings.FLUTTERWAVE_SEC_KEY}
+        url = settings.FLUTTERWAVE_API_URL + '/v3/transactions/' + transaction_id + '/verify'
+        verificationRequest = await http_client.get(url, headers=headers)
         rootUrl = config('API_URL')
         retryLink = rootUrl + '/credits/callback&tx_ref=' + tx_ref
         retryLink += '' if transaction_id == '' else ('&transaction_id=' + transaction_id)
@@ -184,7 +194,7 @@ async def verify_flutterwave_payment(
             jsonResponse = verificationRequest.json()
             ref = jsonResponse['data']['tx_ref']
             frontendUrl = jsonResponse['data']['meta']['redirect_url']
-            wallet_transaction = db.query(wallet_transaction_models.WalletTransaction).filter_by(id=ref).first()
+            wallet_transaction = await db.get(wallet_transaction_models.WalletTransaction, ref)
             if wallet_transaction is not None:
                 ref = wallet_transaction.transaction_ref
 
@@ -197,30 +207,18 @@ async def verify_flutterwave_payment(
                     user_id, organization_id, _ = ref.split('-')
                     amount = jsonResponse['data']['amount']
                     currency = jsonResponse['data']['currency']
-                    wallet = await _get_wallet(organization_id=organization_id, currency=currency, db=db)
 
                     try:
-                        # add money to wallet
-                        await update_wallet(wallet=wallet, amount=amount, db=db, currency=currency,
-                                            wallet_transaction_id=wallet_transaction.id,
-                                            reason="Flutterwave: " + currency + " " + str(amount) + " Top Up")
-
-                        conversion = await _get_credit_wallet_conversion(currency=currency, db=db)
-                        credits_to_add = round(amount / conversion.rate)
-
-                        # debit money from wallet to buy credits
-                        reference = str(credits_to_add) + ' credits Top Up'
-                        await update_wallet(wallet=wallet, amount=-amount, db=db, currency=currency,
-                                            reason=organization_id + ": " + reference)
-
-                        # update credit here
-                        await _update_credit_wallet(organization_id=organization_id, reference=reference,
-                                                    credits_to_add=credits_to_add,
-                                                    db=db)
+                        await _settle_payment(wallet_transaction_id=wallet_transaction.id,
+                                              organization_id=organization_id, amount=amount, currency=currency,
+                                              provider="Flutterwave", db=db)
 
                         response = RedirectResponse(url=frontendUrl + '?status=success&message=Credit refilled')
                         return response
-                    except fastapi.HTTPException:
+                    except fastapi.HTTPException as e:
+                        if e.status_code == status.HTTP_409_CONFLICT:
+                            return RedirectResponse(
+                                url=frontendUrl + '?status=error&message=Transaction already processed')
                         response = RedirectResponse(
                             url=frontendUrl + '?status=error&message=An error occurred while refilling your credit. '
                                               'Please try again&link=' + retryLink)
@@ -242,11 +240,91 @@ async def verify_flutterwave_payment(
         return response
 
 
+@app.post("/credits/webhook/stripe")
+async def receive_stripe_webhook(request: fastapi.Request, db: AsyncSession = fastapi.Depends(get_async_db)):
+    """Stores a Stripe checkout.session.completed event for the payment event workers"""
+    if settings.STRIPE_WEBHOOK_SECRET == '':
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Webhook is not enabled")
+
+    payload = await request.body()
+    try:
+        event = stripe.Webhook.construct_event(payload, request.headers.get('stripe-signature', ''),
+                                               settings.STRIPE_WEBHOOK_SECRET)
+    except (ValueError, stripe.error.SignatureVerificationError):
+        raise fastapi.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid webhook")
+
+    if event['type'] == 'checkout.session.completed':
+        await _store_payment_event(provider=PaymentProvider.STRIPE,
+                                   provider_transaction_id=event['data']['object']['id'],
+                                   payload=payload.decode(), db=db)
+    return {"message": "Event received"}
+
+
+@app.post("/credits/webhook/flutterwave")
+async def receive_flutterwave_webhook(request: fastapi.Request, db: AsyncSession = fastapi.Depends(get_async_db)):
+    """Stores a Flutterwave charge.completed event for the payment event workers"""
+    if settings.FLUTTERWAVE_WEBHOOK_HASH == '':
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Webhook is not enabled")
+    if not hmac.compare_digest(request.headers.get('verif-hash', '').encode(), settings.FLUTTERWAVE_WEBHOOK_HASH.encode()):
+        raise fastapi.HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid webhook")
+
+    payload = await request.body()
+    try:
+        event = json.loads(payload)
+        transaction_id = str(event['data']['id'])
+    except (ValueError, KeyError, TypeError):
+        raise fastapi.HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid webhook")
+
+    if event.get('event') == 'charge.completed':
+        await _store_payment_event(provider=PaymentProvider.FLUTTERWAVE, provider_transaction_id=transaction_id,
+                                   payload=payload.decode(), db=db)
+    return {"message": "Event received"}
+
+
+@app.get("/credits/events", response_model=Page[schema.PaymentEvent])
+async def get_payment_events(
+        event_status: str = 'dead',
+        user: users_schemas.User = fastapi.Depends(is_authenticated),
+        db: AsyncSession = fastapi.Depends(get_async_db)):
+    """Returns payment events, the dead-lettered ones by default"""
+    if not user.is_superuser:
+        raise fastapi.HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                    detail="You are not allowed to perform this request")
+
+    events = select(payment_event_models.PaymentEvent).filter_by(status=event_status).order_by(
+        payment_event_models.PaymentEvent.date_created)
+    return await paginate_query(db, events)
+
+
+@app.post("/credits/events/{event_id}/retry", response_model=schema.PaymentEvent)
+async def retry_payment_event(
+        event_id: str,
+        user: users_schemas.User = fastapi.Depends(is_authenticated),
+        db: AsyncSession = fastapi.Depends(get_async_db)):
+    """Queues a dead payment event again"""
+    if not user.is_superuser:
+        raise fastapi.HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                    detail="You are not allowed to perform this request")
+
+    event = await db.get(payment_event_models.PaymentEvent, event_id)
+    if event is None or event.status != 'dead':
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dead payment event does not exist")
+
+    event.status = 'pending'
+    event.attempts = 0
+    event.next_attempt_at = _dt.datetime.utcnow()
+    event.last_updated = _dt.datetime.utcnow()
+    await db.commit()
+    await db.refresh(event)
+
+    return event
+
+
 @app.get("/credits/{organization_id}", response_model=schema.CreditWalletResponse)
 async def get_credit(
         organization_id: str,
         user: users_schemas.User = fastapi.Depends(is_authenticated),
-        db: _orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
 ):
     """Gets the credit of an organization"""
     return await _get_credit(organization_id=organization_id, user=user, db=db)
@@ -256,18 +334,18 @@ async def get_credit(
 async def add_credit(body: schema.CreditWalletFund,
                      organization_id: str,
                      user: users_schemas.User = fastapi.Depends(is_authenticated),
-                     db: _orm.Session = fastapi.Depends(get_db)):
+                     db: AsyncSession = fastapi.Depends(get_async_db)):
     """Creates and returns a payment link"""
     await _get_organization(organization_id=organization_id, db=db, user=user)
-    conversion = await _get_credit_wallet_conversion(currency=body.currency, db=db)
+    conversion = await rate_cache.get(currency=body.currency, db=db)
     if conversion is None:
         raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                     detail="Currency " + body.currency + " does not have a conversion rate")
     if body.amount <= 0:
         raise fastapi.HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                     detail="Amount must be a positive number")
-    wallet = db.query(wallet_models.Wallet).filter_by(organization_id=organization_id).filter_by(
-        currency_code=body.currency).first()
+    wallet = (await db.execute(select(wallet_models.Wallet).filter_by(organization_id=organization_id).filter_by(
+        currency_code=body.currency))).scalars().first()
     if wallet is None:
         raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Organization does not have a wallet")
     else:
@@ -284,8 +362,8 @@ async def add_credit(body: schema.CreditWalletFund,
                                                                          transaction_date=_dt.datetime.utcnow(),
                                                                          transaction_ref=txRef)
         db.add(wallet_transaction)
-        db.commit()
-        db.refresh(wallet_transaction)
+        await db.commit()
+        await db.refresh(wallet_transaction)
 
         redirectUrl = rootUrl + '/credits/callback'
         amount = body.amount
@@ -302,74 +380,346 @@ async def add_credit(body: schema.CreditWalletFund,
         return {"link": link}
 
 
-@app.get("/credits/{organization_id}/history", response_model=Page[schema.CreditWalletHistory])
+@app.get("/credits/{organization_id}/history",
+         response_model=Union[Page[schema.CreditWalletHistory], CursorPage[schema.CreditWalletHistory]])
 async def get_credit_history(
         organization_id: str,
+        cursor: str = None,
+        limit: int = fastapi.Query(None, ge=1, le=100),
         user: users_schemas.User = fastapi.Depends(is_authenticated),
-        db: _orm.Session = fastapi.Depends(get_db)):
-    """Returns credit wallet history"""
+        db: AsyncSession = fastapi.Depends(get_async_db)):
+    """Returns credit wallet history, with the balance after each row
+
+    Pass cursor and/or limit instead of page and size to page through the
+    history with the next_cursor of each response.
+    """
     credit = await _get_credit(organization_id=organization_id, user=user, db=db)
-    history = db.query(credit_wallet_history_models.CreditWalletHistory).filter_by(credit_wallet_id=credit.id).order_by(
-        desc(credit_wallet_history_models.CreditWalletHistory.date))
-    return paginate(list(history))
+    history = select(credit_wallet_history_models.CreditWalletHistory).filter_by(credit_wallet_id=credit.id).order_by(
+        desc(credit_wallet_history_models.CreditWalletHistory.date),
+        desc(credit_wallet_history_models.CreditWalletHistory.id))
+    if cursor is not None or limit is not None:
+        page = await paginate_cursor(db, history, credit_wallet_history_models.CreditWalletHistory.date,
+                                     credit_wallet_history_models.CreditWalletHistory.id, cursor, limit or 50)
+        page["items"] = await _with_running_balances(credit_id=credit.id, history=page["items"], db=db)
+        return page
+
+    page = await paginate_query(db, history)
+    page.items = await _with_running_balances(credit_id=credit.id, history=page.items, db=db)
+    return page
+
+
+@app.get("/credits/{organization_id}/history/summary", response_model=List[schema.CreditUsage])
+async def get_credit_usage(
+        organization_id: str,
+        period: schema.CreditUsagePeriod = schema.CreditUsagePeriod.DAY,
+        start: _dt.datetime = None,
+        end: _dt.datetime = None,
+        user: users_schemas.User = fastapi.Depends(is_authenticated),
+        db: AsyncSession = fastapi.Depends(get_async_db)):
+    """Returns the credits added and used per day or month, from start up to
+    but excluding end"""
+    credit = await _get_credit(organization_id=organization_id, user=user, db=db)
+    history = credit_wallet_history_models.CreditWalletHistory
+    bucket = date_bucket(history.date, period.value, db.bind.dialect.name).label("period")
+    usage = (select(bucket,
+                    func.sum(case((history.amount > 0, history.amount), else_=0)).label("credits_added"),
+                    func.sum(case((history.amount < 0, -history.amount), else_=0)).label("credits_used"))
+             .where(history.credit_wallet_id == credit.id)
+             .group_by(bucket)
+             .order_by(bucket))
+    if start is not None:
+        usage = usage.where(history.date >= start)
+    if end is not None:
+        usage = usage.where(history.date < end)
+
+    return [{"period": row.period, "credits_added": row.credits_added, "credits_used": row.credits_used}
+            for row in (await db.execute(usage)).all()]
 
 
 ############
 # Services #
 ############
 
-async def _update_credit_wallet(organization_id: str, credits_to_add: int, reference: str, db: _orm.Session):
-    credit = db.query(model.CreditWallet).filter_by(organization_id=organization_id).first()
-
-    credit.amount += credits_to_add
-    credit.last_updated = _dt.datetime.utcnow()
-    db.commit()
-    db.refresh(credit)
-
-    credit_wallet_history = credit_wallet_history_models.CreditWalletHistory(id=uuid4().hex,
-                                                                             credit_wallet_id=credit.id,
-                                                                             amount=credits_to_add,
-                                                                             date=_dt.datetime.utcnow(),
-                                                                             reference=reference)
-    db.add(credit_wallet_history)
-    db.commit()
-    db.refresh(credit_wallet_history)
-
-
-async def _get_market_rate(currency: str, db: _orm.Session):
-    currency = currency.upper()
-
-    freeCurrencyApiKey = config("FREECURRENCY_API_KEY")
-    url = 'https://freecurrencyapi.net/api/v2/latest?apikey=' + freeCurrencyApiKey
-    response = requests.get(url)
-    if response.status_code == 200:
-        jsonResponse = response.json()
-        rates = jsonResponse['data']
-        rates['USD'] = 1
-        if currency in rates:
-            rate = jsonResponse['data'][currency]
-            conversion_rate = credit_wallet_conversion_models.CreditWalletConversion(id=uuid4().hex,
-                                                                                     rate=rate,
-                                                                                     currency_code=currency)
-
-            db.add(conversion_rate)
-            db.commit()
-            db.refresh(conversion_rate)
-
-            return conversion_rate
-
-    raise fastapi.HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                detail="Could not get exchange rate. Please try again later")
+async def _settle_payment(wallet_transaction_id: str, organization_id: str, amount: float, currency: str,
+                          provider: str, db: AsyncSession):
+    """Settles a paid top up and converts it to credits, in one transaction.
 
-
-async def _get_organization(organization_id: str, db: _orm.Session,
+    The money is credited to the organization's wallet, debited again to buy
+    the credits, and the credits added. Raises a 409 if the top up was
+    already settled, when nothing is changed.
+    """
+    conversion = await rate_cache.get(currency=currency, db=db)
+    if conversion is None:
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="Currency " + currency + " does not have a conversion rate")
+    credits_to_add = round(amount / conversion.rate)
+    reference = str(credits_to_add) + ' credits Top Up'
+
+    try:
+        wallet = await _get_wallet(organization_id=organization_id, currency=currency, db=db)
+        await post_wallet_transactions(transactions=[
+            # add money to wallet
+            {"id": wallet_transaction_id, "wallet_id": wallet.id, "amount": amount, "currency_code": currency,
+             "transaction_ref": provider + ": " + currency + " " + str(amount) + " Top Up"},
+            # debit money from wallet to buy credits
+            {"wallet_id": wallet.id, "amount": -amount, "currency_code": currency,
+             "transaction_ref": organization_id + ": " + reference},
+        ], db=db)
+        await _update_credit_wallet(organization_id=organization_id, reference=reference,
+                                    credits_to_add=credits_to_add, db=db)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+
+async def _update_credit_wallet(organization_id: str, credits_to_add: int, reference: str, db: AsyncSession):
+    """Appends credits_to_add, negative for credits used, to the credit
+    wallet's history and updates its balance, without committing"""
+    credit_id = (await db.execute(select(model.CreditWallet.id).filter_by(
+        organization_id=organization_id))).scalars().first()
+    if credit_id is None:
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="Organization does not have a credit wallet")
+
+    await db.execute(
+        update(model.CreditWallet)
+            .where(model.CreditWallet.id == credit_id)
+            .values(amount=model.CreditWallet.amount + credits_to_add, last_updated=_dt.datetime.utcnow())
+            .execution_options(synchronize_session=False))
+
+    db.add(credit_wallet_history_models.CreditWalletHistory(id=uuid4().hex,
+                                                            credit_wallet_id=credit_id,
+                                                            amount=credits_to_add,
+                                                            date=_dt.datetime.utcnow(),
+                                                            reference=reference))
+
+
+async def _with_running_balances(credit_id: str, history: list, db: AsyncSession):
+    """Returns a newest first page of credit wallet history as schemas, with
+    the balance after each row.
+
+    The balances are a running sum in SQL, from the newest snapshot older
+    than the page, so they cost the rows since that snapshot rather than the
+    whole history.
+    """
+    if not history:
+        return []
+    newest, oldest = history[0], history[-1]
+    rows = credit_wallet_history_models.CreditWalletHistory
+    snapshots = credit_wallet_history_models.CreditWalletSnapshot
+
+    snapshot = (await db.execute(
+        select(snapshots)
+            .where(snapshots.credit_wallet_id == credit_id)
+            .where(tuple_(snapshots.date, snapshots.history_id) < (oldest.date, oldest.id))
+            .order_by(snapshots.date.desc(), snapshots.history_id.desc())
+            .limit(1))).scalars().first()
+
+    running = select(rows.id, func.sum(rows.amount).over(order_by=(rows.date, rows.id))) \
+        .where(rows.credit_wallet_id == credit_id) \
+        .where(tuple_(rows.date, rows.id) <= (newest.date, newest.id))
+    opening_balance = 0
+    if snapshot is not None:
+        running = running.where(tuple_(rows.date, rows.id) > (snapshot.date, snapshot.history_id))
+        opening_balance = snapshot.balance
+    balances = dict((await db.execute(running)).all())
+
+    result = []
+    for row in history:
+        row_schema = schema.CreditWalletHistory.from_orm(row)
+        row_schema.balance = round(opening_balance + balances[row.id], 2)
+        result.append(row_schema)
+    return result
+
+
+async def snapshot_credit_balances(db: AsyncSession):
+    """Snapshots the balance of every credit wallet with history since its
+    last snapshot. Returns the number of snapshots taken."""
+    rows = credit_wallet_history_models.CreditWalletHistory
+    snapshots = credit_wallet_history_models.CreditWalletSnapshot
+
+    newest_first = func.row_number().over(partition_by=snapshots.credit_wallet_id,
+                                          order_by=(snapshots.date.desc(), snapshots.history_id.desc()))
+    ranked = select(snapshots, newest_first.label("rank")).subquery()
+    last = select(ranked).where(ranked.c.rank == 1).subquery()
+
+    since_last = select(
+        rows.credit_wallet_id, rows.date, rows.id,
+        func.sum(rows.amount).over(partition_by=rows.credit_wallet_id, order_by=(rows.date, rows.id)).label("sum"),
+        func.row_number().over(partition_by=rows.credit_wallet_id,
+                               order_by=(rows.date.desc(), rows.id.desc())).label("rank"),
+        func.coalesce(last.c.balance, 0).label("opening_balance")) \
+        .outerjoin(last, last.c.credit_wallet_id == rows.credit_wallet_id) \
+        .where((last.c.id == None) | (tuple_(rows.date, rows.id) > tuple_(last.c.date, last.c.history_id))) \
+        .subquery()
+    newest = (await db.execute(select(since_last).where(since_last.c.rank == 1))).all()
+
+    if newest:
+        now = _dt.datetime.utcnow()
+        await db.execute(insert(snapshots), [
+            {"id": uuid4().hex, "credit_wallet_id": row.credit_wallet_id, "date": row.date, "history_id": row.id,
+             "balance": round(row.opening_balance + row.sum, 2), "date_created": now}
+            for row in newest])
+        await db.commit()
+
+    return len(newest)
+
+
+class PaymentEventError(Exception):
+    """A payment event that cannot be applied, however often it is retried"""
+
+
+async def _queue_callback(provider: PaymentProvider, status: str, tx_ref: str, transaction_id: str,
+                          db: AsyncSession):
+    frontendUrl = config("FRONTEND_URL")
+    if status != 'successful' or transaction_id == '':
+        return RedirectResponse(url=frontendUrl + '?status=error&message=Payment was not successful')
+
+    await _store_payment_event(provider=provider, provider_transaction_id=transaction_id,
+                               payload=json.dumps({"status": status, "tx_ref": tx_ref,
+                                                   "transaction_id": transaction_id}), db=db)
+    return RedirectResponse(
+        url=frontendUrl + '?status=pending&message=Payment received. Your credit will be refilled shortly')
+
+
+async def _store_payment_event(provider: PaymentProvider, provider_transaction_id: str, payload: str,
+                               db: AsyncSession):
+    now = _dt.datetime.utcnow()
+    db.add(payment_event_models.PaymentEvent(id=uuid4().hex, provider=provider.value,
+                                             provider_transaction_id=provider_transaction_id, payload=payload,
+                                             status='pending', attempts=0, next_attempt_at=now,
+                                             date_created=now, last_updated=now))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # the provider sent this payment before
+        await db.rollback()
+
+
+async def _verify_payment(provider: str, provider_transaction_id: str):
+    """Asks the provider about a payment.
+
+    Returns the wallet transaction id, amount and currency of a successful
+    payment and raises PaymentEventError for any other.
+    """
+    if provider == PaymentProvider.STRIPE.value:
+        try:
+            session = await http_client.call_stripe(stripe.checkout.Session.retrieve, provider_transaction_id)
+        except stripe.error.InvalidRequestError as e:
+            raise PaymentEventError(str(e))
+        if session.payment_status != 'paid':
+            raise PaymentEventError("Payment was not successful")
+
+        amount = session.amount_total
+        currency = session.currency.upper()
+        if currency == "NGN":
+            amount /= 100
+        return session.client_reference_id, amount, currency
+
+    headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer ' + settings.FLUTTERWAVE_SEC_KEY}
+    url = settings.FLUTTERWAVE_API_URL + '/v3/transactions/' + provider_transaction_id + '/verify'
+    response = await http_client.get(url, headers=headers)
+    if response.status_code >= 500:
+        response.raise_for_status()
+    jsonResponse = response.json()
+    if response.status_code != 200 or jsonResponse['status'] != 'success' or \
+            jsonResponse['data']['status'] != 'successful':
+        raise PaymentEventError("Payment was not successful")
+
+    return jsonResponse['data']['tx_ref'], jsonResponse['data']['amount'], jsonResponse['data']['currency']
+
+
+async def _apply_payment_event(event: payment_event_models.PaymentEvent, db: AsyncSession):
+    wallet_transaction_id, amount, currency = await _verify_payment(
+        provider=event.provider, provider_transaction_id=event.provider_transaction_id)
+
+    wallet_transaction = await db.get(wallet_transaction_models.WalletTransaction, wallet_transaction_id)
+    if wallet_transaction is None:
+        raise PaymentEventError("Transaction not found")
+    if wallet_transaction.status:
+        return
+
+    user_id, organization_id, _ = wallet_transaction.transaction_ref.split('-')
+    try:
+        await _settle_payment(wallet_transaction_id=wallet_transaction.id, organization_id=organization_id,
+                              amount=amount, currency=currency, provider=event.provider.capitalize(), db=db)
+    except fastapi.HTTPException as e:
+        if e.status_code != status.HTTP_409_CONFLICT:
+            raise PaymentEventError(e.detail)
+
+
+async def process_payment_events():
+    """Claims a batch of due payment events and applies them, at most
+    PAYMENT_EVENT_WORKERS at a time.
+
+    Returns the number of events claimed.
+    """
+    async with database.AsyncSessionLocal() as db:
+        event_ids = (await db.execute(
+            select(payment_event_models.PaymentEvent.id)
+                .where(payment_event_models.PaymentEvent.status.in_(['pending', 'processing']))
+                .where(payment_event_models.PaymentEvent.next_attempt_at <= _dt.datetime.utcnow())
+                .order_by(payment_event_models.PaymentEvent.next_attempt_at)
+                .limit(settings.PAYMENT_EVENT_BATCH_SIZE))).scalars().all()
+
+    workers = asyncio.Semaphore(settings.PAYMENT_EVENT_WORKERS)
+
+    async def work(event_id):
+        async with workers:
+            return await _process_payment_event(event_id=event_id)
+
+    return sum(await asyncio.gather(*(work(event_id) for event_id in event_ids)))
+
+
+async def _process_payment_event(event_id: str):
+    async with database.AsyncSessionLocal() as db:
+        # claim the event, unless another worker did
+        now = _dt.datetime.utcnow()
+        claim = await db.execute(
+            update(payment_event_models.PaymentEvent)
+                .where(payment_event_models.PaymentEvent.id == event_id)
+                .where(payment_event_models.PaymentEvent.status.in_(['pending', 'processing']))
+                .where(payment_event_models.PaymentEvent.next_attempt_at <= now)
+                .values(status='processing', attempts=payment_event_models.PaymentEvent.attempts + 1,
+                        next_attempt_at=now + _dt.timedelta(seconds=settings.PAYMENT_EVENT_LEASE_SECONDS),
+                        last_updated=now)
+                .execution_options(synchronize_session=False))
+        await db.commit()
+        if claim.rowcount != 1:
+            return False
+
+        event = await db.get(payment_event_models.PaymentEvent, event_id)
+        attempts = event.attempts
+        values = {"status": 'done', "last_error": None}
+        try:
+            await _apply_payment_event(event=event, db=db)
+        except PaymentEventError as e:
+            values = {"status": 'dead', "last_error": str(e)}
+        except Exception as e:
+            logger.exception("Could not apply payment event %s", event_id)
+            values = {"status": 'dead' if attempts >= settings.PAYMENT_EVENT_MAX_ATTEMPTS else 'pending',
+                      "last_error": repr(e),
+                      "next_attempt_at": _dt.datetime.utcnow() + _dt.timedelta(
+                          seconds=settings.PAYMENT_EVENT_BACKOFF_SECONDS * 2 ** (attempts - 1))}
+        await db.rollback()
+
+        await db.execute(
+            update(payment_event_models.PaymentEvent)
+                .where(payment_event_models.PaymentEvent.id == event_id)
+                .values(last_updated=_dt.datetime.utcnow(), **values)
+                .execution_options(synchronize_session=False))
+        await db.commit()
+        return True
+
+
+async def _get_organization(organization_id: str, db: AsyncSession,
                             user: users_schemas.User):
-    organization = (
-        db.query(organisation_models.Organization)
+    organization = (await db.execute(
+        select(organisation_models.Organization)
             .filter_by(creator=user.id)
-            .filter(organisation_models.Organization.id == organization_id)
-            .first()
-    )
+            .where(organisation_models.Organization.id == organization_id)
+    )).scalars().first()
 
     if organization is None:
         raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Organization does not exist")
@@ -377,48 +727,71 @@ async def _get_organization(organization_id: str, db: _orm.Session,
     return organization
 
 
-async def _get_credit_wallet_conversion(currency: str, db: _orm.Session):
-    conversion = (
-        db.query(credit_wallet_conversion_models.CreditWalletConversion)
+async def _get_credit_wallet_conversion(currency: str, db: AsyncSession):
+    conversion = (await db.execute(
+        select(credit_wallet_conversion_models.CreditWalletConversion)
             .filter_by(currency_code=currency)
-            .first()
-    )
+    )).scalars().first()
 
     return conversion
 
 
-async def _get_wallet(organization_id: str, currency: str, db: _orm.Session):
-    wallet = db.query(wallet_models.Wallet).filter_by(organization_id=organization_id).filter_by(
-        currency_code=currency).first()
+async def _get_wallet(organization_id: str, currency: str, db: AsyncSession):
+    wallet = (await db.execute(select(wallet_models.Wallet).filter_by(organization_id=organization_id).filter_by(
+        currency_code=currency))).scalars().first()
     if wallet is None:
         wallet = wallet_models.Wallet(id=uuid4().hex, organization_id=organization_id, balance=0,
                                       currency_code=currency,
                                       last_updated=_dt.datetime.utcnow())
 
         db.add(wallet)
-        db.commit()
-        db.refresh(wallet)
+        await db.flush()
 
     return wallet
 
 
 async def _get_credit(organization_id: str,
                       user: users_schemas.User,
-                      db: _orm.Session):
+                      db: AsyncSession):
     # verify if the organization exists under the user's account
 
     await _get_organization(organization_id=organization_id, user=user, db=db)
 
-    credit = db.query(model.CreditWallet).filter_by(organization_id=organization_id).first()
+    credit = (await db.execute(select(model.CreditWallet).filter_by(organization_id=organization_id))).scalars().first()
     if credit is None:
         credit = model.CreditWallet(id=uuid4().hex, organization_id=organization_id, amount=0,
                                     last_updated=_dt.datetime.utcnow())
 
         db.add(credit)
-        db.commit()
-        db.refresh(credit)
+        await db.commit()
+        await db.refresh(credit)
 
     return credit
 
 
+if settings.EXCHANGE_RATE_REFRESH_SECONDS > 0:
+    @app.on_event("startup")
+    @repeat_every(seconds=settings.EXCHANGE_RATE_REFRESH_SECONDS, logger=logger)
+    async def refresh_market_rates_task():
+        async with database.AsyncSessionLocal() as db:
+            await refresh_market_rates(db=db)
+
+
+if settings.CREDIT_SNAPSHOT_SECONDS > 0:
+    @app.on_event("startup")
+    @repeat_every(seconds=settings.CREDIT_SNAPSHOT_SECONDS, wait_first=True, logger=logger)
+    async def snapshot_credit_balances_task():
+        async with database.AsyncSessionLocal() as db:
+            await snapshot_credit_balances(db=db)
+
+
+if settings.PAYMENT_EVENT_POLL_SECONDS > 0:
+    @app.on_event("startup")
+    @repeat_every(seconds=settings.PAYMENT_EVENT_POLL_SECONDS, logger=logger)
+    async def process_payment_events_task():
+        # keep going while there is a backlog
+        while await process_payment_events() == settings.PAYMENT_EVENT_BATCH_SIZE:
+            pass
+
+
 add_pagination(app)
@@ -6,12 +6,14 @@ from bigfastapi.models.user_models import User
 from bigfastapi.models.customer_models import Customer
 from bigfastapi.schemas import customer_schemas, users_schemas
 from bigfastapi.models import customer_models
-from sqlalchemy.orm import Session
-from bigfastapi.db.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from bigfastapi.db.database import get_async_db, get_async_read_db
 from uuid import uuid4
 from fastapi.responses import JSONResponse
 from .auth_api import is_authenticated
-from fastapi_pagination import Page, add_pagination, paginate
+from .utils.utils import paginate_query
+from fastapi_pagination import Page, add_pagination
 import csv
 import io
 import pandas as pd
@@ -27,11 +29,10 @@ async def create_customer(
     background_tasks: BackgroundTasks,
     customer: customer_schemas.CustomerBase,
 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     # user: users_schemas.User = Depends(is_authenticated)
 ):
-    organization = db.query(Organization).filter(
-        Organization.id == customer.organization_id).first()
+    organization = await db.get(Organization, customer.organization_id)
     if not organization:
         return JSONResponse({"message": "Organization does not exist", "customer": []},
                             status_code=status.HTTP_404_NOT_FOUND)
@@ -58,7 +59,7 @@ async def create_bulk_customer(
     organization_id: str,
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     # user: users_schemas.User = Depends(is_authenticated)
 ):
 
@@ -66,8 +67,7 @@ async def create_bulk_customer(
         return JSONResponse({"message": "file must be a valid csv", "customer": []},
                             status_code=status.HTTP_406_NOT_ACCEPTABLE)
 
-    organization = db.query(Organization).filter(
-        Organization.id == organization_id).first()
+    organization = await db.get(Organization, organization_id)
     if not organization:
         return JSONResponse({"message": "Organization does not exist", "customer": []},
                             status_code=status.HTTP_404_NOT_FOUND)
@@ -99,19 +99,17 @@ async def get_customers(
     search_value: str = None,
     sorting_key: str = "date_created",
     reverse_sort: bool = True,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     # user: users_schemas.User = Depends(is_authenticated)
 ):
 
-    organization = db.query(Organization).filter(
-        Organization.id == organization_id).first()
+    organization = await db.get(Organization, organization_id)
     if not organization:
         return JSONResponse({"message": "Organization does not exist"}, status_code=status.HTTP_404_NOT_FOUND)
 
-    customers = await customer_models.fetch_customers(organization_id=organization_id, name=search_value, db=db)
-
-    customers.sort(key=lambda x: getattr(x, sorting_key, "firt_name"), reverse=reverse_sort)
-    return paginate(customers)
+    customers = customer_models.customers_query(organization_id=organization_id, name=search_value,
+                                                sorting_key=sorting_key, reverse_sort=reverse_sort)
+    return await paginate_query(db, customers)
 
 
 
@@ -121,19 +119,19 @@ async def get_customers(
          )
 async def get_customer(
     customer_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     # user: users_schemas.User = Depends(is_authenticated)
 ):
-    customer = db.query(Customer).filter(
-        Customer.customer_id == customer_id).first()
+    customer = (await db.execute(select(Customer).where(
+        Customer.customer_id == customer_id))).scalars().first()
     if not customer:
         return JSONResponse({"message": "Customer does not exist"},
                             status_code=status.HTTP_404_NOT_FOUND)
 
-    other_info = db.query(customer_models.OtherInformation).filter(
-        customer_models.OtherInformation.customer_id == customer_id)
+    other_info = await db.execute(select(customer_models.OtherInformation).where(
+        customer_models.OtherInformation.customer_id == customer_id))
 
-    list_other_info = list(map( customer_schemas.OtherInfo.from_orm, other_info))
+    list_other_info = list(map( customer_schemas.OtherInfo.from_orm, other_info.scalars()))
     
     setattr(customer, 'other_info', list_other_info)
     
@@ -149,17 +147,16 @@ async def update_customer(
     background_tasks: BackgroundTasks,
     customer: customer_schemas.CustomerUpdate,
     customer_id: str, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     # user: users_schemas.User = Depends(is_authenticated)
 ):
-    customer_instance = db.query(Customer).filter(
-        Customer.customer_id == customer_id).first()
+    customer_instance = (await db.execute(select(Customer).where(
+        Customer.customer_id == customer_id))).scalars().first()
     if not customer_instance:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail={"message": "Customer does not exist"})
     if customer.organization_id:
-        organization = db.query(Organization).filter(
-            Organization.id == customer.organization_id).first()
+        organization = await db.get(Organization, customer.organization_id)
         if not organization:
             return JSONResponse({"message": "Organization does not exist"}, status_code=status.HTTP_404_NOT_FOUND)
         customer_instance.organization_id = organization.id
@@ -179,18 +176,18 @@ async def update_customer(
             )
 async def soft_delete_customer(
     customer_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     # user: users_schemas.User = Depends(is_authenticated)
 ):
 
-    customer = db.query(Customer).filter(
-        Customer.customer_id == customer_id).first()
+    customer = (await db.execute(select(Customer).where(
+        Customer.customer_id == customer_id))).scalars().first()
     if not customer:
         return JSONResponse({"message": "Customer does not exist"},
                             status_code=status.HTTP_404_NOT_FOUND)
     customer.is_deleted = True
-    db.commit()
-    db.refresh(customer)
+    await db.commit()
+    await db.refresh(customer)
     return JSONResponse({"message": "Customer deleted succesfully"},
                         status_code=status.HTTP_200_OK)
 
@@ -201,22 +198,21 @@ async def soft_delete_customer(
             )
 async def soft_delete_all_customers(
     organization_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     # user: users_schemas.User = Depends(is_authenticated)
 ):
    
-    organization = db.query(Organization).filter(
-        Organization.id == organization_id).first()
+    organization = await db.get(Organization, organization_id)
     if not organization:
         return JSONResponse({"message": "Organization does not exist"},
                             status_code=status.HTTP_404_NOT_FOUND)
 
-    customers = db.query(Customer).filter_by(
-        organization_id=organization_id, is_deleted=False)
+    customers = (await db.execute(select(Customer).filter_by(
+        organization_id=organization_id, is_deleted=False))).scalars().all()
     for customer in customers:
         customer.is_deleted = True
-        db.commit()
-        db.refresh(customer)
+        await db.commit()
+        await db.refresh(customer)
         print(customer)
 
     return JSONResponse({"message": "Customers deleted succesfully"},
@@ -237,7 +233,7 @@ async def file_to_list_converter(file: UploadFile = File(...)):
     return list_customers
 
 
-async def unpack_create_customers(df_customers, organization_id: str, db: Session = Depends(get_db)):
+async def unpack_create_customers(df_customers, organization_id: str, db: AsyncSession = Depends(get_async_db)):
     posted_customers = []
     for kwargs in df_customers.to_dict(orient='records'):
         customer = Customer(**kwargs)
@@ -1,8 +1,15 @@
 # database.py
-from sqlalchemy import create_engine
+import random
+import time
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from decouple import config
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql import Select
+from decouple import config, Csv
 
 DB_TYPE = config("DB_TYPE")
 DB_NAME = config("DB_NAME")
@@ -11,26 +18,210 @@ DB_PASSWORD = config("DB_PASSWORD")
 DB_HOST = config("DB_HOST")
 DB_PORT = config("DB_PORT")
 DATABASE_URL = ""
+ASYNC_DATABASE_URL = ""
+
+# Connection pool tuning. The defaults match SQLAlchemy's own, so an
+# unconfigured deployment behaves exactly as before.
+DB_POOL_SIZE = config("DB_POOL_SIZE", default=5, cast=int)
+DB_MAX_OVERFLOW = config("DB_MAX_OVERFLOW", default=10, cast=int)
+DB_POOL_TIMEOUT = config("DB_POOL_TIMEOUT", default=30, cast=int)
+DB_POOL_RECYCLE = config("DB_POOL_RECYCLE", default=-1, cast=int)
+DB_POOL_PRE_PING = config("DB_POOL_PRE_PING", default=False, cast=bool)
+DB_STATEMENT_CACHE_SIZE = config("DB_STATEMENT_CACHE_SIZE", default=500, cast=int)
+DB_ISOLATION_LEVEL = config("DB_ISOLATION_LEVEL", default="")
+
+# Read replicas, as a comma separated list of sync database urls. Listing
+# endpoints read from them; a client's reads are kept on the primary for
+# DB_REPLICA_STICKY_SECONDS after it wrote so it sees its own writes (see
+# ReadYourWritesMiddleware).
+DB_REPLICA_URLS = config("DB_REPLICA_URLS", default="", cast=Csv())
+DB_REPLICA_STICKY_SECONDS = config("DB_REPLICA_STICKY_SECONDS", default=5, cast=float)
 
 if DB_TYPE == "mysql":
     DATABASE_URL = f"mysql+mysqldb://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    ASYNC_DATABASE_URL = f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 elif DB_TYPE == "postgresql":
     DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 else:
     DATABASE_URL = "sqlite:///./database.db"
+    ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./database.db"
 
 
-# db_engine = create_engine(DATABASE_URL, connect_args={
-#                           "check_same_thread": False})
+def engine_options():
+    """Returns the keyword arguments used to create an engine for DB_TYPE"""
+    options = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "query_cache_size": DB_STATEMENT_CACHE_SIZE,
+    }
+    if DB_ISOLATION_LEVEL != "":
+        options["isolation_level"] = DB_ISOLATION_LEVEL
 
-if DB_TYPE == "sqlite":
-     db_engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-   db_engine = create_engine(DATABASE_URL)
+    if DB_TYPE == "mysql" or DB_TYPE == "postgresql":
+        options["pool_size"] = DB_POOL_SIZE
+        options["max_overflow"] = DB_MAX_OVERFLOW
+        options["pool_timeout"] = DB_POOL_TIMEOUT
+    else:
+        options["connect_args"] = {"check_same_thread": False}
+
+    return options
+
+
+db_engine = create_engine(DATABASE_URL, **engine_options())
 
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
 
+# The async engine has its own pool, sized from the same settings. Objects
+# are not expired on commit because an AsyncSession cannot lazy load them
+# back when a handler returns them after committing.
+async_db_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options())
+
+AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                 bind=async_db_engine, class_=AsyncSession)
+
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_url(url):
+    """Returns the async driver equivalent of a sync database url"""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+replica_engines = [create_engine(url, **engine_options()) for url in DB_REPLICA_URLS]
+async_replica_engines = [create_async_engine(async_url(url), **engine_options())
+                         for url in DB_REPLICA_URLS]
+
+LAST_WRITE_COOKIE = "db_last_write"
+LAST_WRITE_HEADER = "x-db-last-write"
+
+# the time of the current client's last write, set per request by ReadYourWritesMiddleware
+_client_writes = ContextVar("client_writes", default=None)
+
+
+class ClientWrites:
+    """The time of a client's last write, as a unix timestamp"""
+
+    def __init__(self, last_write: float = 0.0):
+        self.last_write = last_write
+        self.wrote = False
+
+
+def mark_primary_write():
+    """Records that the current client just wrote to the primary"""
+    client_writes = _client_writes.get()
+    if client_writes is not None:
+        client_writes.last_write = time.time()
+        client_writes.wrote = True
+
+
+def read_from_primary():
+    """Returns True while replicas may not have caught up with the current
+    client's last write
+    """
+    client_writes = _client_writes.get()
+    if client_writes is None:
+        return False
+    return 0 <= time.time() - client_writes.last_write < DB_REPLICA_STICKY_SECONDS
+
+
+def _parse_last_write(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ReadYourWritesMiddleware:
+    """Keeps the reads of a client on the primary shortly after it wrote,
+    whichever worker serves it.
+
+    The time of the last write is sent back in a cookie and a header, and
+    read from either on the client's next requests.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        last_write = _parse_last_write(headers.get(LAST_WRITE_HEADER.encode(), b"").decode("latin-1"))
+        cookies = SimpleCookie(headers.get(b"cookie", b"").decode("latin-1"))
+        if LAST_WRITE_COOKIE in cookies:
+            last_write = max(last_write, _parse_last_write(cookies[LAST_WRITE_COOKIE].value))
+        client_writes = ClientWrites(last_write)
+
+        async def send_with_last_write(message):
+            if message["type"] == "http.response.start" and client_writes.wrote:
+                value = "%.3f" % client_writes.last_write
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (LAST_WRITE_HEADER.encode(), value.encode()),
+                    (b"set-cookie", ("%s=%s; Max-Age=%d; Path=/; HttpOnly; SameSite=Lax" % (
+                        LAST_WRITE_COOKIE, value, int(DB_REPLICA_STICKY_SECONDS) + 1)).encode()),
+                ]}
+            await send(message)
+
+        token = _client_writes.set(client_writes)
+        try:
+            await self.app(scope, receive, send_with_last_write)
+        finally:
+            _client_writes.reset(token)
+
+
+class RoutingSession(Session):
+    """A session that sends plain SELECTs to a random read replica.
+
+    Writes, flushes and anything that is not a SELECT go to the session's
+    own bind, as do a client's reads shortly after it wrote (see
+    read_from_primary).
+    """
+
+    def __init__(self, replicas=(), **kwargs):
+        super().__init__(**kwargs)
+        self.replicas = list(replicas)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (self.replicas and not self._flushing and isinstance(clause, Select)
+                and not (self.new or self.dirty or self.deleted)
+                and not read_from_primary()):
+            return random.choice(self.replicas)
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+@event.listens_for(Session, "after_flush")
+def _flushed(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _executed(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _committed(session):
+    if session.info.pop("wrote", False):
+        mark_primary_write()
+
+
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine,
+                                class_=RoutingSession, replicas=replica_engines)
+
+AsyncReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                     bind=async_db_engine, class_=AsyncSession,
+                                     sync_session_class=RoutingSession,
+                                     replicas=[engine.sync_engine for engine in async_replica_engines])
+
 Base = declarative_base()
 
 
@@ -44,3 +235,51 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_read_db():
+    """Like get_db, but SELECTs may be served by a read replica"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    """Like get_async_db, but SELECTs may be served by a read replica"""
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+def pool_status(engine=db_engine):
+    """Returns the current usage of an engine's connection pool.
+
+    Pools that do not keep connections around (sqlite uses one) only
+    report their class name.
+    """
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+
+    if hasattr(pool, "checkedout"):
+        size = pool.size()
+        checked_out = pool.checkedout()
+        # overflow() starts at -size and counts up as connections are opened
+        overflow = max(pool.overflow(), 0)
+        max_overflow = getattr(pool, "_max_overflow", 0)
+        status.update({
+            "size": size,
+            "checked_in": pool.checkedin(),
+            "checked_out": checked_out,
+            "overflow": overflow,
+            "max_overflow": max_overflow,
+            "available": max(size + max_overflow - checked_out, 0),
+            "timeout": getattr(pool, "_timeout", None),
+        })
+
+    return status
@@ -1,21 +1,39 @@
 from .models import email_models
-from .schemas import email_schema
+from .schemas import email_schema, users_schemas
 from typing import Optional
 from uuid import uuid4
-from datetime import datetime
-from fastapi import APIRouter, BackgroundTasks, Response
-from bigfastapi.db.database import get_db
+from datetime import datetime, timedelta
+from fastapi import APIRouter, BackgroundTasks, File, Response, UploadFile, status
+from bigfastapi.db import database
+from bigfastapi.db.database import get_async_db, get_db
+from bigfastapi.models.customer_models import Customer
+from bigfastapi.models.organisation_models import Organization, is_organization_member
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import BackgroundTasks
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
-from pydantic import BaseModel
+from fastapi_utils.tasks import repeat_every
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, EmailStr
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+import aiosmtplib
+import asyncio
+import codecs
+import csv
 import fastapi
+import itertools
+import jinja2
+import json
+import logging
 import sqlalchemy.orm as orm
-from bigfastapi.utils import settings
-import time
+from bigfastapi.utils import mail_sender, settings, templates
+from bigfastapi.utils.scheduler import scheduler, utc
+from .auth_api import is_authenticated
 import os
 
 app = APIRouter(tags=["Transactional Emails 📧"])
 
+logger = logging.getLogger(__name__)
+
 
 class ResponseModel(BaseModel):
     message: str
@@ -178,20 +196,93 @@ def schedule_marketing_email(
         object (dict): a message
     """
 
-    if schedule_at <= datetime.now():
+    if utc(schedule_at) <= datetime.utcnow():
         raise fastapi.HTTPException(
             status_code=404, detail="The scheduled date/time can't be less than or equal to the current date/time")
 
-    scheduled_time = schedule_at - datetime.now()
-    scheduled_time_in_secs = int(round(scheduled_time.total_seconds()))
-    time.sleep(scheduled_time_in_secs)
-    send_email(email_details=email_details,
-               background_tasks=background_tasks, template=template, db=db)
+    scheduler.schedule("marketing_email", {"email_details": email_details.dict(), "template": template},
+                       run_at=schedule_at, db=db)
+    db.commit()
+    scheduler.wake(schedule_at)
     return {"message": "Scheduled Marketing Email will be sent in the background"}
 
 
+@app.post("/email/campaigns", response_model=email_schema.Campaign, status_code=status.HTTP_201_CREATED)
+async def create_campaign(
+    campaign: email_schema.CampaignCreate,
+    user: users_schemas.User = fastapi.Depends(is_authenticated),
+    db: AsyncSession = fastapi.Depends(get_async_db)
+):
+    """An endpoint for sending a marketing email to every customer of an
+    organization, or to the recipients of csv uploads
+
+    Returns:
+        object (dict): the campaign and its recipients by delivery status
+    """
+    await _get_member_organization(organization_id=campaign.organization_id, user=user, db=db)
+
+    template_body = {"title": campaign.title, "body": campaign.body, "date_created": datetime.now(),
+                     **campaign.template_body}
+    email_campaign = email_models.EmailCampaign(id=uuid4().hex, organization_id=campaign.organization_id,
+                                                subject=campaign.subject, template=campaign.template,
+                                                template_body=json.dumps(template_body, default=str),
+                                                date_created=datetime.utcnow())
+    db.add(email_campaign)
+    # the scheduler queues the customers, a chunk per job
+    if campaign.source == email_schema.CampaignSource.customers:
+        scheduler.schedule("campaign_customers", {"campaign_id": email_campaign.id}, run_at=datetime.now(), db=db)
+    await db.commit()
+    scheduler.wake()
+    return await _campaign_progress(campaign=email_campaign, db=db)
+
+
+@app.post("/email/campaigns/{campaign_id}/recipients", response_model=email_schema.Campaign)
+async def add_campaign_recipients(
+    campaign_id: str,
+    file: UploadFile = File(...),
+    user: users_schemas.User = fastapi.Depends(is_authenticated),
+    db: AsyncSession = fastapi.Depends(get_async_db)
+):
+    """An endpoint for adding the recipients of a csv file to a campaign. The
+    file needs an email column, other columns are passed to the template
+
+    Returns:
+        object (dict): the campaign and its recipients by delivery status
+    """
+    campaign = await _get_campaign(campaign_id=campaign_id, user=user, db=db)
+    # the upload is read and parsed off the event loop, a chunk at a time
+    reader = csv.DictReader(codecs.iterdecode(file.file, "utf-8-sig"))
+    if "email" not in (await run_in_threadpool(lambda: reader.fieldnames) or []):
+        raise fastapi.HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                                    detail="A required field email is missing")
+
+    recipients = (row for row in reader if _valid_email(row["email"]))
+    while True:
+        chunk = await run_in_threadpool(list, itertools.islice(recipients, settings.EMAIL_CAMPAIGN_CHUNK_SIZE))
+        if not chunk:
+            break
+        await _queue_campaign_recipients(campaign=campaign, recipients=chunk, db=db)
+        await db.commit()
+    return await _campaign_progress(campaign=campaign, db=db)
+
+
+@app.get("/email/campaigns/{campaign_id}", response_model=email_schema.Campaign)
+async def get_campaign(
+    campaign_id: str,
+    user: users_schemas.User = fastapi.Depends(is_authenticated),
+    db: AsyncSession = fastapi.Depends(get_async_db)
+):
+    """An endpoint for following the delivery of a campaign
+
+    Returns:
+        object (dict): the campaign and its recipients by delivery status
+    """
+    campaign = await _get_campaign(campaign_id=campaign_id, user=user, db=db)
+    return await _campaign_progress(campaign=campaign, db=db)
+
+
 #=================================== EMAIL SERVICES =================================#
-conf = ConnectionConfig(
+conf = templates.TemplateConfig(
     MAIL_USERNAME=settings.MAIL_USERNAME,
     MAIL_PASSWORD=settings.MAIL_PASSWORD,
     MAIL_FROM=settings.MAIL_FROM,
@@ -218,122 +309,308 @@ def send_invite_email(
 
 
 def send_email(email_details: email_schema.Email, background_tasks: BackgroundTasks, template: str, db: orm.Session):
+    # the outbox worker sends the email, background_tasks is no longer used
+    db.add_all(_email_rows(email_details=email_details, template=template))
+    db.commit()
+
+
+@scheduler.handler("marketing_email")
+async def _send_scheduled_email(payload: dict, db):
+    db.add_all(_email_rows(email_details=email_schema.Email(**payload["email_details"]),
+                           template=payload["template"]))
+
+
+def _email_rows(email_details: email_schema.Email, template: str):
+    """Returns the archived email and the outbox email for email_details"""
     date_created = datetime.now()
-    message = MessageSchema(
-        subject=email_details.subject,
-        recipients=email_details.recipient,
-        template_body={
-            "title": email_details.title,
-            "first_name": email_details.first_name,
-            "body": email_details.body,
-            "date_created": date_created,
-            "amount": email_details.amount,
-            "due_date": email_details.due_date,
-            "link": email_details.link,
-            "extra_link": email_details.extra_link,
-            "invoice_id": email_details.invoice_id,
-            "description": email_details.description,
-            "receipt_id": email_details.receipt_id,
-            "promo_product_name": email_details.promo_product_name,
-            "promo_product_description": email_details.promo_product_description,
-            "promo_product_price": email_details.promo_product_price,
-            "product_name": email_details.product_name,
-            "product_description": email_details.product_description,
-            "product_price": email_details.product_price,
-            "extra_product_name": email_details.extra_product_name,
-            "extra_product_description": email_details.extra_product_description,
-            "extra_product_price": email_details.extra_product_price,
-            "sender_address": email_details.sender_address,
-            "sender_city": email_details.sender_city,
-            "sender_state": email_details.sender_state,
-        },
-        subtype="html",
-    )
+    template_body = {
+        "title": email_details.title,
+        "first_name": email_details.first_name,
+        "body": email_details.body,
+        "date_created": date_created,
+        "amount": email_details.amount,
+        "due_date": email_details.due_date,
+        "link": email_details.link,
+        "extra_link": email_details.extra_link,
+        "invoice_id": email_details.invoice_id,
+        "description": email_details.description,
+        "receipt_id": email_details.receipt_id,
+        "promo_product_name": email_details.promo_product_name,
+        "promo_product_description": email_details.promo_product_description,
+        "promo_product_price": email_details.promo_product_price,
+        "product_name": email_details.product_name,
+        "product_description": email_details.product_description,
+        "product_price": email_details.product_price,
+        "extra_product_name": email_details.extra_product_name,
+        "extra_product_description": email_details.extra_product_description,
+        "extra_product_price": email_details.extra_product_price,
+        "sender_address": email_details.sender_address,
+        "sender_city": email_details.sender_city,
+        "sender_state": email_details.sender_state,
+    }
     email = email_models.Email(
         id=uuid4().hex,
         subject=email_details.subject,
-        recipient=email_details.recipient,
-        title=email_details.title,
-        first_name=email_details.first_name,
-        body=email_details.body,
-        amount=email_details.amount,
-        due_date=email_details.due_date,
-        link=email_details.link,
-        extra_link=email_details.extra_link,
-        invoice_id=email_details.invoice_id,
-        receipt_id=email_details.receipt_id,
-        description=email_details.description,
-        promo_product_name=email_details.promo_product_name,
-        promo_product_description=email_details.promo_product_description,
-        promo_product_price=email_details.promo_product_price,
-        product_name=email_details.product_name,
-        product_description=email_details.product_description,
-        product_price=email_details.product_price,
-        extra_product_name=email_details.extra_product_name,
-        extra_product_description=email_details.extra_product_description,
-        extra_product_price=email_details.extra_product_price,
-        sender_address=email_details.sender_address,
-        sender_city=email_details.sender_city,
-        sender_state=email_details.sender_state,
+        recipient_hash=email_models.recipient_hash(email_details.recipient),
+        template=template,
         date_created=date_created,
+        payload=email_models.encode_payload({"recipient": email_details.recipient, **template_body}),
     )
-    db.add(email)
-    db.commit()
-    db.refresh(email)
-    fm = FastMail(conf)
-    background_tasks.add_task(fm.send_message, message, template_name=template)
+    return [email, _outbox_email(subject=email_details.subject, recipients=email_details.recipient,
+                                 template=template, template_body=template_body, email_id=email.id)]
 
 
 async def send_email_user(email: str, user, template, title: str, path="", code=""):
     if path == "" and code != "":
-        message = MessageSchema(
-            subject=title,
-            recipients=[email],
-            template_body={
-                "title": title,
-                "first_name": user.first_name,
-                "code": code
-            },
-            subtype="html",
-        )
-        fm = FastMail(conf)
-
-        return await fm.send_message(message, template)
+        template_body = {
+            "title": title,
+            "first_name": user.first_name,
+            "code": code
+        }
     else:
-        message = MessageSchema(
-            subject=title,
-            recipients=[email],
-            template_body={
-                "title": title,
-                "first_name": user.first_name,
-                "path": path
+        template_body = {
+            "title": title,
+            "first_name": user.first_name,
+            "path": path
 
-            },
-            subtype="html",
-        )
-        fm = FastMail(conf)
+        }
 
-        return await fm.send_message(message, template)
+    await _queue_email(subject=title, recipients=[email], template=template, template_body=template_body)
 
 
 async def send_email_debts(email: str, user, template, title: str, amount=int, due_date="", description="", date="", invoice_id=str, email_message="", business_name=""):
 
-    message = MessageSchema(
-        subject=title,
-        recipients=[email],
-        template_body={
-            "title": title,
-            "first_name": user.first_name,
-            "amount": amount,
-            "due_date": due_date,
-            "description": description,
-            "date": date,
-            "invoice_id": invoice_id,
-            "email_message": email_message,
-            "business_name": business_name
-        },
-        subtype="html",
-    )
-    fm = FastMail(conf)
+    template_body = {
+        "title": title,
+        "first_name": user.first_name,
+        "amount": amount,
+        "due_date": due_date,
+        "description": description,
+        "date": date,
+        "invoice_id": invoice_id,
+        "email_message": email_message,
+        "business_name": business_name
+    }
+
+    await _queue_email(subject=title, recipients=[email], template=template, template_body=template_body)
+
+
+def _outbox_email(subject: str, recipients: list, template: str, template_body: dict, email_id: str = None):
+    return email_models.OutboxEmail(id=uuid4().hex, email_id=email_id, subject=subject,
+                                    recipients=json.dumps(recipients), template=template,
+                                    template_body=json.dumps(template_body, default=str),
+                                    status="pending", attempts=0, next_attempt_at=datetime.utcnow(),
+                                    date_created=datetime.utcnow())
+
+
+async def _queue_email(subject: str, recipients: list, template: str, template_body: dict):
+    async with database.AsyncSessionLocal() as db:
+        db.add(_outbox_email(subject=subject, recipients=recipients, template=template,
+                             template_body=template_body))
+        await db.commit()
+
+
+async def _get_member_organization(organization_id: str, user: users_schemas.User, db: AsyncSession):
+    organization = await db.get(Organization, organization_id)
+    if organization is None:
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Organization does not exist")
+    if not await is_organization_member(organization, user_id=user.id, db=db):
+        raise fastapi.HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                    detail="Only the members of an organization can run its campaigns")
+    return organization
+
+
+async def _get_campaign(campaign_id: str, user: users_schemas.User, db: AsyncSession):
+    campaign = await db.get(email_models.EmailCampaign, campaign_id)
+    if campaign is None:
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campaign does not exist")
+    await _get_member_organization(organization_id=campaign.organization_id, user=user, db=db)
+    return campaign
+
+
+async def _campaign_progress(campaign: email_models.EmailCampaign, db: AsyncSession):
+    counts = await db.execute(
+        select(email_models.CampaignRecipient.status, func.count())
+            .where(email_models.CampaignRecipient.campaign_id == campaign.id)
+            .group_by(email_models.CampaignRecipient.status))
+    progress = email_schema.Campaign.from_orm(campaign)
+    progress.recipients = dict(counts.all())
+    return progress
+
+
+def _valid_email(address: str):
+    try:
+        EmailStr.validate(address)
+    except Exception:
+        return False
+    return True
+
+
+@scheduler.handler("campaign_customers")
+async def _queue_customers(payload: dict, db: AsyncSession):
+    """Queues the campaign for a chunk of the customers of its organization,
+    after the customer id payload["after"], and schedules the next chunk
+    """
+    campaign = await db.get(email_models.EmailCampaign, payload["campaign_id"])
+    query = (select(Customer.id, Customer.email, Customer.first_name, Customer.last_name)
+             .where(Customer.organization_id == campaign.organization_id)
+             .where(Customer.is_deleted == False)
+             .order_by(Customer.id)
+             .limit(settings.EMAIL_CAMPAIGN_CHUNK_SIZE))
+    if payload.get("after") is not None:
+        query = query.where(Customer.id > payload["after"])
+    customers = (await db.execute(query)).all()
+
+    await _queue_campaign_recipients(
+        campaign=campaign, db=db,
+        recipients=[{"email": customer.email, "first_name": customer.first_name,
+                     "last_name": customer.last_name}
+                    for customer in customers if customer.email and _valid_email(customer.email)])
+    if len(customers) == settings.EMAIL_CAMPAIGN_CHUNK_SIZE:
+        scheduler.schedule("campaign_customers", {**payload, "after": customers[-1].id},
+                           run_at=datetime.now(), db=db)
+
+
+async def _queue_campaign_recipients(campaign: email_models.EmailCampaign, recipients: list, db: AsyncSession):
+    """Adds an outbox email and a delivery status row for each recipient,
+    without committing. Each recipient's values are passed to the template.
+    """
+    if not recipients:
+        return
+    now = datetime.utcnow()
+    outbox_rows, recipient_rows = [], []
+    for recipient in recipients:
+        outbox_id = uuid4().hex
+        outbox_rows.append({"id": outbox_id, "campaign_id": campaign.id, "recipients": json.dumps([recipient["email"]]),
+                            "template_body": json.dumps(recipient), "status": "pending", "attempts": 0,
+                            "next_attempt_at": now, "date_created": now})
+        recipient_rows.append({"id": outbox_id, "campaign_id": campaign.id, "email": recipient["email"],
+                               "status": "pending"})
+    await db.execute(insert(email_models.CampaignRecipient), recipient_rows)
+    await db.execute(insert(email_models.OutboxEmail), outbox_rows)
+
+
+smtp_pool = mail_sender.SMTPPool(conf, size=settings.EMAIL_SMTP_CONNECTIONS, rate=settings.EMAIL_RATE_PER_SECOND)
+app.on_event("shutdown")(smtp_pool.close)
+
+# rendering is CPU work, kept off the event loop
+_render_executor = ThreadPoolExecutor(max_workers=settings.EMAIL_RENDER_WORKERS, thread_name_prefix="email-render")
 
-    return await fm.send_message(message, template)
+
+def _render(template: str, template_body: dict):
+    return conf.template_engine().get_template(template).render(**template_body)
+
+
+async def send_outbox_emails():
+    """Claims a batch of due outbox emails and sends them over the pooled
+    SMTP connections.
+
+    Returns the number of emails claimed.
+    """
+    claim_id = uuid4().hex
+    now = datetime.utcnow()
+    async with database.AsyncSessionLocal() as db:
+        due_ids = (await db.execute(
+            select(email_models.OutboxEmail.id)
+                .where(email_models.OutboxEmail.status.in_(["pending", "sending"]))
+                .where(email_models.OutboxEmail.next_attempt_at <= now)
+                .order_by(email_models.OutboxEmail.next_attempt_at)
+                .limit(settings.EMAIL_OUTBOX_BATCH_SIZE))).scalars().all()
+        if not due_ids:
+            return 0
+
+        # claim the batch, less any email another worker claimed meanwhile
+        await db.execute(
+            update(email_models.OutboxEmail)
+                .where(email_models.OutboxEmail.id.in_(due_ids))
+                .where(email_models.OutboxEmail.status.in_(["pending", "sending"]))
+                .where(email_models.OutboxEmail.next_attempt_at <= now)
+                .values(status="sending", claim_id=claim_id, attempts=email_models.OutboxEmail.attempts + 1,
+                        next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS))
+                .execution_options(synchronize_session=False))
+        await db.commit()
+        emails = (await db.execute(
+            select(email_models.OutboxEmail).filter_by(claim_id=claim_id, status="sending"))).scalars().all()
+
+        campaign_ids = {email.campaign_id for email in emails if email.campaign_id is not None}
+        campaigns = {}
+        if campaign_ids:
+            campaigns = {campaign.id: campaign for campaign in (await db.execute(
+                select(email_models.EmailCampaign)
+                    .where(email_models.EmailCampaign.id.in_(campaign_ids)))).scalars()}
+
+        errors = await asyncio.gather(*(_send_outbox_email(email, campaign=campaigns.get(email.campaign_id))
+                                        for email in emails))
+
+        sent_ids = [email.id for email, error in zip(emails, errors) if error is None]
+        if sent_ids:
+            await db.execute(
+                update(email_models.OutboxEmail)
+                    .where(email_models.OutboxEmail.id.in_(sent_ids))
+                    # a worker whose lease ran out must not touch emails claimed again since
+                    .where(email_models.OutboxEmail.claim_id == claim_id)
+                    .values(status="sent", last_error=None, date_sent=datetime.utcnow())
+                    .execution_options(synchronize_session=False))
+        dead_ids = []
+        for email, error in zip(emails, errors):
+            if error is None:
+                continue
+            permanent = isinstance(error, (aiosmtplib.SMTPRecipientsRefused, jinja2.TemplateError))
+            dead = permanent or email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+            if dead:
+                dead_ids.append(email.id)
+            retry_at = datetime.utcnow() + timedelta(
+                seconds=settings.EMAIL_OUTBOX_BACKOFF_SECONDS * 2 ** (email.attempts - 1))
+            await db.execute(
+                update(email_models.OutboxEmail)
+                    .where(email_models.OutboxEmail.id == email.id)
+                    .where(email_models.OutboxEmail.claim_id == claim_id)
+                    .values(status="dead" if dead else "pending", last_error=repr(error), next_attempt_at=retry_at)
+                    .execution_options(synchronize_session=False))
+
+        if campaign_ids:
+            for delivery_status, ids in (("sent", sent_ids), ("dead", dead_ids)):
+                if ids:
+                    await db.execute(
+                        update(email_models.CampaignRecipient)
+                            .where(email_models.CampaignRecipient.id.in_(ids))
+                            .values(status=delivery_status)
+                            .execution_options(synchronize_session=False))
+        await db.commit()
+        return len(due_ids)
+
+
+async def _send_outbox_email(email: email_models.OutboxEmail, campaign: email_models.EmailCampaign = None):
+    """Sends an outbox email, returning the exception if it failed"""
+    subject, template, template_body = email.subject, email.template, json.loads(email.template_body)
+    if campaign is not None:
+        subject, template = campaign.subject, campaign.template
+        template_body = {**json.loads(campaign.template_body), **template_body}
+    try:
+        html = await asyncio.get_running_loop().run_in_executor(_render_executor, _render, template, template_body)
+        message = mail_sender.build_message(
+            smtp_pool.config, subject=subject, recipients=json.loads(email.recipients), html=html)
+        await smtp_pool.send(message)
+    except Exception as e:
+        logger.warning("Could not send outbox email %s: %r", email.id, e)
+        return e
+    return None
+
+
+if settings.EMAIL_OUTBOX_POLL_SECONDS > 0:
+    @app.on_event("startup")
+    @repeat_every(seconds=settings.EMAIL_OUTBOX_POLL_SECONDS, logger=logger)
+    async def send_outbox_emails_task():
+        # keep going while there is a backlog
+        while await send_outbox_emails() == settings.EMAIL_OUTBOX_BATCH_SIZE:
+            pass
+
+
+@app.on_event("startup")
+def precompile_email_templates():
+    templates.precompile(conf.TEMPLATE_FOLDER)
+
+
+if settings.SCHEDULER_MAX_SLEEP_SECONDS > 0:
+    app.on_event("startup")(scheduler.start)
+    app.on_event("shutdown")(scheduler.stop)
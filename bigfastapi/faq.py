@@ -8,7 +8,7 @@ from .models import faq_models
 from .schemas import faq_schemas
 from .auth_api import is_authenticated
 from .schemas import users_schemas
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_db, get_read_db
 from fastapi.responses import JSONResponse
 from bigfastapi.utils.utils import generate_short_id
 
@@ -44,7 +44,7 @@ def create_faq(
 
 
 @app.get('/support/faqs', response_model=List[faq_schemas.FaqInDB])
-def get_faqs(db: orm.Session = fastapi.Depends(get_db)):
+def get_faqs(db: orm.Session = fastapi.Depends(get_read_db)):
 
     """model for support and faqs
     
@@ -12,7 +12,6 @@ from fastapi import Depends, APIRouter
 from fastapi import HTTPException
 from fastapi import status
 from fastapi.security import OAuth2PasswordBearer
-import passlib.hash as _hash
 from authlib.integrations.starlette_client import OAuth
 from authlib.integrations.starlette_client import OAuthError
 from fastapi import FastAPI
@@ -21,9 +20,11 @@ from fastapi import Request
 from fastapi import status
 from starlette.config import Config
 from starlette.middleware.sessions import SessionMiddleware
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_async_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from bigfastapi.auth_api import create_access_token
-from bigfastapi.utils import settings
+from bigfastapi.utils import settings, passwords
 from starlette.responses import RedirectResponse, HTMLResponse
 import random
 import string
@@ -70,11 +71,11 @@ async def login(request: Request):
 
 
 @app.get('/google/token')
-async def auth(request: Request, db: orm.Session = fastapi.Depends(get_db)):
+async def auth(request: Request, db: AsyncSession = fastapi.Depends(get_async_db)):
 
     access_token = await oauth.google.authorize_access_token(request)
     user_data = await oauth.google.parse_id_token(request, access_token)
-    check_user = valid_email_from_db(user_data['email'], db)
+    check_user = await valid_email_from_db(user_data['email'], db)
     
     if check_user:
         user_id = str(check_user.id)
@@ -89,7 +90,7 @@ async def auth(request: Request, db: orm.Session = fastapi.Depends(get_db)):
     n= str(ran)
     
     user_obj = user_models.User(
-        id = uuid4().hex, email=user_data.email, password=_hash.sha256_crypt.hash(n),
+        id = uuid4().hex, email=user_data.email, password=await passwords.hash_password(n),
         first_name=user_data.given_name, last_name=user_data.family_name, phone_number=n,
         is_active=True, is_verified = True, country_code="", is_deleted=False,
         country="", state= "", google_id = "", google_image=user_data.picture,
@@ -99,8 +100,8 @@ async def auth(request: Request, db: orm.Session = fastapi.Depends(get_db)):
   
     
     db.add(user_obj)
-    db.commit()
-    db.refresh(user_obj)
+    await db.commit()
+    await db.refresh(user_obj)
 
     response = 'https://v2.customerpay.me/app/google/authenticate?token=' + access_token["id_token"] + '&user_id=' + user_obj.id
     return RedirectResponse(url=response)
@@ -109,14 +110,14 @@ async def auth(request: Request, db: orm.Session = fastapi.Depends(get_db)):
 
     
 @app.post('/google/validate-token')
-async def validate_user(user: google_schema.GoogleAuth,  db: orm.Session = fastapi.Depends(get_db)):
-    user_found = db.query(user_models.User).filter(user_models.User.id == user.user_id).first()
+async def validate_user(user: google_schema.GoogleAuth,  db: AsyncSession = fastapi.Depends(get_async_db)):
+    user_found = await db.get(user_models.User, user.user_id)
     return {"data":  auth_schemas.UserCreateOut.from_orm(user_found), "access_token": user.token}
 
 
 
-def valid_email_from_db(email, db: orm.Session = fastapi.Depends(get_db)):
-    found_user = db.query(user_models.User).filter(user_models.User.email == email).first()
+async def valid_email_from_db(email, db: AsyncSession = fastapi.Depends(get_async_db)):
+    found_user = (await db.execute(select(user_models.User).where(user_models.User.email == email))).scalars().first()
     return found_user
 
 
@@ -0,0 +1,30 @@
+"""Health
+
+Reports the state of the resources the API depends on, so pools can be
+sized per worker from real numbers.
+
+Import it like this app.include_router(health, tags=["Health"])
+After that, the following endpoints will become available:
+
+ * /health/db
+
+"""
+
+from fastapi import APIRouter
+
+from bigfastapi.db import database
+
+app = APIRouter(tags=["Health"])
+
+
+@app.get("/health/db", status_code=200)
+def get_database_health():
+    """intro-This endpoint returns the usage of the database connection pools. To get this data you need to make a get request to the /health/db endpoint.
+
+    returnDesc-On sucessful request, it returns
+        returnBody- the pool class, its size and the number of checked out, overflow and available connections for both the sync and the async engine.
+    """
+    return {
+        "sync": database.pool_status(database.db_engine),
+        "async": database.pool_status(database.async_db_engine.sync_engine),
+    }
@@ -1,7 +1,7 @@
 import datetime as _dt
 from uuid import uuid4
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.schema import Column
 from sqlalchemy.types import String, DateTime, Float, Boolean
 
@@ -19,3 +19,7 @@ class Activitieslog(Base):
     action = Column(String(255), default='')
     created_at = Column(DateTime, default=_dt.datetime.now())
     is_deleted = Column(Boolean, default=False)
+
+    __table_args__ = (
+        Index("ix_activities_log_organization_id_created_at_id", "organization_id", "created_at", "id"),
+    )
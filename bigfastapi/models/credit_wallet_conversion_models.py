@@ -1,7 +1,7 @@
 from uuid import uuid4
 
 from sqlalchemy.schema import Column
-from sqlalchemy.types import String, Float
+from sqlalchemy.types import Boolean, DateTime, Float, String
 
 import bigfastapi.db.database as _database
 
@@ -11,4 +11,8 @@ class CreditWalletConversion(_database.Base):
     id = Column(String(255), primary_key=True, index=True, default=uuid4().hex)
     credit_wallet_type = Column(String(255), default='bfacredit')
     rate = Column(Float, default=0)
-    currency_code = Column(String(4))
+    currency_code = Column(String(4), unique=True)
+    # market rates are refreshed from freecurrencyapi, other rates were set
+    # by an admin and are left alone
+    is_market_rate = Column(Boolean, default=False)
+    last_updated = Column(DateTime)
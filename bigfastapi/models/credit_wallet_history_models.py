@@ -1,7 +1,7 @@
 import datetime as _dt
 from uuid import uuid4
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, event
 from sqlalchemy.schema import Column
 from sqlalchemy.types import String, DateTime, Float
 
@@ -9,9 +9,38 @@ from bigfastapi.db.database import Base
 
 
 class CreditWalletHistory(Base):
+    """The credit wallet ledger. Rows are only ever appended: credits used
+    are recorded as negative amounts."""
     __tablename__ = "credit_wallet_history"
     id = Column(String(255), primary_key=True, index=True, default=uuid4().hex)
     credit_wallet_id = Column(String(255), ForeignKey("credit_wallets.id"))
     amount = Column(Float, default=0)
     date = Column(DateTime, default=_dt.datetime.utcnow)
     reference = Column(String(255), default='')
+
+    __table_args__ = (
+        Index("ix_credit_wallet_history_wallet_id_date_id", "credit_wallet_id", "date", "id"),
+    )
+
+
+class CreditWalletSnapshot(Base):
+    """The balance of a credit wallet up to and including its history row
+    (date, history_id), so running balances are summed from the nearest
+    snapshot rather than from the first row."""
+    __tablename__ = "credit_wallet_snapshots"
+    id = Column(String(255), primary_key=True, index=True, default=lambda: uuid4().hex)
+    credit_wallet_id = Column(String(255), ForeignKey("credit_wallets.id"))
+    date = Column(DateTime)
+    history_id = Column(String(255))
+    balance = Column(Float, default=0)
+    date_created = Column(DateTime, default=_dt.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_credit_wallet_snapshots_wallet_id_date_history_id", "credit_wallet_id", "date", "history_id"),
+    )
+
+
+@event.listens_for(CreditWalletHistory, "before_update")
+@event.listens_for(CreditWalletHistory, "before_delete")
+def _append_only(mapper, connection, target):
+    raise ValueError("Credit wallet history rows cannot be changed")
@@ -5,11 +5,12 @@ from sqlalchemy.sql import func
 from bigfastapi.db.database import Base
 from uuid import uuid4
 from sqlalchemy.schema import Column
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends
 from datetime import datetime
 from bigfastapi.schemas import customer_schemas
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_async_db
 from bigfastapi.utils.utils import generate_short_id
 from typing import List
 
@@ -53,12 +54,12 @@ class OtherInformation(Base):
 
 async def fetch_customers(organization_id: str,
                           name: str = None,
-                          db: Session = Depends(get_db)):
-    customers = db.query(Customer).filter(
-        Customer.organization_id == organization_id).filter(
+                          db: AsyncSession = Depends(get_async_db)):
+    customers = await db.execute(select(Customer).where(
+        Customer.organization_id == organization_id).where(
         Customer.is_deleted == False
-    )
-    customer_list = list(map(customer_schemas.Customer.from_orm, customers))
+    ))
+    customer_list = list(map(customer_schemas.Customer.from_orm, customers.scalars()))
     if not name:
         return customer_list
     found_customers = []
@@ -68,10 +69,29 @@ async def fetch_customers(organization_id: str,
     return found_customers
 
 
+def customers_query(organization_id: str,
+                    name: str = None,
+                    sorting_key: str = "date_created",
+                    reverse_sort: bool = True):
+    query = select(Customer).where(
+        Customer.organization_id == organization_id).where(
+        Customer.is_deleted == False
+    )
+    if name:
+        query = query.where(or_(
+            func.lower(Customer.first_name).contains(name.lower(), autoescape=True),
+            func.lower(Customer.last_name).contains(name.lower(), autoescape=True)))
+
+    sort_column = Customer.__table__.columns.get(sorting_key, Customer.first_name)
+    if reverse_sort:
+        sort_column = sort_column.desc()
+    return query.order_by(sort_column, Customer.customer_id)
+
+
 async def add_customer(
     customer: customer_schemas.CustomerBase,
     organization_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
     ):
     customer_instance = Customer(
         id=uuid4().hex,
@@ -96,15 +116,15 @@ async def add_customer(
         last_updated=datetime.now()
     )
     db.add(customer_instance)
-    db.commit()
-    db.refresh(customer_instance)
+    await db.commit()
+    await db.refresh(customer_instance)
     return customer_schemas.Customer.from_orm(customer_instance)
 
 
 async def add_other_info(
     list_other_info: List[customer_schemas.OtherInfo],
     customer_id:str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
     ):
     res_obj = []
     for other_info in list_other_info:
@@ -115,8 +135,8 @@ async def add_other_info(
             value = other_info.value
         )
         db.add(other_info_instance)
-        db.commit()
-        db.refresh(other_info_instance)
+        await db.commit()
+        await db.refresh(other_info_instance)
         res_obj.append(other_info_instance)
 
     return list(map(customer_schemas.OtherInfo.from_orm, res_obj))
@@ -125,7 +145,7 @@ async def add_other_info(
 async def put_customer(
     customer: customer_schemas.CustomerUpdate,
     customer_instance,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     if customer.first_name:
         customer_instance.first_name = customer.first_name
@@ -158,12 +178,12 @@ async def put_customer(
     if customer.country_code:
         customer_instance.region = customer.country_code
     customer_instance.last_updated = datetime.now()
-    db.commit()
-    db.refresh(customer_instance)
+    await db.commit()
+    await db.refresh(customer_instance)
     return customer_schemas.Customer.from_orm(customer_instance)
 
 
-async def get_customer_by_id(customer_id: str, organization_id: str, db: Session):
-    customer = db.query(Customer).filter(
-        Customer.customer_id == customer_id and Customer.organization_id == organization_id).first()
+async def get_customer_by_id(customer_id: str, organization_id: str, db: AsyncSession):
+    customer = (await db.execute(select(Customer).where(
+        Customer.customer_id == customer_id and Customer.organization_id == organization_id))).scalars().first()
     return customer
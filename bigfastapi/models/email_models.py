@@ -1,38 +1,108 @@
 import datetime as dt
+import hashlib
+import json
+import zlib
 
+from sqlalchemy import Index
 from sqlalchemy.schema import Column
-from sqlalchemy.types import String, DateTime, Text, PickleType
-from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy.types import String, DateTime, Integer, LargeBinary, Text
 from uuid import uuid4
 import bigfastapi.db.database as database
 
 
+def recipient_hash(recipients: list):
+    """Returns the hash archived emails to recipients are looked up by"""
+    normalized = ",".join(sorted(recipient.strip().lower() for recipient in recipients))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def encode_payload(details: dict):
+    """Compresses the values of an archived email, leaving out empty ones"""
+    details = {key: value for key, value in details.items() if value is not None}
+    return zlib.compress(json.dumps(details, default=str, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_payload(payload: bytes):
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
 class Email(database.Base):
+    """An archived email: a small header row, with the recipients and the
+    values given to the template compressed into payload.
+    """
     __tablename__ = "email"
-    id = Column(String(255), primary_key=True, index=True, default=uuid4().hex)
-    subject = Column(String(255), index=True)
-    recipient = Column(MutableList.as_mutable(PickleType), default=[])
-    title = Column(String(255), index=True)
-    first_name = Column(String(255), index=True)
-    body = Column(String(255), index=True, nullable=True, default=None)
-    amount = Column(String(255), index=True, nullable=True, default=None)
-    due_date = Column(String(255), index=True, nullable=True, default=None)
-    link = Column(String(255), index=True, nullable=True, default=None)
-    extra_link = Column(String(255), index=True, nullable=True, default=None)
-    receipt_id = Column(String(255), index=True, nullable=True, default=None)
-    invoice_id = Column(String(255), index=True, nullable=True, default=None)
-    description = Column(String(255), index=True, nullable=True, default=None)
-    sender = Column(String(255), index=True, nullable=True, default=None)
-    promo_product_name = Column(String(255), index=True, nullable=True, default=None)
-    promo_product_description = Column(String(255), index=True, nullable=True, default=None)
-    promo_product_price = Column(String(255), index=True, nullable=True, default=None)
-    product_name = Column(String(255), index=True, nullable=True, default=None)
-    product_description = Column(String(255), index=True, nullable=True, default=None)
-    product_price = Column(String(255), index=True, nullable=True, default=None)
-    extra_product_name = Column(String(255), index=True, nullable=True, default=None)
-    extra_product_description = Column(String(255), index=True, nullable=True, default=None)
-    extra_product_price = Column(String(255), index=True, nullable=True, default=None)
-    sender_address = Column(String(255), index=True)
-    sender_city = Column(String(255), index=True)
-    sender_state = Column(String(255), index=True)
+    id = Column(String(255), primary_key=True, default=lambda: uuid4().hex)
+    subject = Column(String(255))
+    recipient_hash = Column(String(64), index=True)
+    template = Column(String(255))
+    date_created = Column(DateTime, index=True, default=dt.datetime.utcnow)
+    payload = Column(LargeBinary)
+
+    @property
+    def details(self):
+        return decode_payload(self.payload)
+
+
+class OutboxEmail(database.Base):
+    """An email waiting to be sent by the email outbox worker.
+
+    recipients and template_body are JSON. status is pending, sending, sent
+    or dead; dead emails failed EMAIL_OUTBOX_MAX_ATTEMPTS times, or cannot be
+    delivered.
+    """
+    __tablename__ = "email_outbox"
+    id = Column(String(255), primary_key=True, index=True, default=lambda: uuid4().hex)
+    email_id = Column(String(255), nullable=True)
+    subject = Column(String(255))
+    recipients = Column(Text)
+    template = Column(String(255))
+    template_body = Column(Text)
+    status = Column(String(20), default="pending")
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    # campaign emails take their subject, template and shared template
+    # values from the campaign
+    campaign_id = Column(String(255), nullable=True)
+    # the worker that claimed a sending email
+    claim_id = Column(String(255), nullable=True)
+    # when a pending email is next due, or a sending email's claim expires
+    next_attempt_at = Column(DateTime, default=dt.datetime.utcnow)
     date_created = Column(DateTime, default=dt.datetime.utcnow)
+    date_sent = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("ix_email_outbox_claim_id", "claim_id"),
+    )
+
+
+class EmailCampaign(database.Base):
+    """A marketing email sent to many recipients, each rendered separately.
+
+    template_body is JSON, holding the template values shared by every
+    recipient.
+    """
+    __tablename__ = "email_campaigns"
+    id = Column(String(255), primary_key=True, index=True, default=lambda: uuid4().hex)
+    organization_id = Column(String(255), index=True)
+    subject = Column(String(255))
+    template = Column(String(255))
+    template_body = Column(Text)
+    date_created = Column(DateTime, default=dt.datetime.utcnow)
+
+
+class CampaignRecipient(database.Base):
+    """The delivery status of a campaign email to one recipient.
+
+    id is the id of the recipient's outbox email. status is pending, sent or
+    dead.
+    """
+    __tablename__ = "email_campaign_recipients"
+    id = Column(String(32), primary_key=True)
+    campaign_id = Column(String(255))
+    email = Column(String(255))
+    status = Column(String(10), default="pending")
+
+    __table_args__ = (
+        Index("ix_email_campaign_recipients_campaign_id_status", "campaign_id", "status"),
+    )
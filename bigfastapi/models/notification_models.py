@@ -1,23 +1,64 @@
 from datetime import datetime
+from sqlalchemy import Index, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.schema import Column
-from sqlalchemy.types import String, DateTime, Boolean
+from sqlalchemy.types import String, DateTime, Boolean, Integer
 from uuid import uuid4
 import bigfastapi.db.database as database
+from sqlalchemy.ext.asyncio import AsyncSession
 from bigfastapi.schemas import users_schemas as schema
 import sqlalchemy.orm as orm
 
 
 class Notification(database.Base):
     __tablename__ = "notifications"
-    id = Column(String(255), primary_key=True, index=True, default=uuid4().hex)
-    creator = Column(String(100), index=True)
-    content = Column(String(255), index=True)
+    id = Column(String(255), primary_key=True, default=uuid4().hex)
+    creator = Column(String(100))
+    content = Column(String(255))
     has_read = Column(Boolean, default=False)
-    reference = Column(String(100), index=True)
-    recipient = Column(String(255), index=True)
+    reference = Column(String(100))
+    recipient = Column(String(255))
     date_created = Column(DateTime, default=datetime.utcnow)
     last_updated = Column(DateTime, default=datetime.utcnow)
 
+    # only the indexes the inbox and retention queries use, every insert updates them
+    __table_args__ = (
+        Index("ix_notifications_date_created_id", "date_created", "id"),
+        # a recipient's inbox, newest first, all or by read state
+        Index("ix_notifications_recipient_has_read_date_created", "recipient", "has_read", "date_created", "id"),
+        Index("ix_notifications_recipient_date_created", "recipient", "date_created", "id"),
+    )
+
+
+class ArchivedNotification(database.Base):
+    """A read notification moved out of notifications once past the TTL of
+    its type
+    """
+    __tablename__ = "notifications_archive"
+    id = Column(String(255), primary_key=True)
+    creator = Column(String(100))
+    content = Column(String(255))
+    has_read = Column(Boolean, default=True)
+    reference = Column(String(100))
+    recipient = Column(String(255))
+    date_created = Column(DateTime)
+    last_updated = Column(DateTime)
+    date_archived = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_notifications_archive_recipient_date_created", "recipient", "date_created", "id"),
+        Index("ix_notifications_archive_date_archived", "date_archived"),
+    )
+
+
+class NotificationCounter(database.Base):
+    """The number of unread notifications of a recipient, kept up to date as
+    notifications are created, read, moved and deleted
+    """
+    __tablename__ = "notification_counters"
+    recipient = Column(String(255), primary_key=True)
+    unread = Column(Integer, nullable=False, default=0)
+
 
 def get_authenticated_user_email(user: schema.User):
     return user.email
@@ -25,3 +66,51 @@ def get_authenticated_user_email(user: schema.User):
 def notification_selector(id: str, db: orm.Session):
     notification = db.query(Notification).filter(Notification.id == id).first()
     return notification
+
+
+def adjust_unread_count(recipient: str, delta: int, db: orm.Session):
+    """Adds delta to the unread count of recipient, in the caller's transaction"""
+    if delta == 0:
+        return
+    increment = (update(NotificationCounter)
+                 .where(NotificationCounter.recipient == recipient)
+                 .values(unread=NotificationCounter.unread + delta)
+                 .execution_options(synchronize_session=False))
+    if db.execute(increment).rowcount == 1:
+        return
+
+    try:
+        with db.begin_nested():
+            db.add(NotificationCounter(recipient=recipient, unread=max(delta, 0)))
+    except IntegrityError:
+        # another request created the counter first
+        db.execute(increment)
+
+
+async def increment_unread_counts(recipients: list, db: AsyncSession):
+    """Adds one to the unread count of each of the distinct recipients, in the
+    caller's transaction
+    """
+    await db.execute(update(NotificationCounter)
+                     .where(NotificationCounter.recipient.in_(recipients))
+                     .values(unread=NotificationCounter.unread + 1)
+                     .execution_options(synchronize_session=False))
+    existing = set((await db.execute(
+        select(NotificationCounter.recipient).where(NotificationCounter.recipient.in_(recipients)))).scalars())
+    missing = [recipient for recipient in recipients if recipient not in existing]
+    if not missing:
+        return
+
+    try:
+        async with db.begin_nested():
+            await db.execute(insert(NotificationCounter), [{"recipient": recipient, "unread": 1}
+                                                           for recipient in missing])
+    except IntegrityError:
+        # another request created some of the counters first
+        for recipient in missing:
+            await db.run_sync(lambda session: adjust_unread_count(recipient=recipient, delta=1, db=session))
+
+
+def unread_count(recipient: str, db: orm.Session):
+    counter = db.get(NotificationCounter, recipient)
+    return counter.unread if counter is not None else 0
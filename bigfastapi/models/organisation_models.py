@@ -15,6 +15,7 @@ from fastapi_utils.guid_type import GUID, GUID_DEFAULT_SQLITE
 
 
 from bigfastapi.db.database import Base
+from bigfastapi.models import store_user_model
 
 class Organization(Base):
     __tablename__ = "businesses"
@@ -39,6 +40,18 @@ class Organization(Base):
     date_created = Column(DateTime, default=_dt.datetime.utcnow)
     last_updated = Column(DateTime, default=_dt.datetime.utcnow)
 
+async def is_organization_member(organization: Organization, user_id: str, db):
+    """Returns True if the user owns or is a member of organization"""
+    if organization.creator == user_id:
+        return True
+    membership = (await db.execute(
+        _sql.select(store_user_model.StoreUser.id)
+            .where(store_user_model.StoreUser.store_id == organization.id)
+            .where(store_user_model.StoreUser.user_id == user_id)
+            .where(store_user_model.StoreUser.is_deleted == False)
+            .limit(1))).scalar()
+    return membership is not None
+
 class DefaultTemplates(Base):
     __tablename__ = "default_templates"
     id = Column(String(255), primary_key=True, index=True, default=uuid4().hex)
@@ -0,0 +1,35 @@
+import datetime as _dt
+from uuid import uuid4
+
+from sqlalchemy import Index, UniqueConstraint
+from sqlalchemy.schema import Column
+from sqlalchemy.types import DateTime, Integer, String, Text
+
+from bigfastapi.db.database import Base
+
+
+class PaymentEvent(Base):
+    """A payment reported by a provider, waiting to be verified and applied.
+
+    Events are stored as received and picked up by the payment event
+    workers. status is pending, processing, done or dead; dead events failed
+    PAYMENT_EVENT_MAX_ATTEMPTS times, or cannot succeed, and wait for an admin
+    to retry them.
+    """
+    __tablename__ = "payment_events"
+    id = Column(String(255), primary_key=True, index=True, default=lambda: uuid4().hex)
+    provider = Column(String(50))
+    provider_transaction_id = Column(String(255))
+    payload = Column(Text)
+    status = Column(String(20), default="pending")
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    # when a pending event is next due, or a processing event's claim expires
+    next_attempt_at = Column(DateTime, default=_dt.datetime.utcnow)
+    date_created = Column(DateTime, default=_dt.datetime.utcnow)
+    last_updated = Column(DateTime, default=_dt.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("provider", "provider_transaction_id", name="uq_payment_events_provider_transaction"),
+        Index("ix_payment_events_status_next_attempt_at", "status", "next_attempt_at"),
+    )
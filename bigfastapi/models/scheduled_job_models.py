@@ -0,0 +1,34 @@
+import datetime as _dt
+from uuid import uuid4
+
+from sqlalchemy import Index
+from sqlalchemy.schema import Column
+from sqlalchemy.types import DateTime, Integer, String, Text
+
+from bigfastapi.db.database import Base
+
+
+class ScheduledJob(Base):
+    """A job to run at run_at, picked up by the scheduler.
+
+    job_type names the scheduler handler the JSON payload is given to.
+    status is pending, running, done or dead; dead jobs failed
+    SCHEDULED_JOB_MAX_ATTEMPTS times.
+    """
+    __tablename__ = "scheduled_jobs"
+    id = Column(String(255), primary_key=True, index=True, default=lambda: uuid4().hex)
+    job_type = Column(String(100))
+    payload = Column(Text)
+    # when a pending job is due, or a running job's claim expires
+    run_at = Column(DateTime)
+    status = Column(String(20), default="pending")
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    claim_id = Column(String(255), nullable=True)
+    date_created = Column(DateTime, default=_dt.datetime.utcnow)
+    last_updated = Column(DateTime, default=_dt.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_scheduled_jobs_status_run_at", "status", "run_at"),
+        Index("ix_scheduled_jobs_claim_id", "claim_id"),
+    )
@@ -3,7 +3,6 @@ import datetime as datetime
 from sqlite3 import Timestamp
 import sqlalchemy as _sql
 import sqlalchemy.orm as _orm
-import passlib.hash as _hash
 from sqlalchemy.schema import Column
 from sqlalchemy.types import String, Integer, Enum, DateTime, Boolean, ARRAY, Text
 from sqlalchemy import ForeignKey
@@ -12,6 +11,7 @@ from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 from sqlalchemy.sql import func
 from fastapi_utils.guid_type import GUID, GUID_DEFAULT_SQLITE
 from bigfastapi.db.database import Base
+from bigfastapi.utils import passwords
 
 
 
@@ -39,5 +39,9 @@ class User(Base):
     last_updated = Column(DateTime, default=datetime.datetime.utcnow)
 
 
-    def verify_password(self, password: str):
-        return _hash.sha256_crypt.verify(password, self.password)
+    async def verify_password(self, password: str):
+        valid, new_hash = await passwords.verify_password(password, self.password)
+        # hashes made with fewer rounds than configured are upgraded on login
+        if new_hash is not None:
+            self.password = new_hash
+        return valid
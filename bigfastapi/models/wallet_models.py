@@ -1,9 +1,9 @@
 import datetime as _dt
 from uuid import uuid4
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, UniqueConstraint
 from sqlalchemy.schema import Column
-from sqlalchemy.types import String, DateTime, Float
+from sqlalchemy.types import String, DateTime, Float, Integer
 
 import bigfastapi.db.database as _database
 
@@ -16,3 +16,21 @@ class Wallet(_database.Base):
     currency_code = Column(String(4))
     balance = Column(Float, default=0)
     last_updated = Column(DateTime, default=_dt.datetime.utcnow)
+
+    # one wallet per currency, so concurrent get-or-creates cannot both create it
+    __table_args__ = (
+        UniqueConstraint("organization_id", "currency_code", name="uq_wallets_organization_id_currency_code"),
+    )
+
+
+class WalletBalanceShard(_database.Base):
+    """Part of the balance of a busy wallet.
+
+    Credits to the platform (super admin) wallet go to one of several shard
+    rows at random instead of the wallets row, so concurrent payments do not
+    queue on one row lock. The wallet's balance is its row's plus its shards'.
+    """
+    __tablename__ = "wallet_balance_shards"
+    wallet_id = Column(String(255), ForeignKey("wallets.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    balance = Column(Float, default=0)
@@ -1,7 +1,7 @@
 import datetime as _dt
 from uuid import uuid4
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.schema import Column
 from sqlalchemy.types import String, DateTime, Float, Boolean
 
@@ -17,3 +17,7 @@ class WalletTransaction(Base):
     currency_code = Column(String(4))
     transaction_date = Column(DateTime, default=_dt.datetime.utcnow)
     transaction_ref = Column(String(255), default='')
+
+    __table_args__ = (
+        Index("ix_wallet_transactions_wallet_id_date_id", "wallet_id", "transaction_date", "id"),
+    )
@@ -1,16 +1,35 @@
-from fastapi import APIRouter
-from datetime import datetime
-from bigfastapi.db.database import get_db
-from fastapi import Depends
-from .models import notification_models as model
+from fastapi import APIRouter, BackgroundTasks, Request
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timedelta
+from bigfastapi.db import database
+from bigfastapi.db.database import get_async_db, get_db, get_read_db
+from fastapi import Depends, HTTPException, Query
+from .models import notification_models as model, role_models, store_user_model, user_models
+from .models.organisation_models import Organization, is_organization_member
 from .schemas import notification_schemas as schema, users_schemas as user_schema
-from typing import List
+from .schemas.pagination_schemas import CursorPage
+from .utils import settings
+from .utils.notification_hub import hub
+from .utils.scheduler import scheduler
+from .utils.utils import cursor_page, cursor_query
+from fastapi_utils.tasks import repeat_every
+from typing import List, Union
+from sqlalchemy import DateTime, delete, insert, literal, not_, or_, select, true, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from bigfastapi.auth_api import is_authenticated
+import asyncio
+import logging
 import sqlalchemy.orm as orm
 from uuid import uuid4
 
 
 app = APIRouter(tags=["Notification"])
+logger = logging.getLogger(__name__)
+app.on_event("startup")(hub.start)
+app.on_event("shutdown")(hub.stop)
+if settings.SCHEDULER_MAX_SLEEP_SECONDS > 0:
+    app.on_event("startup")(scheduler.start)
+    app.on_event("shutdown")(scheduler.stop)
 
 @app.get("/notification/{notification_id}", response_model=schema.Notification)
 def get_a_notification(notification_id: str, db: orm.Session = Depends(get_db)):
@@ -26,21 +45,78 @@ def get_a_notification(notification_id: str, db: orm.Session = Depends(get_db)):
 
     return model.notification_selector(id=notification_id, db=db)
 
-@app.get("/notifications", response_model=List[schema.Notification])
-def get_all_notifications(db: orm.Session = Depends(get_db)):  
+@app.get("/notifications", response_model=Union[List[schema.Notification], CursorPage[schema.Notification]])
+def get_all_notifications(cursor: str = None, limit: int = Query(None, ge=1, le=100), db: orm.Session = Depends(get_read_db)):  
 
     """intro-This endpoint allows you to retrieve all notifications from the database. To retrieve you need to make a get request to the /notifications endpoint
 
+    paramDesc-To page through the notifications, newest first, pass either of these query parameters:
+        param-limit: This is the number of notifications per page
+        param-cursor: This is the next_cursor of the previous page
 
     returnDesc-On sucessful request, it returns
-        returnBody- an array of notifications.
+        returnBody- an array of notifications, or a page of notifications and the next_cursor when paging.
     """
 
+    if cursor is not None or limit is not None:
+        query = cursor_query(select(model.Notification), model.Notification.date_created,
+                             model.Notification.id, cursor, limit or 50)
+        return cursor_page(db.execute(query).scalars().all(), model.Notification.date_created,
+                           model.Notification.id, limit or 50)
+
     notifications = db.query(model.Notification).all()
     return list(map(schema.Notification.from_orm, notifications))
 
+@app.get("/notifications/inbox", response_model=CursorPage[schema.Notification])
+def get_inbox(has_read: bool = None, cursor: str = None, limit: int = Query(50, ge=1, le=100),
+              user: user_schema.User = Depends(is_authenticated), db: orm.Session = Depends(get_read_db)):
+
+    """intro-This endpoint allows you to page through the notifications sent to the authenticated user, newest first. To retrieve you need to make a get request to the /notifications/inbox endpoint
+
+    paramDesc-On get request the url takes these optional query parameters:
+        param-has_read: true or false to only return read or unread notifications
+        param-limit: This is the number of notifications per page
+        param-cursor: This is the next_cursor of the previous page
+
+    returnDesc-On sucessful request, it returns
+        returnBody- a page of notifications and the next_cursor.
+    """
+
+    query = select(model.Notification).where(model.Notification.recipient == user.email)
+    if has_read is not None:
+        query = query.where(model.Notification.has_read == has_read)
+    query = cursor_query(query, model.Notification.date_created, model.Notification.id, cursor, limit)
+    return cursor_page(db.execute(query).scalars().all(), model.Notification.date_created,
+                       model.Notification.id, limit)
+
+@app.get("/notifications/inbox/unread-count", response_model=schema.UnreadCount)
+def get_unread_count(user: user_schema.User = Depends(is_authenticated), db: orm.Session = Depends(get_db)):
+
+    """intro-This endpoint allows you to get the number of unread notifications of the authenticated user. You need to make a get request to the /notifications/inbox/unread-count endpoint
+
+    returnDesc-On sucessful request, it returns
+        returnBody- the number of unread notifications.
+    """
+
+    return {"unread": model.unread_count(recipient=user.email, db=db)}
+
+@app.get("/notifications/stream")
+async def stream_notifications(request: Request, user: user_schema.User = Depends(is_authenticated),
+                               db: AsyncSession = Depends(get_async_db)):
+
+    """intro-This endpoint pushes the notifications sent to the authenticated user as they are created, as Server-Sent Events. To use, you need to make a get request to the /notifications/stream endpoint and keep the connection open
+
+    returnDesc-On sucessful request, it returns
+        returnBody- a text/event-stream of notification events, each with the notification as its data.
+    """
+
+    # authentication is done, don't hold a database connection for as long as the stream is open
+    await db.close()
+    return StreamingResponse(notification_events(request, recipient=user.email), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/notification", response_model=schema.Notification)
-def create_notification(notification: schema.NotificationCreate, user: user_schema.User = Depends(is_authenticated),db: orm.Session = Depends(get_db)):
+def create_notification(notification: schema.NotificationCreate, background_tasks: BackgroundTasks, user: user_schema.User = Depends(is_authenticated),db: orm.Session = Depends(get_db)):
 
     """intro-This endpoint allows you to create a new notification. To create, you need to make a post request to the /notification endpoint
 
@@ -58,12 +134,69 @@ def create_notification(notification: schema.NotificationCreate, user: user_sche
     else:
         creator = notification.creator
 
-    new_notification = model.Notification(id=uuid4().hex, creator=creator, content=notification.content, reference=notification.reference, recipient=notification.recipient)
+    new_notification = model.Notification(id=uuid4().hex, creator=creator, content=notification.content, reference=notification.reference, recipient=notification.recipient, has_read=False)
     db.add(new_notification)
+    model.adjust_unread_count(recipient=notification.recipient, delta=1, db=db)
     db.commit()
     db.refresh(new_notification)
 
-    return schema.Notification.from_orm(new_notification)
+    created = schema.Notification.from_orm(new_notification)
+    background_tasks.add_task(hub.publish, created.recipient, created.json())
+    return created
+
+@app.post("/notifications/fan-out", response_model=schema.FanOutResult)
+async def fan_out_notification(fan_out: schema.NotificationFanOut, background_tasks: BackgroundTasks,
+                               user: user_schema.User = Depends(is_authenticated),
+                               db: AsyncSession = Depends(get_async_db)):
+
+    """intro-This endpoint allows you to send the same notification to a whole audience: the members of an organization, the members with a role, or a list of recipients. To use, you need to make a post request to the /notifications/fan-out endpoint. Large audiences are notified in the background.
+
+        reqBody-content: This is the content of the notification
+        reqBody-reference: This is a unique identifier of the notification
+        reqBody-creator: This is the creator of the notification, '' for the authenticated user
+        reqBody-organization_id: Every member of this organization, and its owner, is notified. Only its owner and members can notify it
+        reqBody-role: Optional, only the members of organization_id with this role are notified
+        reqBody-recipients: A list of recipients to notify, instead of organization_id
+
+    returnDesc-On sucessful request, it returns
+        returnBody- the number of notifications created so far, and whether the rest are created in the background.
+    """
+
+    if (fan_out.organization_id is None) == (fan_out.recipients is None):
+        raise HTTPException(status_code=400, detail="Pass either organization_id or recipients")
+    if fan_out.role is not None and fan_out.organization_id is None:
+        raise HTTPException(status_code=400, detail="role needs an organization_id")
+
+    notification = {"creator": fan_out.creator or model.get_authenticated_user_email(user=user),
+                    "content": fan_out.content, "reference": fan_out.reference}
+    chunk_size = settings.NOTIFICATION_FANOUT_CHUNK_SIZE
+
+    # the first chunk is created now, the rest by the scheduler, a chunk per job
+    if fan_out.recipients is not None:
+        recipients = list(dict.fromkeys(fan_out.recipients))
+        rows = await _add_notifications(notification, recipients=recipients[:chunk_size], db=db)
+        for start in range(chunk_size, len(recipients), chunk_size):
+            scheduler.schedule("notification_fanout",
+                               {"notification": notification, "recipients": recipients[start:start + chunk_size]},
+                               run_at=datetime.now(), db=db)
+        background = len(recipients) > chunk_size
+    else:
+        organization = await db.get(Organization, fan_out.organization_id)
+        if organization is None:
+            raise HTTPException(status_code=404, detail="Organization does not exist")
+        if not await is_organization_member(organization, user_id=user.id, db=db):
+            raise HTTPException(status_code=403, detail="Only the members of an organization can notify it")
+        job = {"notification": notification, "organization_id": fan_out.organization_id, "role": fan_out.role}
+        rows, after = await _fan_out_to_members(job, db=db)
+        if after is not None:
+            scheduler.schedule("notification_fanout", {**job, "after": after}, run_at=datetime.now(), db=db)
+        background = after is not None
+
+    await db.commit()
+    if background:
+        scheduler.wake()
+    background_tasks.add_task(_publish_notifications, rows)
+    return {"created": len(rows), "background": background}
 
 @app.put("/notification/{notification_id}/read", response_model=schema.Notification)
 def mark_notification_read(notification_id: str,db: orm.Session = Depends(get_db)):  
@@ -79,38 +212,46 @@ def mark_notification_read(notification_id: str,db: orm.Session = Depends(get_db
 
     notification = model.notification_selector(id=notification_id, db=db)
 
-    if notification.has_read:
-        pass
-    else:
-        notification.has_read = True
-        notification.last_updated = datetime.utcnow()
+    # only the request that actually marks it read counts it
+    updated = db.execute(update(model.Notification)
+                         .where(model.Notification.id == notification_id)
+                         .where(model.Notification.has_read.isnot(True))
+                         .values(has_read=True, last_updated=datetime.utcnow())
+                         .execution_options(synchronize_session=False)).rowcount
+    model.adjust_unread_count(recipient=notification.recipient, delta=-updated, db=db)
 
     db.commit()
     db.refresh(notification)
 
     return schema.Notification.from_orm(notification)
 
-@app.put("/notifications/read", response_model=List[schema.Notification])
-def mark_notifications_read(db: orm.Session = Depends(get_db)):
+@app.put("/notifications/read", response_model=schema.MarkReadResult)
+def mark_notifications_read(filters: schema.MarkRead = None, user: user_schema.User = Depends(is_authenticated),
+                            db: orm.Session = Depends(get_db)):
 
-    """intro-This endpoint allows you mark all notifications as read. To use, you need to make a put request to the /notification/read enpoint. 
+    """intro-This endpoint allows you mark the notifications of the authenticated user as read, in one go. To use, you need to make a put request to the /notifications/read enpoint.
+
+        reqBody-ids: Optional, only these notifications are marked read
+        reqBody-before: Optional, only notifications created before this time are marked read
 
     returnDesc-On sucessful request, it returns
-        returnBody- an array of the notifications.
+        returnBody- the number of notifications marked read.
     """
 
-    notifications = db.query(model.Notification).all()
-    for notification in notifications:
-        if notification.has_read:
-            pass
-        else:
-            notification.has_read = True
-            notification.last_updated = datetime.utcnow()
-            
-        db.commit()
-        db.refresh(notification)
-    
-    return list(map(schema.Notification.from_orm, notifications))
+    query = (update(model.Notification)
+             .where(model.Notification.recipient == user.email)
+             .where(model.Notification.has_read.isnot(True)))
+    if filters is not None and filters.ids is not None:
+        query = query.where(model.Notification.id.in_(filters.ids))
+    if filters is not None and filters.before is not None:
+        query = query.where(model.Notification.date_created < filters.before)
+
+    updated = db.execute(query.values(has_read=True, last_updated=datetime.utcnow())
+                         .execution_options(synchronize_session=False)).rowcount
+    model.adjust_unread_count(recipient=user.email, delta=-updated, db=db)
+    db.commit()
+
+    return {"updated": updated}
 
 @app.put("/notifications/{notification_id}", response_model=schema.Notification)
 def update_notification(notification_id: str, notification: schema.NotificationUpdate, db: orm.Session = Depends(get_db)):
@@ -135,7 +276,22 @@ def update_notification(notification_id: str, notification: schema.NotificationU
         notification_from_db.reference = notification.reference
 
     if notification.recipient != "":
-        notification_from_db.recipient = notification.recipient
+        previous_recipient = notification_from_db.recipient
+        # an unread notification takes its unread count along, unless it is read meanwhile
+        moved_unread = db.execute(update(model.Notification)
+                                  .where(model.Notification.id == notification_id)
+                                  .where(model.Notification.recipient == previous_recipient)
+                                  .where(model.Notification.has_read.isnot(True))
+                                  .values(recipient=notification.recipient)
+                                  .execution_options(synchronize_session=False)).rowcount
+        if moved_unread:
+            model.adjust_unread_count(recipient=previous_recipient, delta=-1, db=db)
+            model.adjust_unread_count(recipient=notification.recipient, delta=1, db=db)
+        else:
+            db.execute(update(model.Notification)
+                       .where(model.Notification.id == notification_id)
+                       .values(recipient=notification.recipient)
+                       .execution_options(synchronize_session=False))
 
     notification_from_db.last_updated = datetime.utcnow()
 
@@ -157,7 +313,186 @@ def delete_notification(notification_id: str,db: orm.Session = Depends(get_db)):
 
     notification = model.notification_selector(id=notification_id, db=db)
 
-    db.delete(notification)
+    # only the request that actually deletes it unread counts it
+    deleted_unread = db.execute(delete(model.Notification)
+                                .where(model.Notification.id == notification_id)
+                                .where(model.Notification.has_read.isnot(True))
+                                .execution_options(synchronize_session=False)).rowcount
+    if deleted_unread:
+        model.adjust_unread_count(recipient=notification.recipient, delta=-1, db=db)
+    else:
+        db.execute(delete(model.Notification)
+                   .where(model.Notification.id == notification_id)
+                   .execution_options(synchronize_session=False))
     db.commit()
 
     return {"message":"successfully deleted"}
+
+
+async def notification_events(request: Request, recipient: str):
+    """Yields the Server-Sent Events of the notifications published to
+    recipient until the client disconnects
+    """
+    async with hub.subscribe(recipient) as messages:
+        yield ": connected\n\n"
+        while not await request.is_disconnected():
+            try:
+                message = await asyncio.wait_for(messages.get(), settings.NOTIFICATION_STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield "event: notification\ndata: " + message + "\n\n"
+
+
+def _audience_query(organization_id: str, role: str = None):
+    """Selects the id and email of the members of an organization with role,
+    or of all its members and its owner, by id
+    """
+    members = (select(store_user_model.StoreUser.user_id)
+               .where(store_user_model.StoreUser.store_id == organization_id)
+               .where(store_user_model.StoreUser.is_deleted == False))
+    if role is not None:
+        members = (members.join(role_models.Role, role_models.Role.id == store_user_model.StoreUser.role_id)
+                   .where(role_models.Role.organization_id == organization_id)
+                   .where(role_models.Role.role_name == role.lower()))
+        in_audience = user_models.User.id.in_(members)
+    else:
+        owner = select(Organization.creator).where(Organization.id == organization_id).scalar_subquery()
+        in_audience = or_(user_models.User.id.in_(members), user_models.User.id == owner)
+    return (select(user_models.User.id, user_models.User.email)
+            .where(in_audience)
+            .where(user_models.User.is_deleted == False)
+            .order_by(user_models.User.id))
+
+
+async def _fan_out_to_members(job: dict, db: AsyncSession):
+    """Notifies a chunk of the members of the job's audience, after the
+    member id job["after"].
+
+    Returns the notifications and the id of the last member notified, or None
+    if there are no more members.
+    """
+    query = _audience_query(job["organization_id"], job["role"]).limit(settings.NOTIFICATION_FANOUT_CHUNK_SIZE)
+    if job.get("after") is not None:
+        query = query.where(user_models.User.id > job["after"])
+    members = (await db.execute(query)).all()
+
+    rows = await _add_notifications(job["notification"], db=db,
+                                    recipients=list(dict.fromkeys(member.email for member in members if member.email)))
+    if len(members) < settings.NOTIFICATION_FANOUT_CHUNK_SIZE:
+        return rows, None
+    return rows, members[-1].id
+
+
+async def _add_notifications(notification: dict, recipients: list, db: AsyncSession):
+    """Adds a notification for each of the distinct recipients in one insert,
+    without committing. Returns the rows added.
+    """
+    if not recipients:
+        return []
+    now = datetime.utcnow()
+    rows = [{"id": uuid4().hex, **notification, "recipient": recipient, "has_read": False,
+             "date_created": now, "last_updated": now} for recipient in recipients]
+    await db.execute(insert(model.Notification), rows)
+    await model.increment_unread_counts(recipients, db=db)
+    return rows
+
+
+async def _publish_notifications(rows: list):
+    for row in rows:
+        await hub.publish(row["recipient"], schema.Notification(**row).json())
+
+
+@scheduler.handler("notification_fanout")
+async def _send_fan_out(payload: dict, db):
+    if "recipients" in payload:
+        rows = await _add_notifications(payload["notification"], recipients=payload["recipients"], db=db)
+    else:
+        rows, after = await _fan_out_to_members(payload, db=db)
+        if after is not None:
+            scheduler.schedule("notification_fanout", {**payload, "after": after}, run_at=datetime.now(), db=db)
+    # pushed before the scheduler commits, a subscriber may see them a moment early
+    await _publish_notifications(rows)
+
+
+def _retention_policies(now: datetime):
+    """Returns a (condition, cutoff) for each notification type with a TTL:
+    the read notifications matching condition created before cutoff have
+    expired
+    """
+    policies, typed = [], []
+    for notification_type, days in settings.NOTIFICATION_TTL_DAYS_BY_TYPE.items():
+        condition = model.Notification.reference.startswith(notification_type + "-", autoescape=True)
+        typed.append(condition)
+        if days > 0:
+            policies.append((condition, now - timedelta(days=days)))
+    if settings.NOTIFICATION_TTL_DAYS > 0:
+        untyped = or_(model.Notification.reference.is_(None), not_(or_(*typed))) if typed else true()
+        policies.append((untyped, now - timedelta(days=settings.NOTIFICATION_TTL_DAYS)))
+    return policies
+
+
+async def archive_notifications():
+    """Moves a batch of expired read notifications to the archive, or deletes
+    them if NOTIFICATION_ARCHIVE_EXPIRED is off, in one transaction.
+
+    Returns the number of notifications moved or deleted.
+    """
+    now = datetime.utcnow()
+    batch_size = settings.NOTIFICATION_RETENTION_BATCH_SIZE
+    async with database.AsyncSessionLocal() as db:
+        expired_ids = []
+        for condition, cutoff in _retention_policies(now):
+            expired_ids += (await db.execute(
+                select(model.Notification.id)
+                    .where(model.Notification.has_read == True)
+                    .where(model.Notification.date_created < cutoff)
+                    .where(condition)
+                    .limit(batch_size - len(expired_ids)))).scalars().all()
+            if len(expired_ids) == batch_size:
+                break
+        if not expired_ids:
+            return 0
+
+        if settings.NOTIFICATION_ARCHIVE_EXPIRED:
+            columns = list(model.Notification.__table__.columns)
+            await db.execute(insert(model.ArchivedNotification).from_select(
+                [column.name for column in columns] + ["date_archived"],
+                select(*columns, literal(now, DateTime)).where(model.Notification.id.in_(expired_ids))))
+        await db.execute(delete(model.Notification)
+                         .where(model.Notification.id.in_(expired_ids))
+                         .execution_options(synchronize_session=False))
+        await db.commit()
+        return len(expired_ids)
+
+
+async def purge_archived_notifications():
+    """Deletes a batch of the notifications archived more than
+    NOTIFICATION_ARCHIVE_TTL_DAYS ago. Returns the number deleted.
+    """
+    if settings.NOTIFICATION_ARCHIVE_TTL_DAYS <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=settings.NOTIFICATION_ARCHIVE_TTL_DAYS)
+    async with database.AsyncSessionLocal() as db:
+        purged_ids = (await db.execute(
+            select(model.ArchivedNotification.id)
+                .where(model.ArchivedNotification.date_archived < cutoff)
+                .limit(settings.NOTIFICATION_RETENTION_BATCH_SIZE))).scalars().all()
+        if not purged_ids:
+            return 0
+        await db.execute(delete(model.ArchivedNotification)
+                         .where(model.ArchivedNotification.id.in_(purged_ids))
+                         .execution_options(synchronize_session=False))
+        await db.commit()
+        return len(purged_ids)
+
+
+if settings.NOTIFICATION_RETENTION_INTERVAL_SECONDS > 0:
+    @app.on_event("startup")
+    @repeat_every(seconds=settings.NOTIFICATION_RETENTION_INTERVAL_SECONDS, logger=logger)
+    async def apply_notification_retention_task():
+        # keep going while there is a backlog
+        while await archive_notifications() == settings.NOTIFICATION_RETENTION_BATCH_SIZE:
+            pass
+        while await purge_archived_notifications() == settings.NOTIFICATION_RETENTION_BATCH_SIZE:
+            pass
@@ -9,9 +9,10 @@ from decouple import config
 from fastapi import APIRouter
 from fastapi import UploadFile, File
 from fastapi.responses import FileResponse
-from sqlalchemy import and_
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_db, get_async_db
 from .auth_api import is_authenticated
 from .files import upload_image
 from .models import credit_wallet_models as credit_wallet_models
@@ -22,7 +23,7 @@ from fastapi import BackgroundTasks
 from .schemas import organisation_schemas as _schemas
 from .schemas import users_schemas
 
-from .utils.utils import paginate_data, row_to_dict
+from .utils.utils import paginate_data_query, row_to_dict
 
 app = APIRouter(tags=["Organization"])
 
@@ -31,7 +32,7 @@ app = APIRouter(tags=["Organization"])
 async def create_organization(
         organization: _schemas.OrganizationCreate,
         user: str = _fastapi.Depends(is_authenticated),
-        db: _orm.Session = _fastapi.Depends(get_db),
+        db: AsyncSession = _fastapi.Depends(get_async_db),
 ):
     db_org = await get_orgnanization_by_name(name=organization.name, db=db)
 
@@ -48,8 +49,8 @@ async def create_organization(
         )
 
         db.add(template_obj)
-        db.commit()
-        db.refresh(template_obj)
+        await db.commit()
+        await db.refresh(template_obj)
 
         template_obj = _models.DefaultTemplates(
             id=uuid4().hex, organization_id=created_org.id, subject="Reminder_Two",
@@ -58,8 +59,8 @@ async def create_organization(
         )
 
         db.add(template_obj)
-        db.commit()
-        db.refresh(template_obj)
+        await db.commit()
+        await db.refresh(template_obj)
 
     return created_org
 
@@ -67,20 +68,18 @@ async def create_organization(
 @app.get("/organizations")
 async def get_organizations(
         user: users_schemas.User = _fastapi.Depends(is_authenticated),
-        db: _orm.Session = _fastapi.Depends(get_db),
-        page_size: int = 15,
-        page_number: int = 1,
+        db: AsyncSession = _fastapi.Depends(get_async_db),
+        page_size: int = _fastapi.Query(15, ge=1),
+        page_number: int = _fastapi.Query(1, ge=1),
 ):
-    all_orgs = await get_organizations(user, db)
-
-    return paginate_data(all_orgs, page_size, page_number)
+    return await get_organizations(user, db, page_size, page_number)
 
 
 @app.get("/organizations/{organization_id}", status_code=200)
 async def get_organization(
         organization_id: str,
         user: users_schemas.User = _fastapi.Depends(is_authenticated),
-        db: _orm.Session = _fastapi.Depends(get_db),
+        db: AsyncSession = _fastapi.Depends(get_async_db),
 ):
     return await get_organization(organization_id, user, db)
 
@@ -88,47 +87,39 @@ async def get_organization(
 @app.get("/organizations/{organization_id}/users", status_code=200)
 async def get_organization_users(
         organization_id: str,
-        db: _orm.Session = _fastapi.Depends(get_db)
+        db: AsyncSession = _fastapi.Depends(get_async_db)
 ):
 
     """
         An endpoint that returns the users in an organization.
     """
     # query the store_users table with the organization_id
-    invited_list = db.query(store_user_model.StoreUser).filter(
+    invited_list = (await db.execute(select(store_user_model.StoreUser).where(
         and_(
             store_user_model.StoreUser.store_id == organization_id,
             store_user_model.StoreUser.is_deleted == False
         )
-    ).all()
+    ))).scalars().all()
 
     invited_list = list(map(lambda x: row_to_dict(x), invited_list))
 
-    organization = (
-        db.query(_models.Organization)
-        .filter(_models.Organization.id == organization_id)
-        .first()
-    )
+    organization = await db.get(_models.Organization, organization_id)
 
     if organization is None:
         raise _fastapi.HTTPException(
             status_code=404, detail="Organization does not exist")
     store_owner_id = organization.creator
-    store_owner = (
-        db.query(user_models.User)
-        .filter(user_models.User.id == store_owner_id)
-        .first())
+    store_owner = await db.get(user_models.User, store_owner_id)
 
     invited_users = []
     if len(invited_list) > 0:
         for invited in invited_list:
-            user =  db.query(user_models.User).filter(
+            user = (await db.execute(select(user_models.User).where(
                 and_(
                     user_models.User.id == invited["user_id"],
                     user_models.User.is_deleted == False
-                )).first()
-            role = db.query(role_models.Role).filter(
-                role_models.Role.id == invited["role_id"]).first()
+                )))).scalars().first()
+            role = await db.get(role_models.Role, invited["role_id"])
             if(user.id == invited["user_id"]):
                 invited["email"] = user.email
                 invited["role"] = role.role_name 
@@ -236,7 +227,7 @@ def get_pending_invites(
 async def update_organization(organization_id: str, organization: _schemas.OrganizationUpdate,
                               user: users_schemas.User = _fastapi.Depends(
                                   is_authenticated),
-                              db: _orm.Session = _fastapi.Depends(get_db)):
+                              db: AsyncSession = _fastapi.Depends(get_async_db)):
     return await update_organization(organization_id, organization, user, db)
 
 
@@ -271,9 +262,8 @@ async def organization_image_upload(organization_id: str, file: UploadFile = Fil
 
 
 @app.get("/organizations/{organization_id}/image")
-async def get_organization_image_upload(organization_id: str, db: _orm.Session = _fastapi.Depends(get_db)):
-    org = db.query(_models.Organization).filter(
-        _models.Organization.id == organization_id).first()
+async def get_organization_image_upload(organization_id: str, db: AsyncSession = _fastapi.Depends(get_async_db)):
+    org = await db.get(_models.Organization, organization_id)
 
     image = org.image
     filename = f"/{org.id}/{image}"
@@ -286,23 +276,23 @@ async def get_organization_image_upload(organization_id: str, db: _orm.Session =
 
 @app.delete("/organizations/{organization_id}", status_code=204)
 async def delete_organization(organization_id: str, user: users_schemas.User = _fastapi.Depends(is_authenticated),
-                              db: _orm.Session = _fastapi.Depends(get_db)):
+                              db: AsyncSession = _fastapi.Depends(get_async_db)):
     return await delete_organization(organization_id, user, db)
 
 
 # /////////////////////////////////////////////////////////////////////////////////
 # Organisation Services
 
-async def get_orgnanization_by_name(name: str, db: _orm.Session):
-    return db.query(_models.Organization).filter(_models.Organization.name == name).first()
+async def get_orgnanization_by_name(name: str, db: AsyncSession):
+    return (await db.execute(select(_models.Organization).where(_models.Organization.name == name))).scalars().first()
 
 
-async def fetch_organization_by_name(name: str, organization_id: str, db: _orm.Session):
-    return db.query(_models.Organization).filter(_models.Organization.name == name).filter(
-        _models.Organization.id != organization_id).first()
+async def fetch_organization_by_name(name: str, organization_id: str, db: AsyncSession):
+    return (await db.execute(select(_models.Organization).where(_models.Organization.name == name).where(
+        _models.Organization.id != organization_id))).scalars().first()
 
 
-async def create_organization(user: users_schemas.User, db: _orm.Session, organization: _schemas.OrganizationCreate):
+async def create_organization(user: users_schemas.User, db: AsyncSession, organization: _schemas.OrganizationCreate):
     organization_id = uuid4().hex
     organization = _models.Organization(id=organization_id, creator=user.id, mission=organization.mission,
                                         vision=organization.vision, values=organization.values, name=organization.name,
@@ -313,8 +303,8 @@ async def create_organization(user: users_schemas.User, db: _orm.Session, organi
                                         currency_preference=organization.currency_preference)
     
     db.add(organization)
-    db.commit()
-    db.refresh(organization)
+    await db.commit()
+    await db.refresh(organization)
     
     roles = ["Assistant", "Admin", "Owner"]
 
@@ -325,8 +315,8 @@ async def create_organization(user: users_schemas.User, db: _orm.Session, organi
             role_name=role.lower()
         )
         db.add(new_role)
-        db.commit()
-        db.refresh(new_role)
+        await db.commit()
+        await db.refresh(new_role)
 
     await create_wallet(organization_id=organization_id, currency=organization.currency_preference, db=db)
     await create_credit_wallet(organization_id=organization_id, db=db)
@@ -334,54 +324,26 @@ async def create_organization(user: users_schemas.User, db: _orm.Session, organi
     return _schemas.Organization.from_orm(organization)
 
 
-async def get_organizations(user: users_schemas.User, db: _orm.Session):
-    native_orgs = db.query(_models.Organization).filter_by(
-        creator=user.id).all()
+async def get_organizations(user: users_schemas.User, db: AsyncSession, page_size: int = 15, page_number: int = 1):
+    invited_org_ids = select(store_user_model.StoreUser.store_id).where(
+        store_user_model.StoreUser.user_id == user.id)
+    organizations = select(_models.Organization).where(or_(
+        _models.Organization.creator == user.id,
+        _models.Organization.id.in_(invited_org_ids))).order_by(
+        _models.Organization.date_created, _models.Organization.id)
 
-    invited_orgs_rep = (
-        db.query(store_user_model.StoreUser)
-        .filter(store_user_model.StoreUser.user_id == user.id)
-        .all()
-    )
+    page = await paginate_data_query(db, organizations, page_size, page_number)
+
+    appBasePath = config('API_URL')
+    for organization in page["data"]:
+        imageURL = appBasePath + f'/organizations/{organization.id}/image'
+        setattr(organization, 'image_full_path', imageURL)
+
+    return page
 
-    if len(invited_orgs_rep) < 1:
-        # continue to last stage
-        organization_list = native_orgs
-        organizationCollection = []
-        for pos in range(len(organization_list)):
-            appBasePath = config('API_URL')
-            imageURL = appBasePath + \
-                f'/organizations/{organization_list[pos].id}/image'
-            setattr(organization_list[pos], 'image_full_path', imageURL)
-            organizationCollection.append(organization_list[pos])
-
-        return organizationCollection
-
-    store_id_list = list(map(lambda x: x.store_id, invited_orgs_rep))
-
-    org = []
-    for store_id in store_id_list:
-        org = org + \
-            db.query(_models.Organization).filter(
-                _models.Organization.id == store_id).all()
-
-    org_coll = native_orgs + org
-    organizationCollection = []
-    for pos in range(len(org_coll)):
-        appBasePath = config('API_URL')
-        imageURL = appBasePath+f'/organizations/{org_coll[pos].id}/image'
-        setattr(org_coll[pos], 'image_full_path', imageURL)
-        organizationCollection.append(org_coll[pos])
-
-    return organizationCollection
-
-
-async def _organization_selector(organization_id: str, user: users_schemas.User, db: _orm.Session):
-    organization = (
-        db.query(_models.Organization)
-        .filter(_models.Organization.id == organization_id)
-        .first()
-    )
+
+async def _organization_selector(organization_id: str, user: users_schemas.User, db: AsyncSession):
+    organization = await db.get(_models.Organization, organization_id)
 
     if organization is None:
         raise _fastapi.HTTPException(
@@ -394,21 +356,21 @@ async def _organization_selector(organization_id: str, user: users_schemas.User,
     return organization
 
 
-async def get_organization(organization_id: str, user: users_schemas.User, db: _orm.Session):
+async def get_organization(organization_id: str, user: users_schemas.User, db: AsyncSession):
     organization = await _organization_selector(organization_id=organization_id, user=user, db=db)
 
     return _schemas.Organization.from_orm(organization)
 
 
-async def delete_organization(organization_id: str, user: users_schemas.User, db: _orm.Session):
+async def delete_organization(organization_id: str, user: users_schemas.User, db: AsyncSession):
     organization = await _organization_selector(organization_id, user, db)
 
-    db.delete(organization)
-    db.commit()
+    await db.delete(organization)
+    await db.commit()
 
 
 async def update_organization(organization_id: str, organization: _schemas.OrganizationUpdate, user: users_schemas.User,
-                              db: _orm.Session):
+                              db: AsyncSession):
     organization_db = await _organization_selector(organization_id, user, db)
     currencyUpdated = False
     if organization.mission != "":
@@ -450,8 +412,8 @@ async def update_organization(organization_id: str, organization: _schemas.Organ
 
     organization_db.last_updated = _dt.datetime.utcnow()
 
-    db.commit()
-    db.refresh(organization_db)
+    await db.commit()
+    await db.refresh(organization_db)
 
     # create a new wallet if the currency is changed
     if currencyUpdated:
@@ -460,10 +422,10 @@ async def update_organization(organization_id: str, organization: _schemas.Organ
     return _schemas.Organization.from_orm(organization_db)
 
 
-async def create_wallet(organization_id: str, currency: str, db: _orm.Session):
+async def create_wallet(organization_id: str, currency: str, db: AsyncSession):
     currency = currency.upper()
-    wallet = db.query(wallet_models.Wallet).filter_by(organization_id=organization_id).filter_by(
-        currency_code=currency).first()
+    wallet = (await db.execute(select(wallet_models.Wallet).filter_by(organization_id=organization_id).filter_by(
+        currency_code=currency))).scalars().first()
 
     if wallet is None:
         wallet = wallet_models.Wallet(id=uuid4().hex, organization_id=organization_id, balance=0,
@@ -471,14 +433,14 @@ async def create_wallet(organization_id: str, currency: str, db: _orm.Session):
                                       last_updated=_dt.datetime.utcnow())
 
         db.add(wallet)
-        db.commit()
-        db.refresh(wallet)
+        await db.commit()
+        await db.refresh(wallet)
 
 
-async def create_credit_wallet(organization_id: str, db: _orm.Session):
+async def create_credit_wallet(organization_id: str, db: AsyncSession):
     credit = credit_wallet_models.CreditWallet(id=uuid4().hex, organization_id=organization_id, amount=0,
                                                last_updated=_dt.datetime.utcnow())
 
     db.add(credit)
-    db.commit()
-    db.refresh(credit)
+    await db.commit()
+    await db.refresh(credit)
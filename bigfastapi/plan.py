@@ -3,7 +3,7 @@ from bigfastapi import db
 from uuid import uuid4
 from bigfastapi.models import plan_model
 from bigfastapi.schemas import plan_schema
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_db, get_read_db
 import sqlalchemy.orm as _orm
 import fastapi as _fastapi
 from fastapi import APIRouter
@@ -22,7 +22,7 @@ async def addPlan(plan: plan_schema.PlanReqBase, db: _orm.Session = _fastapi.Dep
 
 
 @app.get('/plans', response_model=plan_schema.ResponseList)
-async def getAll(db: _orm.Session = _fastapi.Depends(get_db)):
+async def getAll(db: _orm.Session = _fastapi.Depends(get_read_db)):
     plans = await getAllPlans(db)
     return buildSuccessRess(plans, True)
 
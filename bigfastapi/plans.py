@@ -2,7 +2,7 @@ from .schemas import plan_schemas, users_schemas
 from .auth_api import is_authenticated
 from .models import plan_models
 from fastapi import APIRouter, Depends, HTTPException, status, responses
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_db, get_read_db
 import sqlalchemy.orm as orm
 from typing import List
 from fastapi.encoders import jsonable_encoder
@@ -83,7 +83,7 @@ def update_plan(
 
 
 @app.get("/plans", response_model=List[plan_schemas.Plan])
-def get_all_plans(db: orm.Session = Depends(get_db)):
+def get_all_plans(db: orm.Session = Depends(get_read_db)):
     """Retrieves all existing plans
 
     Args:
@@ -18,8 +18,8 @@ import sqlalchemy.orm as orm
 from .models import receipt_models as receiptmodel
 from uuid import uuid4
 from fastapi import BackgroundTasks
-from bigfastapi.utils import settings
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
+from bigfastapi.utils import settings, templates
+from fastapi_mail import FastMail, MessageSchema
 from typing import Optional
 
 app = APIRouter()
@@ -85,7 +85,7 @@ def send_receipt_email(
     background_tasks.add_task(fm.send_message, message, template_name=template)
 
 
-conf = ConnectionConfig(
+conf = templates.TemplateConfig(
     MAIL_USERNAME=settings.MAIL_USERNAME,
     MAIL_PASSWORD=settings.MAIL_PASSWORD,
     MAIL_FROM=settings.MAIL_FROM,
@@ -1,4 +1,6 @@
 import datetime
+from enum import Enum
+from typing import Optional
 
 import pydantic as _pydantic
 
@@ -12,11 +14,24 @@ class CreditWalletHistory(_pydantic.BaseModel):
     date: datetime.datetime
     reference: str
     credit_wallet_id: str
+    # the wallet's balance after this row
+    balance: Optional[float]
 
     class Config:
         orm_mode = True
 
 
+class CreditUsagePeriod(Enum):
+    DAY = 'day'
+    MONTH = 'month'
+
+
+class CreditUsage(_pydantic.BaseModel):
+    period: str
+    credits_added: float
+    credits_used: float
+
+
 class CreditWalletFund(_pydantic.BaseModel):
     currency: str
     amount: float
@@ -46,3 +61,17 @@ class CreditWalletResponse(CreditWalletCreate):
 
     class Config:
         orm_mode = True
+
+
+class PaymentEvent(_pydantic.BaseModel):
+    id: str
+    provider: str
+    provider_transaction_id: str
+    status: str
+    attempts: int
+    last_error: Optional[str]
+    next_attempt_at: datetime.datetime
+    date_created: datetime.datetime
+
+    class Config:
+        orm_mode = True
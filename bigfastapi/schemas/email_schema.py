@@ -1,5 +1,7 @@
+from datetime import datetime
+from enum import Enum
 from pydantic import EmailStr, BaseModel
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 
 
 class Email(BaseModel):
@@ -28,3 +30,36 @@ class Email(BaseModel):
     sender_city: str
     sender_state: str
 
+
+
+class CampaignSource(str, Enum):
+    customers = "customers"
+    csv = "csv"
+
+
+class CampaignBase(BaseModel):
+    organization_id: str
+    subject: str
+    title: str
+    body: Optional[str] = None
+    template: str = "marketing_email.html"
+    # template values shared by every recipient
+    template_body: Dict[str, Any] = {}
+
+
+class CampaignCreate(CampaignBase):
+    # csv campaigns get their recipients from uploads to /email/campaigns/{campaign_id}/recipients
+    source: CampaignSource = CampaignSource.customers
+
+
+class Campaign(BaseModel):
+    id: str
+    organization_id: str
+    subject: str
+    template: str
+    date_created: datetime
+    # number of recipients by delivery status
+    recipients: Dict[str, int] = {}
+
+    class Config:
+        orm_mode = True
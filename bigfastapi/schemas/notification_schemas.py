@@ -23,4 +23,26 @@ class NotificationCreate(NotificationBase):
     creator: str = Field(..., description="creator='' makes the authenticated user email the creator. If you want to override it, pass the email you want to use eg. creator='support@admin.com'")
 
 class NotificationUpdate(NotificationBase):
-    pass
\ No newline at end of file
+    pass
+
+class UnreadCount(pydantic.BaseModel):
+    unread: int
+
+class MarkRead(pydantic.BaseModel):
+    ids: Optional[List[str]] = Field(None, description="only mark these notifications read")
+    before: Optional[datetime] = Field(None, description="only mark notifications created before this time read")
+
+class MarkReadResult(pydantic.BaseModel):
+    updated: int
+
+class NotificationFanOut(pydantic.BaseModel):
+    content: str
+    reference: str
+    creator: str = Field("", description="creator='' makes the authenticated user email the creator")
+    organization_id: Optional[str] = Field(None, description="notify every member of this organization, and its owner")
+    role: Optional[str] = Field(None, description="only notify the members of organization_id with this role")
+    recipients: Optional[List[str]] = Field(None, description="notify these recipients instead of an organization")
+
+class FanOutResult(pydantic.BaseModel):
+    created: int
+    background: bool = Field(..., description="true if the rest of the audience is notified in the background")
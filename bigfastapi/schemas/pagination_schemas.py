@@ -0,0 +1,10 @@
+from typing import Generic, List, Optional, TypeVar
+
+from pydantic.generics import GenericModel
+
+T = TypeVar("T")
+
+
+class CursorPage(GenericModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
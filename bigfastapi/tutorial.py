@@ -6,7 +6,7 @@ from fastapi.responses import JSONResponse
 from fastapi import APIRouter
 import fastapi as _fastapi
 import sqlalchemy.orm as _orm
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_db, get_read_db
 from bigfastapi.schemas import plan_schema, tutorial_schema
 from bigfastapi.models import plan_model, tutorial_model, user_models
 from uuid import uuid4
@@ -37,7 +37,7 @@ async def store(newTutorial: tutorial_schema.TutorialRequest, db: _orm.Session =
 async def getTutorials(
         category: str = None, title: str = None,
         page_size: int = 10, page: int = 1,
-        db: _orm.Session = _fastapi.Depends(get_db)):
+        db: _orm.Session = _fastapi.Depends(get_read_db)):
 
     rowCount = await tutorial_model.getRowCount(db)
     skip = getSkip(page, page_size)
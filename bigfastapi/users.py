@@ -9,11 +9,13 @@ from fastapi.responses import JSONResponse
 from sqlalchemy import and_
 import os
 
-import passlib.hash as _hash
+from bigfastapi.utils import passwords
 from bigfastapi.models import organisation_models, user_models, auth_models
 from fastapi import APIRouter, HTTPException, UploadFile, File, BackgroundTasks, status
 import sqlalchemy.orm as orm
-from bigfastapi.db.database import get_db
+from bigfastapi.db.database import get_db, get_async_db
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from .schemas import users_schemas as _schemas
 from .schemas import store_invite_schemas as _invite_schemas
 from .auth_api import is_authenticated, send_code_password_reset_email,  resend_token_verification_mail, verify_user_token, password_change_token
@@ -36,7 +38,7 @@ async def get_user(user: _schemas.User = fastapi.Depends(is_authenticated)):
 async def update_user(
     user_update: _schemas.UserUpdate,
     user: _schemas.User = fastapi.Depends(is_authenticated),
-    db: orm.Session = fastapi.Depends(get_db),
+    db: AsyncSession = fastapi.Depends(get_async_db),
 ):
     return await user_update(user_update, user, db)
 
@@ -44,7 +46,7 @@ async def update_user(
 # user must be a super user to perform this
 @app.put("/users/{user_id}/activate")
 async def activate_user(user_activate: _schemas.UserActivate, user_id: str, user: _schemas.User = fastapi.Depends(is_authenticated),
-                        db: orm.Session = fastapi.Depends(get_db)):
+                        db: AsyncSession = fastapi.Depends(get_async_db)):
     if user.is_superuser == False:
         raise fastapi.HTTPException(
             status_code=403, detail="only super admins can perform this operation")
@@ -56,7 +58,7 @@ async def activate_user(user_activate: _schemas.UserActivate, user_id: str, user
 
 
 @app.post("/users/recover-password")
-async def recover_password(email: _schemas.UserRecoverPassword, db: orm.Session = fastapi.Depends(get_db)):
+async def recover_password(email: _schemas.UserRecoverPassword, db: AsyncSession = fastapi.Depends(get_async_db)):
     user = await get_user(db=db, email=email.email)
     await delete_password_reset_code(db, user.id)
     await send_code_password_reset_email(email.email, db)
@@ -64,7 +66,7 @@ async def recover_password(email: _schemas.UserRecoverPassword, db: orm.Session
 
 
 @app.post("/users/reset-password")
-async def reset_password(user: _schemas.UserResetPassword, db: orm.Session = fastapi.Depends(get_db)):
+async def reset_password(user: _schemas.UserResetPassword, db: AsyncSession = fastapi.Depends(get_async_db)):
     code_exist = await get_password_reset_code_sent_to_email(user.code, db)
     if code_exist is None:
         raise fastapi.HTTPException(status_code=403, detail="invalid code")
@@ -74,7 +76,7 @@ async def reset_password(user: _schemas.UserResetPassword, db: orm.Session = fas
 @app.put('/users/profile/update')
 async def updateUserProfile(
         payload: _schemas.UpdateUserReq,
-        db: orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
         user: str = fastapi.Depends(is_authenticated)):
 
     updatedUser = await updateUserDetails(db, user.id, payload)
@@ -84,7 +86,7 @@ async def updateUserProfile(
 @app.patch('/users/password/update')
 async def updatePassword(
         payload: _schemas.updatePasswordRequest,
-        db: orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
         user: str = fastapi.Depends(is_authenticated)):
 
     dbResponse = await updateUserPassword(db, user.id, payload)
@@ -151,7 +153,7 @@ def accept_invite(
 
 
 @app.post("/users/invite/", status_code=201)
-async def invite_user(
+def invite_user(
     payload: _invite_schemas.UserInvite,
     background_tasks: BackgroundTasks,
     template: Optional[str] = "invite_email.html",
@@ -214,7 +216,7 @@ async def invite_user(
 @app.get('/users/invite/{invite_code}')
 async def get_single_invite(
     invite_code: str,
-    db: orm.Session = fastapi.Depends(get_db),
+    db: AsyncSession = fastapi.Depends(get_async_db),
 ):
 
     """
@@ -222,18 +224,17 @@ async def get_single_invite(
     """
 
     # user invite code to query the invite table
-    existing_invite = db.query(
-        store_invite_model.StoreInvite).filter(
+    existing_invite = (await db.execute(select(
+        store_invite_model.StoreInvite).where(
             and_(
                 store_invite_model.StoreInvite.invite_code == invite_code,
                 store_invite_model.StoreInvite.is_deleted == False,
                 store_invite_model.StoreInvite.is_revoked == False
-            )).first()
-    existing_user = db.query(user_models.User).filter(
-        user_models.User.email == existing_invite.user_email).first()
+            )))).scalars().first()
+    existing_user = (await db.execute(select(user_models.User).where(
+        user_models.User.email == existing_invite.user_email))).scalars().first()
 
-    store = db.query(organisation_models.Organization).filter(
-        organisation_models.Organization.id == existing_invite.store_id).first()
+    store = await db.get(organisation_models.Organization, existing_invite.store_id)
 
     # existing_invite.__setattr__('store', store)
     setattr(existing_invite, 'store', store)
@@ -345,7 +346,7 @@ def update_user_role(
 @app.post("/users/resend-verification/token")
 async def resend_token_verification(
     email: _schemas.UserTokenVerification,
-    db: orm.Session = fastapi.Depends(get_db),
+    db: AsyncSession = fastapi.Depends(get_async_db),
 ):
     return await resend_token_verification_mail(email.email, email.redirect_url, db)
 
@@ -353,7 +354,7 @@ async def resend_token_verification(
 @app.post("/users/verify/token/{token}")
 async def verify_user_with_token(
     token: str,
-    db: orm.Session = fastapi.Depends(get_db),
+    db: AsyncSession = fastapi.Depends(get_async_db),
 ):
     return await verify_user_token(token)
 
@@ -362,7 +363,7 @@ async def verify_user_with_token(
 async def password_change_with_token(
     password: _schemas.UserPasswordUpdate,
     token: str,
-    db: orm.Session = fastapi.Depends(get_db),
+    db: AsyncSession = fastapi.Depends(get_async_db),
 ):
     return await password_change_token(password, token, db)
 
@@ -426,11 +427,12 @@ async def updateUserImage(userId: str, db: orm.Session, imageEndpoint: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def get_password_reset_code_sent_to_email(code: str, db: orm.Session):
-    return db.query(auth_models.PasswordResetCode).filter(auth_models.PasswordResetCode.code == code).first()
+async def get_password_reset_code_sent_to_email(code: str, db: AsyncSession):
+    return (await db.execute(select(auth_models.PasswordResetCode).where(
+        auth_models.PasswordResetCode.code == code))).scalars().first()
 
 
-async def user_update(user_update: _schemas.UserUpdate, user: _schemas.User, db: orm.Session):
+async def user_update(user_update: _schemas.UserUpdate, user: _schemas.User, db: AsyncSession):
     user = await get_user(db=db, id=user.id)
 
     if user_update.first_name != "":
@@ -442,56 +444,55 @@ async def user_update(user_update: _schemas.UserUpdate, user: _schemas.User, db:
     if user_update.phone_number != "":
         user.phone_number = user_update.phone_number
 
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     return _schemas.User.fromorm(user)
 
 
-async def activate(user_activate: _schemas.UserActivate, user: _schemas.User, db: orm.Session):
+async def activate(user_activate: _schemas.UserActivate, user: _schemas.User, db: AsyncSession):
     user = await get_user(db=db, id=user_activate.email)
     user_activate.is_activte = True
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     return _schemas.User.fromorm(user)
 
 
-async def deactivate(user_activate: _schemas.UserActivate, user: _schemas.User, db: orm.Session):
+async def deactivate(user_activate: _schemas.UserActivate, user: _schemas.User, db: AsyncSession):
     user = await get_user(db=db, email=user_activate.email)
     user_activate.is_active = False
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return _schemas.User.fromorm(user)
 
 
-async def resetpassword(user: _schemas.UserResetPassword, id: str, db: orm.Session):
+async def resetpassword(user: _schemas.UserResetPassword, id: str, db: AsyncSession):
     user_found = await get_user(db, id=id)
-    user_found.password = _hash.sha256_crypt.hash(user.password)
-    db.query(auth_models.PasswordResetCode).filter(
-        auth_models.PasswordResetCode.user_id == user_found.id).delete()
-    db.commit()
-    db.refresh(user_found)
+    user_found.password = await passwords.hash_password(user.password)
+    await db.execute(delete(auth_models.PasswordResetCode).where(
+        auth_models.PasswordResetCode.user_id == user_found.id))
+    await db.commit()
+    await db.refresh(user_found)
     return "password reset successful"
 
 
-async def get_user(db: orm.Session, email="", id=""):
+async def get_user(db: AsyncSession, email="", id=""):
     if email != "":
-        return db.query(user_models.User).filter(user_models.User.email == email).first()
+        return (await db.execute(select(user_models.User).where(user_models.User.email == email))).scalars().first()
     if id != "":
-        return db.query(user_models.User).filter(user_models.User.id == id).first()
+        return await db.get(user_models.User, id)
 
 
-async def delete_password_reset_code(db: orm.Session, user_id: str):
-    db.query(auth_models.PasswordResetCode).filter(
-        auth_models.PasswordResetCode.user_id == user_id).delete()
-    db.commit()
+async def delete_password_reset_code(db: AsyncSession, user_id: str):
+    await db.execute(delete(auth_models.PasswordResetCode).where(
+        auth_models.PasswordResetCode.user_id == user_id))
+    await db.commit()
 
 
 # Update user profile/Bio
-async def updateUserDetails(db: orm.Session, userId: str, payload: _schemas.UpdateUserReq):
-    user = db.query(user_models.User).filter(
-        user_models.User.id == userId).first()
+async def updateUserDetails(db: AsyncSession, userId: str, payload: _schemas.UpdateUserReq):
+    user = await db.get(user_models.User, userId)
 
     user.first_name = payload.first_name
     user.last_name = payload.last_name
@@ -501,23 +502,22 @@ async def updateUserDetails(db: orm.Session, userId: str, payload: _schemas.Upda
     user.country = payload.country
 
     try:
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         return user
     except:
         raise HTTPException(status_code=500, detail='Something went wrong')
 
 
 # Update user profile/Bio
-async def updateUserPassword(db: orm.Session, userId: str, payload: _schemas.updatePasswordRequest):
+async def updateUserPassword(db: AsyncSession, userId: str, payload: _schemas.updatePasswordRequest):
     if payload.password == payload.password_confirmation:
-        user = db.query(user_models.User).filter(
-            user_models.User.id == userId).first()
-        user.password = _hash.sha256_crypt.hash(payload.password)
+        user = await db.get(user_models.User, userId)
+        user.password = await passwords.hash_password(payload.password)
 
         try:
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            await db.refresh(user)
             return user
         except:
             raise HTTPException(status_code=500, detail='Something went wrong')
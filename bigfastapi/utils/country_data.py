@@ -0,0 +1,79 @@
+import hashlib
+import json
+from functools import lru_cache
+
+import pkg_resources
+
+DATA_PATH = pkg_resources.resource_filename('bigfastapi', 'data/')
+
+
+def _without(data: dict, *keys):
+    return {key: value for key, value in data.items() if key not in keys}
+
+
+def _serialize(content):
+    body = json.dumps(content).encode("utf-8")
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    return body, etag
+
+
+class CountryData:
+    """countries.json and dialcode.json, indexed and with the responses of
+    the countries endpoints serialized up front.
+
+    Serialized responses are (body, etag) tuples.
+    """
+
+    def __init__(self, countries: list, dialcodes: list):
+        self.countries = countries
+        self.by_code = {}
+        self.by_name = {}
+        self.by_dial_code = {}
+        for country in countries:
+            self.by_code.setdefault(country["iso2"].casefold(), country)
+            self.by_code.setdefault(country["iso3"].casefold(), country)
+            self.by_name.setdefault(country["name"], country)
+        for dialcode in dialcodes:
+            self.by_dial_code.setdefault(dialcode["dial_code"], dialcode)
+
+        self.countries_response = _serialize(
+            [_without(country, "states", "dial_code", "sample_phone_format") for country in countries])
+        self.codes_response = _serialize(
+            [_without(country, "states", "flag_url", "flag_unicode")
+             for country in countries if country["dial_code"] != ""])
+        self._states_responses = {}
+        self._code_responses = {}
+
+    def country(self, code: str):
+        """Returns the country with iso2 or iso3 code, in any case, or None"""
+        return self.by_code.get(code.casefold())
+
+    def states_response(self, code: str):
+        country = self.country(code)
+        if country is None:
+            return None
+        key = country["iso2"]
+        if key not in self._states_responses:
+            self._states_responses[key] = _serialize(
+                _without(country, "dial_code", "sample_phone_format"))
+        return self._states_responses[key]
+
+    def code_response(self, code: str):
+        country = self.country(code)
+        if country is None or country["dial_code"] == "":
+            return None
+        key = country["iso2"]
+        if key not in self._code_responses:
+            self._code_responses[key] = _serialize(
+                _without(country, "states", "flag_url", "flag_unicode"))
+        return self._code_responses[key]
+
+
+@lru_cache(maxsize=None)
+def get_country_data():
+    """Loads the country data the first time it is needed"""
+    with open(DATA_PATH + "/countries.json") as file:
+        countries = json.load(file)
+    with open(DATA_PATH + "/dialcode.json") as file:
+        dialcodes = json.load(file)
+    return CountryData(countries, dialcodes)
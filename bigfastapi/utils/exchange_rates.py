@@ -0,0 +1,121 @@
+import asyncio
+import datetime as _dt
+import logging
+import time
+from uuid import uuid4
+
+import httpx
+from sqlalchemy import func, select
+
+from bigfastapi.db import database
+from bigfastapi.models import credit_wallet_conversion_models as model
+from bigfastapi.schemas import credit_wallet_conversion_schemas as schema
+from bigfastapi.utils import http_client, settings
+
+logger = logging.getLogger(__name__)
+
+
+def _upsert(dialect: str, rows: list):
+    """Inserts rows, or updates the rate of existing market rates"""
+    table = model.CreditWalletConversion.__table__
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(rows)
+        return statement.on_duplicate_key_update(
+            rate=func.if_(table.c.is_market_rate, statement.inserted.rate, table.c.rate),
+            last_updated=func.if_(table.c.is_market_rate, statement.inserted.last_updated, table.c.last_updated))
+
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.currency_code],
+        set_={"rate": statement.excluded.rate, "last_updated": statement.excluded.last_updated},
+        where=table.c.is_market_rate == True)
+
+
+async def store_market_rates(rates: dict, db):
+    """Stores a whole table of market rates in one statement.
+
+    Rates an admin has set are not overwritten. Does not commit.
+    """
+    now = _dt.datetime.utcnow()
+    rows = [{"id": uuid4().hex, "currency_code": currency, "rate": rate, "is_market_rate": True,
+             "last_updated": now}
+            for currency, rate in rates.items() if len(currency) <= 4]
+    if rows:
+        await db.execute(_upsert(db.bind.dialect.name, rows))
+
+
+class RateCache:
+    """The conversion rates table, held in memory.
+
+    Rates are served from memory. Once they are older than
+    EXCHANGE_RATE_CACHE_SECONDS they are still served, while a background
+    task reloads them. Only the first read of a cold cache waits for the
+    database.
+    """
+
+    def __init__(self):
+        self.rates = None
+        self.loaded_at = 0.0
+        self._reloading = None
+
+    async def get(self, currency: str, db):
+        """Returns the conversion rate of currency, or None"""
+        if self.rates is None:
+            await self.reload(db)
+        elif time.monotonic() - self.loaded_at > settings.EXCHANGE_RATE_CACHE_SECONDS:
+            self.revalidate()
+        rate = self.rates.get(currency)
+        return rate if rate is not None else self.rates.get(currency.upper())
+
+    async def reload(self, db):
+        rows = (await db.execute(select(model.CreditWalletConversion))).scalars().all()
+        self.rates = {row.currency_code: schema.CreditWalletConversion.from_orm(row) for row in rows}
+        self.loaded_at = time.monotonic()
+
+    def revalidate(self):
+        """Starts a reload in the background, unless one is running"""
+        if self._reloading is None or self._reloading.done():
+            self._reloading = asyncio.get_running_loop().create_task(self._reload())
+
+    async def _reload(self):
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await self.reload(db)
+        except Exception:
+            logger.exception("Could not reload conversion rates")
+
+    def set(self, rate: model.CreditWalletConversion):
+        """Updates a rate after it was written to the database"""
+        if self.rates is not None:
+            self.rates[rate.currency_code] = schema.CreditWalletConversion.from_orm(rate)
+
+    def clear(self):
+        self.rates = None
+        self.loaded_at = 0.0
+
+
+rate_cache = RateCache()
+
+
+async def refresh_market_rates(db):
+    """Stores the latest freecurrencyapi rates, if an api key is set, and
+    reloads the cache"""
+    if settings.FREECURRENCY_API_KEY.strip() != '':
+        try:
+            response = await http_client.get(settings.FREECURRENCY_API_URL + '/api/v2/latest',
+                                             params={'apikey': settings.FREECURRENCY_API_KEY})
+            response.raise_for_status()
+            rates = response.json()['data']
+        except (httpx.HTTPError, KeyError, ValueError):
+            logger.exception("Could not fetch market rates")
+        else:
+            rates['USD'] = 1
+            await store_market_rates(rates, db)
+            await db.commit()
+
+    await rate_cache.reload(db)
@@ -0,0 +1,89 @@
+import asyncio
+import random
+
+import httpx
+import stripe
+from starlette.concurrency import run_in_threadpool
+
+from bigfastapi.utils import settings
+
+# responses worth trying again, the provider may answer differently later
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_client = None
+
+
+def get_client():
+    """Returns the HTTP client shared by all provider calls, so their
+    connections are kept alive and reused"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=settings.HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=settings.HTTP_MAX_CONNECTIONS))
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _backoff(attempt: int):
+    # full jitter, so clients that failed together do not retry together
+    return random.uniform(0, settings.HTTP_BACKOFF_SECONDS * 2 ** attempt)
+
+
+async def request(method: str, url: str, retries: int = None, **kwargs):
+    """Sends a request with the shared client, retrying with backoff.
+
+    Requests that never reached the provider are always retried. Timeouts
+    and RETRY_STATUS_CODES responses are only retried for idempotent
+    methods, since a POST may already have been acted on. The last response
+    is returned whatever its status; the last error is raised.
+    """
+    if retries is None:
+        retries = settings.HTTP_RETRIES
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+
+    for attempt in range(retries + 1):
+        last_attempt = attempt == retries
+        try:
+            response = await get_client().request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+            if last_attempt:
+                raise
+        except httpx.TransportError:
+            if last_attempt or not idempotent:
+                raise
+        else:
+            if last_attempt or not idempotent or response.status_code not in RETRY_STATUS_CODES:
+                return response
+        await asyncio.sleep(_backoff(attempt))
+
+
+async def get(url: str, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs):
+    return await request("POST", url, **kwargs)
+
+
+# The Stripe SDK is configured through module globals, so they are set once
+# here rather than per call from the thread pool. It keeps a connection per
+# thread, retries on its own (with idempotency keys, so retried creates are
+# safe) and times out after HTTP_TIMEOUT_SECONDS.
+stripe.default_http_client = stripe.http_client.RequestsClient(timeout=settings.HTTP_TIMEOUT_SECONDS)
+stripe.max_network_retries = settings.HTTP_RETRIES
+stripe.api_key = settings.STRIPE_SEC_KEY
+stripe.api_base = settings.STRIPE_API_URL
+
+
+async def call_stripe(operation, *args, **kwargs):
+    """Runs a blocking Stripe SDK call on the thread pool"""
+    return await run_in_threadpool(operation, *args, **kwargs)
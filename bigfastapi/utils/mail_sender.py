@@ -0,0 +1,107 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr, formatdate, make_msgid
+
+import aiosmtplib
+from fastapi_mail import ConnectionConfig
+
+
+class RateLimiter:
+    """Spaces out calls to wait() to at most rate a second, 0 for no limit"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next = 0.0
+
+    async def wait(self):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        delay = self._next - now
+        self._next = max(now, self._next) + 1 / self.rate
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class SMTPPool:
+    """Up to size authenticated connections to the SMTP server in config,
+    kept open between messages.
+
+    Sends are limited to rate messages a second across the pool. A
+    connection that fails is closed rather than given back.
+    """
+
+    def __init__(self, config: ConnectionConfig, size: int, rate: float = 0):
+        self.config = config
+        self.size = size
+        self.rate_limiter = RateLimiter(rate)
+        self._idle = []
+        self._slots = None
+        self._loop = None
+
+    async def _connect(self):
+        smtp = aiosmtplib.SMTP(hostname=self.config.MAIL_SERVER, port=self.config.MAIL_PORT,
+                               use_tls=self.config.MAIL_SSL, start_tls=self.config.MAIL_TLS,
+                               validate_certs=self.config.VALIDATE_CERTS)
+        await smtp.connect()
+        if self.config.USE_CREDENTIALS:
+            await smtp.login(self.config.MAIL_USERNAME, self.config.MAIL_PASSWORD)
+        return smtp
+
+    @asynccontextmanager
+    async def connection(self):
+        # connections belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._idle, self._slots = loop, [], asyncio.Semaphore(self.size)
+
+        async with self._slots:
+            smtp = None
+            while self._idle and smtp is None:
+                smtp = self._idle.pop()
+                if not smtp.is_connected:
+                    smtp = None
+            if smtp is None:
+                smtp = await self._connect()
+
+            try:
+                yield smtp
+            except BaseException:
+                smtp.close()
+                raise
+            self._idle.append(smtp)
+
+    async def send(self, message):
+        await self.rate_limiter.wait()
+        try:
+            async with self.connection() as smtp:
+                await smtp.send_message(message)
+        except aiosmtplib.SMTPServerDisconnected:
+            # the server may have dropped an idle connection, try a new one
+            async with self.connection() as smtp:
+                await smtp.send_message(message)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for smtp in idle:
+            try:
+                await smtp.quit()
+            except aiosmtplib.SMTPException:
+                smtp.close()
+
+
+def build_message(config: ConnectionConfig, subject: str, recipients: list, html: str):
+    """Returns the MIME message for an html body, with the same headers
+    fastapi_mail sends
+    """
+    message = MIMEMultipart("mixed")
+    message["Date"] = formatdate(localtime=True)
+    message["Message-ID"] = make_msgid()
+    message["To"] = ", ".join(recipients)
+    message["From"] = formataddr((config.MAIL_FROM_NAME, config.MAIL_FROM)) if config.MAIL_FROM_NAME else config.MAIL_FROM
+    message["Subject"] = subject
+    message.attach(MIMEText(html, "html", "utf-8"))
+    return message
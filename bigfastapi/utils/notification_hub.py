@@ -0,0 +1,89 @@
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+
+class Broker:
+    """Carries published messages to the hubs of every process.
+
+    A broker hands each message given to publish(), by any process, to the
+    handler given to start(). InMemoryBroker only reaches this process; a
+    broker over Redis or Postgres LISTEN/NOTIFY lets several workers fan out.
+    """
+
+    async def start(self, handler):
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class InMemoryBroker(Broker):
+    """A broker for a single process, and tests"""
+
+    def __init__(self):
+        self._handler = None
+
+    async def start(self, handler):
+        self._handler = handler
+
+    async def publish(self, channel: str, message: str):
+        if self._handler is not None:
+            await self._handler(channel, message)
+
+
+class NotificationHub:
+    """Pushes messages to the subscribers of a recipient.
+
+    Messages go out through the broker and come back to every process's hub,
+    which queues them for its own subscribers. A subscriber that falls more
+    than queue_size messages behind loses the oldest.
+    """
+
+    def __init__(self, broker: Broker = None, queue_size: int = 100):
+        self.broker = broker or InMemoryBroker()
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._started = False
+
+    async def start(self):
+        if not self._started:
+            self._started = True
+            await self.broker.start(self._deliver)
+
+    async def stop(self):
+        if self._started:
+            self._started = False
+            await self.broker.stop()
+
+    async def publish(self, recipient: str, message: str):
+        await self.start()
+        await self.broker.publish(recipient, message)
+
+    @asynccontextmanager
+    async def subscribe(self, recipient: str):
+        """Yields a queue of the messages published to recipient while subscribed"""
+        await self.start()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[recipient].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[recipient].discard(queue)
+            if not self._subscribers[recipient]:
+                del self._subscribers[recipient]
+
+    def subscriber_count(self, recipient: str):
+        return len(self._subscribers.get(recipient, ()))
+
+    async def _deliver(self, recipient: str, message: str):
+        for queue in list(self._subscribers.get(recipient, ())):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+
+hub = NotificationHub()
@@ -0,0 +1,33 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from bigfastapi.utils import settings
+
+# sha256_crypt spends tens of milliseconds of CPU per hash. The work is done
+# in C with the GIL released, so a thread pool keeps it off the event loop
+# and lets concurrent logins use every core.
+pwd_context = CryptContext(
+    schemes=["sha256_crypt"],
+    sha256_crypt__default_rounds=settings.PASSWORD_HASH_ROUNDS,
+    sha256_crypt__min_rounds=settings.PASSWORD_HASH_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS,
+                               thread_name_prefix="password-hash")
+
+
+async def hash_password(password: str):
+    """Returns the sha256_crypt hash of password"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed: str):
+    """Checks password against hashed.
+
+    Returns a (valid, new_hash) tuple. new_hash is None unless the password
+    is valid and hashed was made with fewer than PASSWORD_HASH_ROUNDS rounds,
+    in which case it should replace the stored hash.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, pwd_context.verify_and_update, password, hashed)
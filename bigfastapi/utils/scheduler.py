@@ -0,0 +1,162 @@
+import asyncio
+import datetime as _dt
+import json
+import logging
+from uuid import uuid4
+
+from sqlalchemy import func, select, update
+
+from bigfastapi.db import database
+from bigfastapi.models import scheduled_job_models as model
+from bigfastapi.utils import settings
+
+logger = logging.getLogger(__name__)
+
+
+def utc(moment: _dt.datetime):
+    """Returns moment as a naive UTC datetime, taking naive moments as local time"""
+    return moment.astimezone(_dt.timezone.utc).replace(tzinfo=None)
+
+
+class Scheduler:
+    """Runs scheduled jobs when they are due.
+
+    Handlers are registered by job type with handler(). A single loop sleeps
+    until the next job is due, or until wake() is called, and runs due jobs
+    in batches of SCHEDULED_JOB_BATCH_SIZE.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self._task = None
+        self._loop = None
+        self._wakeup = None
+        self._next_run_at = None
+
+    def handler(self, job_type: str):
+        """Registers the decorated coroutine as the handler for job_type.
+
+        It is called with the job's payload and the session the job is
+        marked done in.
+        """
+        def register(function):
+            self.handlers[job_type] = function
+            return function
+        return register
+
+    def schedule(self, job_type: str, payload: dict, run_at: _dt.datetime, db):
+        """Adds a job to db, to run at run_at. The caller commits, then calls wake()"""
+        job = model.ScheduledJob(id=uuid4().hex, job_type=job_type, payload=json.dumps(payload, default=str),
+                                 run_at=utc(run_at), status="pending", attempts=0)
+        db.add(job)
+        return job
+
+    def wake(self, run_at: _dt.datetime = None):
+        """Makes the loop look for due jobs now, if run_at is sooner than it
+        was going to. Safe to call from any thread.
+        """
+        if self._loop is None:
+            return
+        if run_at is not None and self._next_run_at is not None and utc(run_at) >= self._next_run_at:
+            return
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = self._loop = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                while await self.run_due_jobs() == settings.SCHEDULED_JOB_BATCH_SIZE:
+                    pass
+                self._next_run_at = await self.next_run_at()
+            except Exception:
+                logger.exception("Could not run scheduled jobs")
+                self._next_run_at = None
+
+            timeout = settings.SCHEDULER_MAX_SLEEP_SECONDS
+            if self._next_run_at is not None:
+                timeout = min(timeout, max((self._next_run_at - _dt.datetime.utcnow()).total_seconds(), 0))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def next_run_at(self):
+        async with database.AsyncSessionLocal() as db:
+            return (await db.execute(
+                select(func.min(model.ScheduledJob.run_at))
+                    .where(model.ScheduledJob.status.in_(["pending", "running"])))).scalar()
+
+    async def run_due_jobs(self):
+        """Claims a batch of due jobs and runs them one at a time, each in a
+        savepoint and its own commit.
+
+        Returns the number of jobs claimed.
+        """
+        claim_id = uuid4().hex
+        now = _dt.datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            due_ids = (await db.execute(
+                select(model.ScheduledJob.id)
+                    .where(model.ScheduledJob.status.in_(["pending", "running"]))
+                    .where(model.ScheduledJob.run_at <= now)
+                    .order_by(model.ScheduledJob.run_at)
+                    .limit(settings.SCHEDULED_JOB_BATCH_SIZE))).scalars().all()
+            if not due_ids:
+                return 0
+
+            # claim the batch, less any job another scheduler claimed meanwhile
+            await db.execute(
+                update(model.ScheduledJob)
+                    .where(model.ScheduledJob.id.in_(due_ids))
+                    .where(model.ScheduledJob.status.in_(["pending", "running"]))
+                    .where(model.ScheduledJob.run_at <= now)
+                    .values(status="running", claim_id=claim_id, attempts=model.ScheduledJob.attempts + 1,
+                            run_at=now + _dt.timedelta(seconds=settings.SCHEDULED_JOB_LEASE_SECONDS),
+                            last_updated=now)
+                    .execution_options(synchronize_session=False))
+            await db.commit()
+            jobs = (await db.execute(
+                select(model.ScheduledJob).filter_by(claim_id=claim_id, status="running"))).scalars().all()
+
+            # each job commits on its own, so a job's writes are never held up by the rest of the batch
+            for job in jobs:
+                try:
+                    async with db.begin_nested():
+                        await self.handlers[job.job_type](json.loads(job.payload), db=db)
+                    await db.execute(
+                        update(model.ScheduledJob)
+                            .where(model.ScheduledJob.id == job.id)
+                            .values(status="done", last_error=None, last_updated=_dt.datetime.utcnow())
+                            .execution_options(synchronize_session=False))
+                except Exception as e:
+                    logger.exception("Could not run scheduled job %s", job.id)
+                    dead = job.attempts >= settings.SCHEDULED_JOB_MAX_ATTEMPTS or job.job_type not in self.handlers
+                    await db.execute(
+                        update(model.ScheduledJob)
+                            .where(model.ScheduledJob.id == job.id)
+                            .values(status="dead" if dead else "pending", last_error=repr(e),
+                                    run_at=_dt.datetime.utcnow() + _dt.timedelta(
+                                        seconds=settings.SCHEDULED_JOB_BACKOFF_SECONDS * 2 ** (job.attempts - 1)),
+                                    last_updated=_dt.datetime.utcnow())
+                            .execution_options(synchronize_session=False))
+                await db.commit()
+            return len(due_ids)
+
+
+scheduler = Scheduler()
@@ -1,5 +1,5 @@
 import os
-from decouple import config
+from decouple import Csv, config
 import pkg_resources
 JWT_SECRET = config("JWT_SECRET")
 GOOGLE_CLIENT_ID = config("GOOGLE_CLIENT_ID")
@@ -16,6 +16,112 @@ TEMPLATE_FOLDER = config('TEMPLATE_FOLDER')
 # EMAIL_VERIFICATION_TEMPLATE = config('EMAIL_VERIFICATION_TEMPLATE')
 # PASSWORD_RESET_TEMPLATE = config('PASSWORD_RESET_TEMPLATE')
 FILES_BASE_FOLDER = config('FILES_BASE_FOLDER')
+# How long a verified access token and its user are trusted without a query.
+# Changes made by other workers or bulk statements show up after at most this
+# many seconds; 0 turns the cache off.
+AUTH_CACHE_SECONDS = config('AUTH_CACHE_SECONDS', default=60, cast=int)
+AUTH_CACHE_SIZE = config('AUTH_CACHE_SIZE', default=10000, cast=int)
+# Password hashes are computed on a pool of PASSWORD_HASH_WORKERS threads.
+# Raising PASSWORD_HASH_ROUNDS upgrades existing hashes as users log in.
+PASSWORD_HASH_ROUNDS = config('PASSWORD_HASH_ROUNDS', default=535000, cast=int)
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 1, cast=int)
+# How often wallet balances are checked against their transactions, 0 to never
+WALLET_RECONCILE_SECONDS = config('WALLET_RECONCILE_SECONDS', default=3600, cast=int)
+# Number of rows the platform wallet's balance is spread over
+ADMIN_WALLET_SHARDS = config('ADMIN_WALLET_SHARDS', default=16, cast=int)
+# Payment and exchange rate providers. Their calls share a pool of
+# HTTP_MAX_CONNECTIONS kept-alive connections and are retried HTTP_RETRIES
+# times, waiting up to HTTP_BACKOFF_SECONDS, doubled at each attempt.
+STRIPE_SEC_KEY = config('STRIPE_SEC_KEY', default='')
+STRIPE_API_URL = config('STRIPE_API_URL', default='https://api.stripe.com')
+FLUTTERWAVE_SEC_KEY = config('FLUTTERWAVE_SEC_KEY', default='')
+FLUTTERWAVE_API_URL = config('FLUTTERWAVE_API_URL', default='https://api.flutterwave.com')
+FREECURRENCY_API_KEY = config('FREECURRENCY_API_KEY', default='')
+FREECURRENCY_API_URL = config('FREECURRENCY_API_URL', default='https://freecurrencyapi.net')
+HTTP_TIMEOUT_SECONDS = config('HTTP_TIMEOUT_SECONDS', default=10, cast=float)
+HTTP_MAX_CONNECTIONS = config('HTTP_MAX_CONNECTIONS', default=20, cast=int)
+HTTP_RETRIES = config('HTTP_RETRIES', default=2, cast=int)
+HTTP_BACKOFF_SECONDS = config('HTTP_BACKOFF_SECONDS', default=0.5, cast=float)
+# Conversion rates are served from memory and reloaded in the background
+# once older than EXCHANGE_RATE_CACHE_SECONDS. Market rates are fetched every
+# EXCHANGE_RATE_REFRESH_SECONDS, 0 to never.
+EXCHANGE_RATE_CACHE_SECONDS = config('EXCHANGE_RATE_CACHE_SECONDS', default=300, cast=int)
+EXCHANGE_RATE_REFRESH_SECONDS = config('EXCHANGE_RATE_REFRESH_SECONDS', default=3600, cast=int)
+# Payment webhooks are stored and applied by PAYMENT_EVENT_WORKERS concurrent
+# workers, polling every PAYMENT_EVENT_POLL_SECONDS (0 to never) for batches of
+# up to PAYMENT_EVENT_BATCH_SIZE. A failed event is retried after
+# PAYMENT_EVENT_BACKOFF_SECONDS, doubled at each attempt, and dead-lettered
+# after PAYMENT_EVENT_MAX_ATTEMPTS. A claimed event is given back after
+# PAYMENT_EVENT_LEASE_SECONDS in case its worker died. With
+# PAYMENT_CALLBACKS_QUEUED the payment redirects are queued the same way.
+STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
+FLUTTERWAVE_WEBHOOK_HASH = config('FLUTTERWAVE_WEBHOOK_HASH', default='')
+PAYMENT_EVENT_WORKERS = config('PAYMENT_EVENT_WORKERS', default=4, cast=int)
+PAYMENT_EVENT_POLL_SECONDS = config('PAYMENT_EVENT_POLL_SECONDS', default=5, cast=float)
+PAYMENT_EVENT_BATCH_SIZE = config('PAYMENT_EVENT_BATCH_SIZE', default=50, cast=int)
+PAYMENT_EVENT_BACKOFF_SECONDS = config('PAYMENT_EVENT_BACKOFF_SECONDS', default=30, cast=float)
+PAYMENT_EVENT_MAX_ATTEMPTS = config('PAYMENT_EVENT_MAX_ATTEMPTS', default=5, cast=int)
+PAYMENT_EVENT_LEASE_SECONDS = config('PAYMENT_EVENT_LEASE_SECONDS', default=300, cast=float)
+PAYMENT_CALLBACKS_QUEUED = config('PAYMENT_CALLBACKS_QUEUED', default=False, cast=bool)
+# How often credit wallet balances are snapshotted, 0 to never. Running
+# balances in the credit history are summed from the last snapshot.
+CREDIT_SNAPSHOT_SECONDS = config('CREDIT_SNAPSHOT_SECONDS', default=86400, cast=int)
+# Emails are queued in the email outbox and sent by a worker polling every
+# EMAIL_OUTBOX_POLL_SECONDS (0 to never) for batches of up to
+# EMAIL_OUTBOX_BATCH_SIZE, over at most EMAIL_SMTP_CONNECTIONS reused SMTP
+# connections and at most EMAIL_RATE_PER_SECOND messages a second (0 for no
+# limit). A failed email is retried after EMAIL_OUTBOX_BACKOFF_SECONDS, doubled
+# at each attempt, and dead-lettered after EMAIL_OUTBOX_MAX_ATTEMPTS. A claimed
+# batch is given back after EMAIL_OUTBOX_LEASE_SECONDS in case its worker died.
+EMAIL_SMTP_CONNECTIONS = config('EMAIL_SMTP_CONNECTIONS', default=4, cast=int)
+EMAIL_RATE_PER_SECOND = config('EMAIL_RATE_PER_SECOND', default=10, cast=float)
+EMAIL_OUTBOX_POLL_SECONDS = config('EMAIL_OUTBOX_POLL_SECONDS', default=5, cast=float)
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=100, cast=int)
+EMAIL_OUTBOX_BACKOFF_SECONDS = config('EMAIL_OUTBOX_BACKOFF_SECONDS', default=60, cast=float)
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+EMAIL_OUTBOX_LEASE_SECONDS = config('EMAIL_OUTBOX_LEASE_SECONDS', default=600, cast=float)
+# Campaign recipients are queued EMAIL_CAMPAIGN_CHUNK_SIZE at a time. Emails
+# are rendered on a pool of EMAIL_RENDER_WORKERS threads.
+EMAIL_CAMPAIGN_CHUNK_SIZE = config('EMAIL_CAMPAIGN_CHUNK_SIZE', default=1000, cast=int)
+EMAIL_RENDER_WORKERS = config('EMAIL_RENDER_WORKERS', default=os.cpu_count() or 1, cast=int)
+# Compiled email templates are cached on disk in TEMPLATE_BYTECODE_CACHE_DIR,
+# the system temporary folder if empty. Turn on TEMPLATE_AUTO_RELOAD in
+# development to pick up template edits without a restart.
+TEMPLATE_BYTECODE_CACHE_DIR = config('TEMPLATE_BYTECODE_CACHE_DIR', default='')
+TEMPLATE_AUTO_RELOAD = config('TEMPLATE_AUTO_RELOAD', default=False, cast=bool)
+# Notification streams send a comment every NOTIFICATION_STREAM_HEARTBEAT_SECONDS
+# to keep idle connections open through proxies
+NOTIFICATION_STREAM_HEARTBEAT_SECONDS = config('NOTIFICATION_STREAM_HEARTBEAT_SECONDS', default=15, cast=float)
+# Notifications fanned out to an audience are created NOTIFICATION_FANOUT_CHUNK_SIZE
+# at a time, the first chunk in the request and the rest by the scheduler
+NOTIFICATION_FANOUT_CHUNK_SIZE = config('NOTIFICATION_FANOUT_CHUNK_SIZE', default=1000, cast=int)
+# Read notifications are moved to the archive table NOTIFICATION_TTL_DAYS after
+# they were created, or deleted if NOTIFICATION_ARCHIVE_EXPIRED is off. The type
+# of a notification is the prefix of its reference, eg. comment-1234, and
+# NOTIFICATION_TTL_DAYS_BY_TYPE overrides the TTL of some types, eg.
+# comment:30,blog:365. A TTL of 0 keeps notifications forever. Archived
+# notifications are deleted after NOTIFICATION_ARCHIVE_TTL_DAYS, 0 to keep them.
+# Expired notifications are looked for every NOTIFICATION_RETENTION_INTERVAL_SECONDS,
+# 0 to not look, and handled NOTIFICATION_RETENTION_BATCH_SIZE per transaction.
+NOTIFICATION_TTL_DAYS = config('NOTIFICATION_TTL_DAYS', default=90, cast=float)
+NOTIFICATION_TTL_DAYS_BY_TYPE = config('NOTIFICATION_TTL_DAYS_BY_TYPE', default='',
+                                       cast=Csv(cast=lambda ttl: (ttl.split(':')[0], float(ttl.split(':')[1])),
+                                                post_process=dict))
+NOTIFICATION_ARCHIVE_EXPIRED = config('NOTIFICATION_ARCHIVE_EXPIRED', default=True, cast=bool)
+NOTIFICATION_ARCHIVE_TTL_DAYS = config('NOTIFICATION_ARCHIVE_TTL_DAYS', default=0, cast=float)
+NOTIFICATION_RETENTION_INTERVAL_SECONDS = config('NOTIFICATION_RETENTION_INTERVAL_SECONDS', default=3600, cast=float)
+NOTIFICATION_RETENTION_BATCH_SIZE = config('NOTIFICATION_RETENTION_BATCH_SIZE', default=1000, cast=int)
+# Scheduled jobs are run in batches of up to SCHEDULED_JOB_BATCH_SIZE when due.
+# The scheduler checks for jobs added by other processes at least every
+# SCHEDULER_MAX_SLEEP_SECONDS, 0 to not run it. A failed job is retried after
+# SCHEDULED_JOB_BACKOFF_SECONDS, doubled at each attempt, and dead-lettered
+# after SCHEDULED_JOB_MAX_ATTEMPTS. A claimed job is given back after
+# SCHEDULED_JOB_LEASE_SECONDS in case its scheduler died.
+SCHEDULER_MAX_SLEEP_SECONDS = config('SCHEDULER_MAX_SLEEP_SECONDS', default=60, cast=float)
+SCHEDULED_JOB_BATCH_SIZE = config('SCHEDULED_JOB_BATCH_SIZE', default=500, cast=int)
+SCHEDULED_JOB_BACKOFF_SECONDS = config('SCHEDULED_JOB_BACKOFF_SECONDS', default=60, cast=float)
+SCHEDULED_JOB_MAX_ATTEMPTS = config('SCHEDULED_JOB_MAX_ATTEMPTS', default=5, cast=int)
+SCHEDULED_JOB_LEASE_SECONDS = config('SCHEDULED_JOB_LEASE_SECONDS', default=600, cast=float)
 
 # EMAIL_VERIFICATION_TEMPLATE="email/welcome_email.html"
 # PASSWORD_RESET_TEMPLATE="email/password_reset.html"
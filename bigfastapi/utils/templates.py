@@ -0,0 +1,54 @@
+import logging
+import os
+from functools import lru_cache
+
+from fastapi_mail import ConnectionConfig
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateError
+
+from bigfastapi.utils import settings
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_environment(folder: str):
+    """Returns the Jinja environment shared by every render of the templates
+    in folder.
+
+    Templates are compiled the first time they are used and kept, and their
+    bytecode is cached in TEMPLATE_BYTECODE_CACHE_DIR for the next process.
+    With TEMPLATE_AUTO_RELOAD a template is recompiled when its file
+    changes, at the cost of checking the file on every render.
+    """
+    bytecode_cache_dir = settings.TEMPLATE_BYTECODE_CACHE_DIR or None
+    if bytecode_cache_dir is not None:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+    return Environment(loader=FileSystemLoader(folder), bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir),
+                       auto_reload=settings.TEMPLATE_AUTO_RELOAD, cache_size=-1)
+
+
+def precompile(folder: str):
+    """Compiles every html template in folder ahead of its first use.
+
+    Returns the number of templates compiled.
+    """
+    environment = get_environment(str(folder))
+    compiled = 0
+    for name in environment.list_templates(extensions=["html"]):
+        try:
+            environment.get_template(name)
+            compiled += 1
+        except TemplateError:
+            logger.exception("Could not compile template %s", name)
+    return compiled
+
+
+class TemplateConfig(ConnectionConfig):
+    """A fastapi_mail ConnectionConfig whose templates come from the shared
+    environment instead of a new one for every message
+    """
+
+    def template_engine(self) -> Environment:
+        if not self.TEMPLATE_FOLDER:
+            return super().template_engine()
+        return get_environment(str(self.TEMPLATE_FOLDER))
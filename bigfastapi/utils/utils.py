@@ -1,17 +1,25 @@
+import base64
 import json
 import random
 import re
+from datetime import datetime
 
 import fastapi
+import httpx
 import pkg_resources
-import requests
 import stripe
 import validators
 from decouple import config
+from fastapi_pagination.api import create_page, resolve_params
+from fastapi_pagination.bases import AbstractParams
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from stripe.error import InvalidRequestError
 
 from bigfastapi.schemas import users_schemas
+from bigfastapi.utils import http_client, settings
+from bigfastapi.utils.country_data import get_country_data
 from bigfastapi.schemas.wallet_schemas import PaymentProvider
 
 DATA_PATH = pkg_resources.resource_filename('bigfastapi', 'data/')
@@ -48,23 +56,124 @@ def paginate_data(data, page_size: int, page_number: int):
     }
 
 
+async def fetch_page(db, query, limit: int, offset: int):
+    """Runs query for one page of rows and counts all of its rows, both in the database.
+
+    db may be a Session or an AsyncSession. Returns (items, total).
+    """
+    count_query = select(func.count()).select_from(query.order_by(None).subquery())
+    page_query = query.limit(limit).offset(offset)
+    if isinstance(db, AsyncSession):
+        total = await db.scalar(count_query)
+        items = (await db.execute(page_query)).scalars().all()
+    else:
+        total = db.scalar(count_query)
+        items = db.execute(page_query).scalars().all()
+    return items, total
+
+
+async def paginate_query(db, query, params: AbstractParams = None):
+    """Like fastapi_pagination's paginate, but LIMIT/OFFSET and the COUNT run in SQL.
+
+    query should be ordered so that pages are stable.
+    """
+    params = resolve_params(params)
+    raw_params = params.to_raw_params()
+    items, total = await fetch_page(db, query, raw_params.limit, raw_params.offset)
+    return create_page(items, total, params)
+
+
+DATE_BUCKET_FORMATS = {
+    "postgresql": {"day": "YYYY-MM-DD", "month": "YYYY-MM"},
+    "mysql": {"day": "%Y-%m-%d", "month": "%Y-%m"},
+    "sqlite": {"day": "%Y-%m-%d", "month": "%Y-%m"},
+}
+
+
+def date_bucket(column, period: str, dialect: str):
+    """Returns an SQL expression formatting column as its day (2022-01-31)
+    or month (2022-01), to group rows by"""
+    date_format = DATE_BUCKET_FORMATS.get(dialect, DATE_BUCKET_FORMATS["sqlite"])[period]
+    if dialect == "postgresql":
+        return func.to_char(column, date_format)
+    if dialect == "mysql":
+        return func.date_format(column, date_format)
+    return func.strftime(date_format, column)
+
+
+def encode_cursor(timestamp: datetime, id: str):
+    raw = json.dumps([timestamp.isoformat(), id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), id
+    except (ValueError, TypeError):
+        raise fastapi.HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def cursor_query(query, timestamp_column, id_column, cursor: str = None, limit: int = 50):
+    """Orders query newest first over (timestamp_column, id_column) and
+    restricts it to the page after cursor, plus one row to tell if there
+    is a next page.
+    """
+    if cursor:
+        timestamp, id = decode_cursor(cursor)
+        query = query.where(tuple_(timestamp_column, id_column) < (timestamp, id))
+    return query.order_by(None).order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1)
+
+
+def cursor_page(items, timestamp_column, id_column, limit: int = 50):
+    """Builds a dict matching CursorPage from the rows of a cursor_query"""
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
+
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def paginate_cursor(db, query, timestamp_column, id_column, cursor: str = None, limit: int = 50):
+    """Keyset pagination over (timestamp_column, id_column), newest first.
+
+    cursor is the next_cursor of the previous page. Every page costs the same
+    however deep it is, given an index ending in (timestamp_column, id_column).
+    """
+    query = cursor_query(query, timestamp_column, id_column, cursor, limit)
+    if isinstance(db, AsyncSession):
+        items = (await db.execute(query)).scalars().all()
+    else:
+        items = db.execute(query).scalars().all()
+    return cursor_page(items, timestamp_column, id_column, limit)
+
+
+async def paginate_data_query(db, query, page_size: int, page_number: int):
+    """paginate_data for a query, without loading rows outside the page.
+    Pages before the first are the first page.
+    """
+    items, total = await fetch_page(db, query, page_size, (max(page_number, 1) - 1) * page_size)
+    return {
+        "data": items,
+        "total_documents": total,
+        "page_limit": page_size
+    }
+
+
 def find_country(ctry):
-    with open(DATA_PATH + "/countries.json") as file:
-        cap_country = ctry.capitalize()
-        countries = json.load(file)
-        found_country = next((country for country in countries if country['name'] == cap_country), None)
-        if found_country is None:
-            raise fastapi.HTTPException(status_code=403, detail="This country doesn't exist")
-        return found_country['name']
+    found_country = get_country_data().by_name.get(ctry.capitalize())
+    if found_country is None:
+        raise fastapi.HTTPException(status_code=403, detail="This country doesn't exist")
+    return found_country['name']
 
 
 def dialcode(dcode):
-    with open(DATA_PATH + "/dialcode.json") as file:
-        dialcodes = json.load(file)
-        found_dialcode = next((dialcode for dialcode in dialcodes if dialcode['dial_code'] == dcode), None)
-        if found_dialcode is None:
-            raise fastapi.HTTPException(status_code=403, detail="This is an invalid dialcode")
-        return found_dialcode['dial_code']
+    found_dialcode = get_country_data().by_dial_code.get(dcode)
+    if found_dialcode is None:
+        raise fastapi.HTTPException(status_code=403, detail="This is an invalid dialcode")
+    return found_dialcode['dial_code']
 
 
 def generate_code(new_length: int = None):
@@ -88,9 +197,9 @@ async def generate_payment_link(api_redirect_url: str,
                                 front_end_redirect_url='',
                                 ):
     if provider == PaymentProvider.STRIPE:
-        stripe.api_key = config('STRIPE_SEC_KEY')
         try:
-            session = stripe.checkout.Session.create(
+            session = await http_client.call_stripe(
+                stripe.checkout.Session.create,
                 line_items=[{
                     'price_data': {
                         'currency': currency,
@@ -112,9 +221,8 @@ async def generate_payment_link(api_redirect_url: str,
             raise fastapi.HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                         detail=str(e))
     else:
-        flutterwaveKey = config('FLUTTERWAVE_SEC_KEY')
-        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer ' + flutterwaveKey}
-        url = 'https://api.flutterwave.com/v3/payments/'
+        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer ' + settings.FLUTTERWAVE_SEC_KEY}
+        url = settings.FLUTTERWAVE_API_URL + '/v3/payments/'
         username = user.email if user.first_name is None else user.first_name
         username += '' if user.last_name is None else ' ' + user.last_name
         data = {
@@ -131,8 +239,11 @@ async def generate_payment_link(api_redirect_url: str,
                 "redirect_url": front_end_redirect_url
             }
         }
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code == 200:
+        try:
+            response = await http_client.post(url, headers=headers, json=data)
+        except httpx.HTTPError:
+            response = None
+        if response is not None and response.status_code == 200:
             jsonResponse = response.json()
             link = (jsonResponse.get('data'))['link']
             return link
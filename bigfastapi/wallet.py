@@ -1,30 +1,41 @@
 import datetime as _dt
+import logging
+import random
+from typing import Union
 from uuid import uuid4
 
 import fastapi
-import sqlalchemy.orm as _orm
 from fastapi import APIRouter, status
-from fastapi_pagination import Page, paginate, add_pagination
-from sqlalchemy import desc
-
-from bigfastapi.db.database import get_db
+from fastapi_pagination import Page, add_pagination
+from fastapi_utils.tasks import repeat_every
+from sqlalchemy import desc, event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bigfastapi.db import database
+from bigfastapi.db.database import get_async_db
+from bigfastapi.utils import settings
 from .auth_api import is_authenticated
 from .models import organisation_models as organisation_models, user_models
 from .models import wallet_models as model
 from .models import wallet_transaction_models as wallet_transaction_models
 from .schemas import users_schemas
+from .schemas.pagination_schemas import CursorPage
 from .schemas import wallet_schemas as schema
+from .utils.utils import paginate_cursor, paginate_query
 
 app = APIRouter(tags=["Wallet"])
 
+logger = logging.getLogger(__name__)
+
 
 @app.post("/wallets", response_model=schema.Wallet)
 async def create_wallet(body: schema.WalletCreate,
                         user: users_schemas.User = fastapi.Depends(is_authenticated),
-                        db: _orm.Session = fastapi.Depends(get_db)):
+                        db: AsyncSession = fastapi.Depends(get_async_db)):
     currency_code = body.currency_code.upper()
-    wallet = db.query(model.Wallet).filter_by(organization_id=body.organization_id).filter_by(
-        currency_code=currency_code).first()
+    wallet = (await db.execute(select(model.Wallet).filter_by(organization_id=body.organization_id).filter_by(
+        currency_code=currency_code))).scalars().first()
     # todo: why is create wallet returning an error?
     # wallet = _create_wallet(organization_id=body.organization_id, db=db)
     if wallet is None:
@@ -33,19 +44,24 @@ async def create_wallet(body: schema.WalletCreate,
                               last_updated=_dt.datetime.utcnow())
 
         db.add(wallet)
-        db.commit()
-        db.refresh(wallet)
-        return wallet
-    else:
-        raise fastapi.HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                    detail="Organization already has a " + body.currency_code + " wallet")
+        try:
+            await db.commit()
+        except IntegrityError:
+            # created by a concurrent request
+            await db.rollback()
+        else:
+            await db.refresh(wallet)
+            return wallet
+
+    raise fastapi.HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                detail="Organization already has a " + body.currency_code + " wallet")
 
 
 @app.get("/wallets/{organization_id}", response_model=Page[schema.Wallet])
 async def get_organization_wallets(
         organization_id: str,
         user: users_schemas.User = fastapi.Depends(is_authenticated),
-        db: _orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
 ):
     """Get all the wallets of an organization"""
     return await _get_organization_wallets(organization_id=organization_id, user=user, db=db)
@@ -56,36 +72,43 @@ async def get_organization_wallet(
         organization_id: str,
         currency: str,
         user: users_schemas.User = fastapi.Depends(is_authenticated),
-        db: _orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
 ):
     """Gets the wallet of an organization"""
-    return await _get_organization_wallet(organization_id=organization_id, currency=currency, user=user, db=db)
+    wallet = await _get_organization_wallet(organization_id=organization_id, currency=currency, user=user, db=db)
+    return (await _with_shard_balances(wallets=[wallet], db=db))[0]
 
 
-@app.get("/wallets/{organization_id}/{currency}/transactions", response_model=Page[schema.WalletTransaction])
+@app.get("/wallets/{organization_id}/{currency}/transactions",
+         response_model=Union[Page[schema.WalletTransaction], CursorPage[schema.WalletTransaction]])
 async def get_wallet_transactions(
         organization_id: str,
         currency: str,
+        cursor: str = None,
+        limit: int = fastapi.Query(None, ge=1, le=100),
         user: users_schemas.User = fastapi.Depends(is_authenticated),
-        db: _orm.Session = fastapi.Depends(get_db),
+        db: AsyncSession = fastapi.Depends(get_async_db),
 ):
-    """Get wallet transactions"""
+    """Get wallet transactions
+
+    Pass cursor and/or limit instead of page and size to page through the
+    transactions with the next_cursor of each response.
+    """
     wallet = await _get_organization_wallet(organization_id=organization_id, currency=currency, user=user, db=db)
-    return await _get_wallet_transactions(wallet_id=wallet.id, db=db)
+    return await _get_wallet_transactions(wallet_id=wallet.id, db=db, cursor=cursor, limit=limit)
 
 
 ############
 # Services #
 ############
 
-async def _get_organization(organization_id: str, db: _orm.Session,
+async def _get_organization(organization_id: str, db: AsyncSession,
                             user: users_schemas.User = fastapi.Depends(is_authenticated)):
-    organization = (
-        db.query(organisation_models.Organization)
+    organization = (await db.execute(
+        select(organisation_models.Organization)
             .filter_by(creator=user.id)
-            .filter(organisation_models.Organization.id == organization_id)
-            .first()
-    )
+            .where(organisation_models.Organization.id == organization_id)
+    )).scalars().first()
 
     if organization is None:
         raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Organization does not exist")
@@ -94,135 +117,287 @@ async def _get_organization(organization_id: str, db: _orm.Session,
 
 
 async def _create_wallet(organization_id: str,
-                         db: _orm.Session, currency_code: str):
+                         db: AsyncSession, currency_code: str):
     wallet = model.Wallet(id=uuid4().hex, organization_id=organization_id, balance=0,
                           last_updated=_dt.datetime.utcnow(), currency_code=currency_code)
 
     db.add(wallet)
-    db.commit()
-    db.refresh(wallet)
+    await db.commit()
+    await db.refresh(wallet)
     return wallet
 
 
-async def _get_wallet_balance(wallet_id: str, db: _orm.Session):
-    query = db.execute(
-        'select round(sum(amount),2) as amount from wallet_transactions where status = 1 and wallet_id="' + wallet_id + '"')
-
-    wallet_balance = query.first()[0]
-
-    if wallet_balance is None:
-        return 0
-    else:
-        return wallet_balance
-
-
 async def _get_organization_wallet(organization_id: str,
                                    currency: str,
                                    user: users_schemas.User,
-                                   db: _orm.Session):
+                                   db: AsyncSession):
     # verify if the organization exists under the user's account
 
     await _get_organization(organization_id=organization_id, db=db, user=user)
-    wallet = db.query(model.Wallet).filter_by(organization_id=organization_id).filter_by(currency_code=currency).first()
+    wallet = (await db.execute(select(model.Wallet).filter_by(organization_id=organization_id).filter_by(
+        currency_code=currency))).scalars().first()
     if wallet is None:
         raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                     detail="Organization does not have a " + currency + " wallet")
 
-    wallet_balance = await _get_wallet_balance(wallet_id=wallet.id, db=db)
-    wallet.balance = wallet_balance
-
     return wallet
 
 
-async def _get_wallet_transactions(wallet_id: str, db: _orm.Session):
-    wallet_transactions = db.query(wallet_transaction_models.WalletTransaction).filter_by(wallet_id=wallet_id).order_by(
-        desc(wallet_transaction_models.WalletTransaction.transaction_date))
+async def _get_wallet_transactions(wallet_id: str, db: AsyncSession, cursor: str = None, limit: int = None):
+    wallet_transactions = select(wallet_transaction_models.WalletTransaction).filter_by(wallet_id=wallet_id).order_by(
+        desc(wallet_transaction_models.WalletTransaction.transaction_date),
+        desc(wallet_transaction_models.WalletTransaction.id))
 
-    return paginate(list(wallet_transactions))
+    if cursor is not None or limit is not None:
+        return await paginate_cursor(db, wallet_transactions,
+                                     wallet_transaction_models.WalletTransaction.transaction_date,
+                                     wallet_transaction_models.WalletTransaction.id, cursor, limit or 50)
+    return await paginate_query(db, wallet_transactions)
 
 
 async def _get_organization_wallets(organization_id: str,
                                     user: users_schemas.User,
-                                    db: _orm.Session):
+                                    db: AsyncSession):
     # verify if the organization exists under the user's account
 
     await _get_organization(organization_id=organization_id, db=db, user=user)
 
-    wallets = db.query(model.Wallet).filter_by(organization_id=organization_id)
-    for index, wallet in enumerate(wallets):
-        wallets[index].balance = await _get_wallet_balance(wallet_id=wallet.id, db=db)
+    wallets = await paginate_query(db, select(model.Wallet).filter_by(organization_id=organization_id).order_by(
+        model.Wallet.currency_code))
+    wallets.items = await _with_shard_balances(wallets=wallets.items, db=db)
+    return wallets
+
+
+async def _with_shard_balances(wallets: list, db: AsyncSession):
+    """Returns the wallets as schemas, with the balance of their shard rows added"""
+    shard_balances = dict((await db.execute(
+        select(model.WalletBalanceShard.wallet_id, func.sum(model.WalletBalanceShard.balance))
+            .where(model.WalletBalanceShard.wallet_id.in_([wallet.id for wallet in wallets]))
+            .group_by(model.WalletBalanceShard.wallet_id))).all())
 
-    return paginate(list(wallets))
+    result = []
+    for wallet in wallets:
+        wallet_schema = schema.Wallet.from_orm(wallet)
+        wallet_schema.balance = round((wallet.balance or 0) + shard_balances.get(wallet.id, 0), 2)
+        result.append(wallet_schema)
+    return result
 
 
 async def _get_wallet(wallet_id: str,
                       user: users_schemas.User,
-                      db: _orm.Session):
-    wallet = db.query(model.Wallet).filter_by(id=wallet_id).first()
+                      db: AsyncSession):
+    wallet = await db.get(model.Wallet, wallet_id)
     if wallet is None:
         raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet does not exist")
 
     return wallet
 
 
-async def _get_super_admin_wallet(db: _orm.Session, currency: str):
-    admin = db.query(user_models.User).filter_by(is_superuser=True).filter_by(is_deleted=False).first()
-    organization = db.query(organisation_models.Organization).filter_by(creator=admin.id).filter_by(
-        is_deleted=False).first()
-    wallet = db.query(model.Wallet).filter_by(organization_id=organization.id).filter_by(
-        currency_code=currency).first()
-    if wallet is None:
-        wallet = await _create_wallet(organization_id=organization.id, db=db, currency_code=currency)
+# currency -> id of the super admin's wallet in that currency
+_super_admin_wallets = {}
+
+
+@event.listens_for(model.Wallet, "after_delete")
+def _forget_deleted_wallet(mapper, connection, wallet):
+    for currency, wallet_id in list(_super_admin_wallets.items()):
+        if wallet_id == wallet.id:
+            _super_admin_wallets.pop(currency, None)
+
+
+async def _get_super_admin_wallet_id(db: AsyncSession, currency: str):
+    if currency in _super_admin_wallets:
+        return _super_admin_wallets[currency]
+
+    wallet_id = (await db.execute(
+        select(model.Wallet.id)
+            .join(organisation_models.Organization, organisation_models.Organization.id == model.Wallet.organization_id)
+            .join(user_models.User, user_models.User.id == organisation_models.Organization.creator)
+            .where(user_models.User.is_superuser == True)
+            .where(user_models.User.is_deleted == False)
+            .where(organisation_models.Organization.is_deleted == False)
+            .where(model.Wallet.currency_code == currency))).scalars().first()
+    if wallet_id is not None:
+        _super_admin_wallets[currency] = wallet_id
+        return wallet_id
+
+    admin = (await db.execute(select(user_models.User).filter_by(is_superuser=True).filter_by(
+        is_deleted=False))).scalars().first()
+    organization = (await db.execute(select(organisation_models.Organization).filter_by(creator=admin.id).filter_by(
+        is_deleted=False))).scalars().first()
+    # flushed, not committed, as this runs inside update_wallet's transaction.
+    # It is cached the next time it is looked up, once it surely exists.
+    wallet = model.Wallet(id=uuid4().hex, organization_id=organization.id, balance=0,
+                          last_updated=_dt.datetime.utcnow(), currency_code=currency)
+    try:
+        async with db.begin_nested():
+            db.add(wallet)
+    except IntegrityError:
+        # a concurrent payment created it first
+        return (await db.execute(select(model.Wallet.id).filter_by(
+            organization_id=organization.id).filter_by(currency_code=currency))).scalar_one()
+
+    return wallet.id
+
+
+async def _add_to_balance(wallet_id: str, amount: float, db: AsyncSession):
+    # the addition runs in SQL so concurrent updates cannot overwrite each other
+    await db.execute(
+        update(model.Wallet)
+            .where(model.Wallet.id == wallet_id)
+            .values(balance=func.round(func.coalesce(model.Wallet.balance, 0) + amount, 2),
+                    last_updated=_dt.datetime.utcnow())
+            .execution_options(synchronize_session=False))
+
+
+async def _add_to_shard_balance(wallet_id: str, amount: float, db: AsyncSession):
+    # like _add_to_balance, but on a random shard row of a heavily written wallet
+    shard = random.randrange(settings.ADMIN_WALLET_SHARDS)
+    add = (update(model.WalletBalanceShard)
+           .where(model.WalletBalanceShard.wallet_id == wallet_id)
+           .where(model.WalletBalanceShard.shard == shard)
+           .values(balance=func.round(model.WalletBalanceShard.balance + amount, 2))
+           .execution_options(synchronize_session=False))
+    if (await db.execute(add)).rowcount == 1:
+        return
+
+    try:
+        async with db.begin_nested():
+            db.add(model.WalletBalanceShard(wallet_id=wallet_id, shard=shard, balance=amount))
+    except IntegrityError:
+        # another payment created the shard first
+        await db.execute(add)
+
+
+async def update_wallet(wallet, amount: float, db: AsyncSession, currency: str, wallet_transaction_id='', reason=''):
+    """Records a settled transaction of amount on wallet and updates its balance.
+
+    With a wallet_transaction_id the pending transaction is settled instead of
+    a new one being created. A negative amount is paid into the super admin
+    wallet. Everything is committed in one transaction.
+    """
+    transaction = {"wallet_id": wallet.id, "amount": amount, "currency_code": currency, "transaction_ref": reason}
+    if wallet_transaction_id != '':
+        transaction["id"] = wallet_transaction_id
+    await post_wallet_transactions(transactions=[transaction], db=db)
+
+    await db.commit()
+    await db.refresh(wallet)
 
     return wallet
 
 
-async def update_wallet(wallet, amount: float, db: _orm.Session, currency: str, wallet_transaction_id='', reason=''):
-    # update the wallet
-    # wallet.balance += amount
-    # wallet.last_updated = _dt.datetime.utcnow()
-    # db.commit()
-    # db.refresh(wallet)
-
-    if wallet_transaction_id == '':
-        wallet_transaction = wallet_transaction_models.WalletTransaction(id=uuid4().hex, wallet_id=wallet.id,
-                                                                         currency_code=currency, amount=amount,
-                                                                         transaction_date=_dt.datetime.utcnow(),
-                                                                         transaction_ref=reason, status=True)
-        db.add(wallet_transaction)
-        db.commit()
-        db.refresh(wallet_transaction)
-
-    else:
-        # update a wallet transaction
-        wallet_transaction = db.query(wallet_transaction_models.WalletTransaction).filter_by(
-            id=wallet_transaction_id).first()
-        wallet_transaction.status = True
-        if reason != '':
-            wallet_transaction.transaction_ref = reason
-        db.commit()
-        db.refresh(wallet_transaction)
-
-    if amount < 0:
-        amount = -amount
-        # transfer money to admin wallet
-
-        adminWallet = await _get_super_admin_wallet(db=db, currency=currency)
-        # update admin wallet
-        adminWallet.balance += amount
-        adminWallet.last_updated = _dt.datetime.utcnow()
-        db.commit()
-        db.refresh(adminWallet)
-
-        wallet_transaction = wallet_transaction_models.WalletTransaction(id=uuid4().hex, wallet_id=adminWallet.id,
-                                                                         currency_code=currency, amount=amount,
-                                                                         transaction_date=_dt.datetime.utcnow(),
-                                                                         transaction_ref=reason, status=True)
-        db.add(wallet_transaction)
-        db.commit()
-        db.refresh(wallet_transaction)
-
-    return wallet
+async def post_wallet_transactions(transactions: list, db: AsyncSession):
+    """Records settled transactions and applies them to wallet balances,
+    without committing.
+
+    transactions are dicts of wallet_id, amount, currency_code and
+    transaction_ref. One with an id settles that pending transaction
+    instead, at most once: if it was already settled the session is rolled
+    back and a 409 raised. Debits are paid into the super admin wallet.
+
+    New transactions are inserted in one statement and each wallet's balance
+    is updated once, whatever the number of transactions.
+    """
+    now = _dt.datetime.utcnow()
+    rows = []
+    balances = {}
+    admin_balances = {}
+    for transaction in transactions:
+        amount = transaction["amount"]
+        if "id" in transaction:
+            await _settle_wallet_transaction(wallet_transaction_id=transaction["id"],
+                                             reason=transaction.get("transaction_ref", ''), db=db)
+        else:
+            rows.append(dict(transaction, id=uuid4().hex, transaction_date=now, status=True))
+        balances[transaction["wallet_id"]] = balances.get(transaction["wallet_id"], 0) + amount
+
+        if amount < 0:
+            # transfer money to admin wallet
+            admin_wallet_id = await _get_super_admin_wallet_id(db=db, currency=transaction["currency_code"])
+            admin_balances[admin_wallet_id] = admin_balances.get(admin_wallet_id, 0) - amount
+            rows.append({"id": uuid4().hex, "wallet_id": admin_wallet_id, "amount": -amount,
+                         "currency_code": transaction["currency_code"],
+                         "transaction_ref": transaction.get("transaction_ref", ''),
+                         "transaction_date": now, "status": True})
+
+    if rows:
+        await db.execute(insert(wallet_transaction_models.WalletTransaction), rows)
+    for wallet_id, amount in balances.items():
+        if amount != 0:
+            await _add_to_balance(wallet_id=wallet_id, amount=amount, db=db)
+    for wallet_id, amount in admin_balances.items():
+        await _add_to_shard_balance(wallet_id=wallet_id, amount=amount, db=db)
+
+
+async def _settle_wallet_transaction(wallet_transaction_id: str, reason: str, db: AsyncSession):
+    # the update only matches a pending transaction, and the row stays
+    # locked until commit, so a concurrent settle waits and then matches none
+    values = {"status": True}
+    if reason != '':
+        values["transaction_ref"] = reason
+    result = await db.execute(
+        update(wallet_transaction_models.WalletTransaction)
+            .where(wallet_transaction_models.WalletTransaction.id == wallet_transaction_id)
+            .where(wallet_transaction_models.WalletTransaction.status == False)
+            .values(**values)
+            .execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        await db.rollback()
+        raise fastapi.HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail="Transaction already processed")
+
+
+async def reconcile_wallet_balances(db: AsyncSession, fix: bool = False):
+    """Compares every wallet's balance with the sum of its settled transactions.
+
+    A wallet's balance includes its shard rows. Returns the wallets that
+    differ, and logs a warning for each. With fix set, their balances are
+    reset to the transaction sum.
+    """
+    ledger = (
+        select(wallet_transaction_models.WalletTransaction.wallet_id,
+               func.round(func.sum(wallet_transaction_models.WalletTransaction.amount), 2).label("balance"))
+            .where(wallet_transaction_models.WalletTransaction.status == True)
+            .group_by(wallet_transaction_models.WalletTransaction.wallet_id)
+            .subquery())
+    shards = (
+        select(model.WalletBalanceShard.wallet_id,
+               func.sum(model.WalletBalanceShard.balance).label("balance"))
+            .group_by(model.WalletBalanceShard.wallet_id)
+            .subquery())
+    shard_balance = func.coalesce(shards.c.balance, 0)
+    balance = func.round(func.coalesce(model.Wallet.balance, 0) + shard_balance, 2)
+    ledger_balance = func.coalesce(ledger.c.balance, 0)
+    rows = (await db.execute(
+        select(model.Wallet.id, balance, ledger_balance, shard_balance)
+            .outerjoin(ledger, ledger.c.wallet_id == model.Wallet.id)
+            .outerjoin(shards, shards.c.wallet_id == model.Wallet.id)
+            .where(func.abs(balance - ledger_balance) >= 0.01))).all()
+
+    drift = []
+    for wallet_id, wallet_balance, transactions_balance, wallet_shard_balance in rows:
+        logger.warning("Wallet %s has a balance of %s but its transactions add up to %s",
+                       wallet_id, wallet_balance, transactions_balance)
+        drift.append({"wallet_id": wallet_id, "balance": wallet_balance, "ledger_balance": transactions_balance})
+        if fix:
+            await db.execute(
+                update(model.Wallet)
+                    .where(model.Wallet.id == wallet_id)
+                    .values(balance=round(transactions_balance - wallet_shard_balance, 2), last_updated=_dt.datetime.utcnow())
+                    .execution_options(synchronize_session=False))
+
+    if fix:
+        await db.commit()
+
+    return drift
+
+
+if settings.WALLET_RECONCILE_SECONDS > 0:
+    @app.on_event("startup")
+    @repeat_every(seconds=settings.WALLET_RECONCILE_SECONDS, wait_first=True, logger=logger)
+    async def reconcile_wallet_balances_task():
+        async with database.AsyncSessionLocal() as db:
+            await reconcile_wallet_balances(db=db)
 
 
 add_pagination(app)
@@ -17,11 +17,12 @@ from bigfastapi.contact import app as contact
 from bigfastapi.countries import app as countries
 from bigfastapi.credit import app as credit
 from bigfastapi.customer import app as customer
-from bigfastapi.db.database import create_database
+from bigfastapi.db.database import ReadYourWritesMiddleware, create_database
 from bigfastapi.email import app as email
 # Import all the functionality that BFA provides
 from bigfastapi.faq import app as faq
 from bigfastapi.files import app as files
+from bigfastapi.health import app as health
 # from bigfastapi.google_auth import app as social_auth
 from bigfastapi.notification import app as notification
 from bigfastapi.organization import app as organization
@@ -68,6 +69,7 @@ tags_metadata = [
 
 app = FastAPI(openapi_tags=tags_metadata)
 app.add_middleware(SessionMiddleware, secret_key=env_var.JWT_SECRET)
+app.add_middleware(ReadYourWritesMiddleware)
 
 client = TestClient(app)
 create_database()
@@ -113,6 +115,7 @@ app.include_router(customer)
 app.include_router(sms)
 app.include_router(schedule)
 app.include_router(activitieslog)
+app.include_router(health)
 
 
 @app.get("/", tags=["Home"])
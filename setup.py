@@ -32,6 +32,7 @@ setuptools.setup(
                         'uvicorn',  
                         'aioredis',
                         'aiosmtplib',
+                        'aiosqlite',
                         'anyio',
                         'alembic',
                         'asgiref',
@@ -44,10 +45,11 @@ setuptools.setup(
                         'dnspython',
                         'email-validator',
                         'fastapi',
-                        'fastapi-mail',
+                        'fastapi-mail>=1.0.6,<1.1',
                         'fastapi-utils',
                         'greenlet',
                         'h11',
+                        'httpx',
                         'idna',
                         'Jinja2',
                         'MarkupSafe',
@@ -0,0 +1,83 @@
+"""A local stand-in for Flutterwave, Stripe and freecurrencyapi.
+
+Point the *_API_URL settings at FakeProvider.url to use it.
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        provider = self.server.provider
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        provider.requests.append({"method": method, "path": self.path, "client": self.client_address,
+                                  "headers": dict(self.headers), "body": body})
+
+        if provider.failures > 0:
+            provider.failures -= 1
+            return self._respond(503, {"status": "error", "message": "Service unavailable"})
+
+        path = self.path.split("?")[0]
+        verify = re.fullmatch(r"/v3/transactions/(\w+)/verify", path)
+        session = re.fullmatch(r"/v1/checkout/sessions/(\w+)", path)
+        if method == "POST" and path == "/v3/payments/":
+            tx_ref = json.loads(body)["tx_ref"]
+            self._respond(200, {"status": "success", "data": {"link": "https://checkout.flutterwave.test/" + tx_ref}})
+        elif method == "GET" and verify:
+            self._respond(200, {"status": "success", "data": provider.transactions[verify.group(1)]})
+        elif method == "GET" and path == "/api/v2/latest":
+            self._respond(200, {"data": provider.rates})
+        elif method == "POST" and path == "/v1/checkout/sessions":
+            self._respond(200, provider.stripe_session("cs_test"))
+        elif method == "GET" and session:
+            self._respond(200, provider.stripe_session(session.group(1)))
+        else:
+            self._respond(404, {"status": "error", "message": "Not found"})
+
+    def _respond(self, status_code, content):
+        body = json.dumps(content).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeProvider:
+    def __init__(self):
+        self.requests = []
+        # the next failures requests are answered with a 503
+        self.failures = 0
+        self.transactions = {}
+        self.rates = {"NGN": 415.5, "EUR": 0.9}
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.provider = self
+        self.url = "http://127.0.0.1:%d" % self._server.server_port
+
+    def stripe_session(self, id):
+        return {"id": id, "object": "checkout.session", "url": "https://checkout.stripe.test/" + id,
+                "client_reference_id": "ref", "amount_total": 1000, "currency": "usd", "payment_status": "paid",
+                "metadata": {"redirect_url": "https://app.test"}}
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,83 @@
+"""A local SMTP server that keeps the messages it is sent.
+
+Point an email ConnectionConfig at FakeSMTP.port on 127.0.0.1, without TLS.
+"""
+import socketserver
+import threading
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        smtp = self.server.smtp
+        smtp.connections += 1
+        self.reply("220 fake.smtp ESMTP")
+        mail_from, recipients = None, []
+        while True:
+            line = self.rfile.readline().decode().rstrip("\r\n")
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250-fake.smtp")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif command == "AUTH":
+                smtp.logins += 1
+                self.reply("235 Authentication successful")
+            elif command == "MAIL":
+                mail_from, recipients = line[10:].strip("<>"), []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                recipient = line[8:].split(">")[0].strip("<")
+                if recipient in smtp.refused:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(recipient)
+                    self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    data_line = self.rfile.readline().decode()
+                    if data_line.rstrip("\r\n") == ".":
+                        break
+                    data.append(data_line)
+                if smtp.failures > 0:
+                    smtp.failures -= 1
+                    self.reply("451 Try again later")
+                else:
+                    smtp.messages.append({"from": mail_from, "to": recipients, "data": "".join(data)})
+                    self.reply("250 OK")
+            elif command == "RSET":
+                mail_from, recipients = None, []
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class FakeSMTP:
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+        # the next failures messages are answered with a 451
+        self.failures = 0
+        self.refused = set()
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.smtp = self
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,170 @@
+from uuid import uuid4
+
+import passlib.hash as _hash
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import bigfastapi.db.database as database
+import bigfastapi.auth_api as auth_api
+from bigfastapi.auth_api import is_authenticated, JWT_SECRET, ALGORITHM
+from bigfastapi.models import auth_models, user_models
+from bigfastapi.utils import settings
+from main import app
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread': False})
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
+test_db = TestingSessionLocal()
+
+tables = [user_models.User.__table__, auth_models.Token.__table__]
+
+
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def setUp():
+    database.Base.metadata.create_all(bind=engine, tables=tables)
+    app.dependency_overrides[database.get_async_db] = override_get_async_db
+    auth_override = app.dependency_overrides.pop(is_authenticated, None)
+
+    user = user_models.User(id=uuid4().hex, email="auth@example.com", first_name="John", last_name="Doe",
+                            password=_hash.sha256_crypt.hash("secret_password"), is_active=True,
+                            is_verified=True, is_superuser=False, is_deleted=False)
+    test_db.add(user)
+    test_db.commit()
+
+    token = jwt.encode({"user_id": user.id}, JWT_SECRET, algorithm=ALGORITHM)
+    test_db.add(auth_models.Token(id=uuid4().hex, user_id=user.id, token=token))
+    test_db.commit()
+
+    yield token
+
+    auth_api._token_cache.clear()
+    auth_api._user_cache.clear()
+    if auth_override is not None:
+        app.dependency_overrides[is_authenticated] = auth_override
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+
+
+def test_get_authenticated_user(setUp):
+    response = client.get("/users/me", headers={"Authorization": "Bearer " + setUp})
+    assert response.status_code == 200
+    assert response.json().get("email") == "auth@example.com"
+
+
+def test_get_authenticated_user_with_unknown_token(setUp):
+    token = jwt.encode({"user_id": uuid4().hex}, JWT_SECRET, algorithm=ALGORITHM)
+    response = client.get("/users/me", headers={"Authorization": "Bearer " + token})
+    assert response.status_code == 403
+
+
+def test_authenticated_requests_are_cached(setUp):
+    headers = {"Authorization": "Bearer " + setUp}
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    try:
+        response = client.get("/users/me", headers=headers)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+
+    assert response.status_code == 200
+    assert statements == []
+
+
+def test_cached_user_is_invalidated_on_update(setUp):
+    headers = {"Authorization": "Bearer " + setUp}
+    assert client.get("/users/me", headers=headers).json().get("first_name") == "John"
+
+    user = test_db.query(user_models.User).filter(user_models.User.email == "auth@example.com").first()
+    user.first_name = "Jane"
+    test_db.commit()
+
+    assert client.get("/users/me", headers=headers).json().get("first_name") == "Jane"
+
+
+def test_deleted_token_is_rejected(setUp):
+    headers = {"Authorization": "Bearer " + setUp}
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+    token = test_db.query(auth_models.Token).filter(auth_models.Token.token == setUp).first()
+    test_db.delete(token)
+    test_db.commit()
+
+    assert client.get("/users/me", headers=headers).status_code == 403
+
+
+def test_login(setUp):
+    response = client.post("/auth/login", json={"email": "auth@example.com", "password": "secret_password"})
+    assert response.status_code == 200
+    assert response.json().get("access_token")
+
+
+def test_login_upgrades_weak_password_hash(setUp):
+    user = test_db.query(user_models.User).filter(user_models.User.email == "auth@example.com").first()
+    user.password = _hash.sha256_crypt.using(rounds=1000).hash("secret_password")
+    test_db.commit()
+
+    response = client.post("/auth/login", json={"email": "auth@example.com", "password": "secret_password"})
+    assert response.status_code == 200
+
+    test_db.expire_all()
+    user = test_db.query(user_models.User).filter(user_models.User.email == "auth@example.com").first()
+    assert _hash.sha256_crypt.from_string(user.password).rounds == settings.PASSWORD_HASH_ROUNDS
+    assert _hash.sha256_crypt.verify("secret_password", user.password)
+
+
+def test_login_with_wrong_password(setUp):
+    response = client.post("/auth/login", json={"email": "auth@example.com", "password": "wrong_password"})
+    assert response.status_code == 403
+
+
+def test_cached_user_leaves_out_the_password(setUp):
+    headers = {"Authorization": "Bearer " + setUp}
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+    assert [values for _, values in auth_api._user_cache.values() if "password" in values] == []
+
+
+def test_expired_cache_picks_up_bulk_updates(setUp):
+    headers = {"Authorization": "Bearer " + setUp}
+    assert client.get("/users/me", headers=headers).json().get("first_name") == "John"
+
+    # bulk statements skip the mapper events, like a write from another worker
+    test_db.query(user_models.User).filter(user_models.User.email == "auth@example.com").update(
+        {"first_name": "Jane"}, synchronize_session=False)
+    test_db.commit()
+    assert client.get("/users/me", headers=headers).json().get("first_name") == "John"
+
+    for cache in (auth_api._token_cache, auth_api._user_cache):
+        for key, (_, value) in list(cache.items()):
+            cache[key] = (0, value)
+    assert client.get("/users/me", headers=headers).json().get("first_name") == "Jane"
+
+
+def test_cache_can_be_turned_off(setUp, monkeypatch):
+    monkeypatch.setattr(settings, "AUTH_CACHE_SECONDS", 0)
+    headers = {"Authorization": "Bearer " + setUp}
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+    assert auth_api._token_cache == {}
+    assert auth_api._user_cache == {}
@@ -45,6 +45,7 @@ client = TestClient(app)
 def setUp():
     database.Base.metadata.create_all(engine, tables=[blog_models.Blog.__table__])
     app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
     app.dependency_overrides[is_authenticated] = override_is_authenticated
 
     blog_data1 = {"title":"First Test Data", "content":"Testing Blog Endpoint"}
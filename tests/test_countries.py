@@ -61,4 +61,22 @@ def test_country_codes_success():
 def test_country_codes_failure():
     response = client.get("/countries/codes?country_code=Ngl")
     assert response.status_code == 404
-    assert response.json() == {"detail": "Country not found"}
\ No newline at end of file
+    assert response.json() == {"detail": "Country not found"}
+
+
+def test_countries_not_modified():
+    response = client.get("/countries")
+    etag = response.headers.get("etag")
+    assert etag
+    response = client.get("/countries", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_country_states_etag_changes_per_country():
+    nigeria = client.get("/countries/NGA/states")
+    ghana = client.get("/countries/gh/states")
+    assert nigeria.json().get("name") == "Nigeria"
+    assert nigeria.headers.get("etag") != ghana.headers.get("etag")
+    response = client.get("/countries/ng/states", headers={"If-None-Match": nigeria.headers.get("etag")})
+    assert response.status_code == 304
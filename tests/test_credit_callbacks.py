@@ -0,0 +1,231 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import fastapi
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import bigfastapi.db.database as database
+from bigfastapi import credit, wallet
+from bigfastapi.db.database import get_async_db
+from bigfastapi.models import credit_wallet_conversion_models, credit_wallet_history_models, credit_wallet_models, \
+    organisation_models, payment_event_models, user_models, wallet_models, wallet_transaction_models
+from bigfastapi.utils import http_client, settings
+from bigfastapi.utils.exchange_rates import rate_cache
+from tests.fake_provider import FakeProvider
+
+engine = create_engine("sqlite:///./test.db", connect_args={'check_same_thread': False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
+test_db = TestingSessionLocal()
+
+tables = [user_models.User.__table__, organisation_models.Organization.__table__,
+          wallet_models.Wallet.__table__, wallet_models.WalletBalanceShard.__table__,
+          wallet_transaction_models.WalletTransaction.__table__, credit_wallet_models.CreditWallet.__table__,
+          credit_wallet_history_models.CreditWalletHistory.__table__,
+          credit_wallet_conversion_models.CreditWalletConversion.__table__,
+          payment_event_models.PaymentEvent.__table__]
+
+
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
+api = fastapi.FastAPI()
+api.include_router(credit.app)
+api.dependency_overrides[get_async_db] = override_get_async_db
+client = TestClient(api)
+
+
+def run(service, *args, **kwargs):
+    async def call():
+        try:
+            async with AsyncTestingSessionLocal() as db:
+                return await service(*args, db=db, **kwargs)
+        finally:
+            await http_client.close_client()
+    return asyncio.run(call())
+
+
+def callback():
+    return run(credit.verify_flutterwave_payment, status="successful", tx_ref="pending", transaction_id="1234")
+
+
+def process_payment_events():
+    async def call():
+        try:
+            return await credit.process_payment_events()
+        finally:
+            await http_client.close_client()
+    return asyncio.run(call())
+
+
+def events():
+    test_db.expire_all()
+    return [(event.provider_transaction_id, event.status, event.attempts)
+            for event in test_db.query(payment_event_models.PaymentEvent).all()]
+
+
+def webhook(transaction_id="1234"):
+    return client.post("/credits/webhook/flutterwave", headers={"verif-hash": "hash"},
+                       data=json.dumps({"event": "charge.completed", "data": {"id": transaction_id}}))
+
+
+def state():
+    test_db.expire_all()
+    org_wallet = test_db.query(wallet_models.Wallet).filter_by(organization_id="org").first()
+    shards = test_db.query(wallet_models.WalletBalanceShard).all()
+    return {
+        "wallet": org_wallet.balance if org_wallet is not None else None,
+        "admin": sum(shard.balance for shard in shards),
+        "credits": test_db.query(credit_wallet_models.CreditWallet).get("credit").amount,
+        "history": test_db.query(credit_wallet_history_models.CreditWalletHistory).count(),
+        "transactions": test_db.query(wallet_transaction_models.WalletTransaction).count(),
+    }
+
+
+@pytest.fixture
+def setUp(monkeypatch):
+    provider = FakeProvider().start()
+    provider.transactions["1234"] = {"tx_ref": "pending", "status": "successful", "amount": 1000, "currency": "NGN",
+                                     "meta": {"redirect_url": "https://app.test"}}
+    monkeypatch.setattr(settings, "FLUTTERWAVE_API_URL", provider.url)
+    monkeypatch.setattr(settings, "FLUTTERWAVE_SEC_KEY", "flw_test")
+    monkeypatch.setattr(settings, "FLUTTERWAVE_WEBHOOK_HASH", "hash")
+    monkeypatch.setattr(settings, "HTTP_RETRIES", 0)
+    monkeypatch.setattr(database, "AsyncSessionLocal", AsyncTestingSessionLocal)
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+    database.Base.metadata.create_all(bind=engine, tables=tables)
+    test_db.add(user_models.User(id="admin", email="admin@example.com", password="-", is_superuser=True,
+                                 is_deleted=False))
+    test_db.add(organisation_models.Organization(id="admin-org", creator="admin", name="admin org"))
+    test_db.add(wallet_models.Wallet(id="admin-wallet", organization_id="admin-org", currency_code="NGN", balance=0))
+    test_db.add(credit_wallet_models.CreditWallet(id="credit", organization_id="org", amount=10))
+    test_db.add(credit_wallet_conversion_models.CreditWalletConversion(id="ngn", currency_code="NGN", rate=2))
+    test_db.add(wallet_transaction_models.WalletTransaction(id="pending", wallet_id="pending-wallet",
+                                                            currency_code="NGN", amount=1000, status=False,
+                                                            transaction_ref="user-org-ref"))
+    test_db.commit()
+    rate_cache.clear()
+    wallet._super_admin_wallets.clear()
+
+    yield provider
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+    provider.stop()
+
+
+def test_callback_commits_once(setUp):
+    commits = []
+
+    def count(connection):
+        commits.append(connection)
+
+    event.listen(async_engine.sync_engine, "commit", count)
+    try:
+        response = callback()
+    finally:
+        event.remove(async_engine.sync_engine, "commit", count)
+
+    assert "status=success" in response.headers["location"]
+    assert len(commits) == 1
+    assert state() == {"wallet": 0, "admin": 1000, "credits": 510, "history": 1, "transactions": 3}
+
+
+def test_repeated_callback_is_a_no_op(setUp):
+    callback()
+    response = callback()
+    assert "Transaction%20already%20processed" in response.headers["location"]
+    assert state() == {"wallet": 0, "admin": 1000, "credits": 510, "history": 1, "transactions": 3}
+
+
+def test_payment_is_settled_once(setUp):
+    callback()
+    # a duplicate that got past the status check before the first committed
+    with pytest.raises(fastapi.HTTPException) as error:
+        run(credit._settle_payment, wallet_transaction_id="pending", organization_id="org", amount=1000,
+            currency="NGN", provider="Flutterwave")
+    assert error.value.status_code == 409
+    assert state() == {"wallet": 0, "admin": 1000, "credits": 510, "history": 1, "transactions": 3}
+
+
+def test_posting_transactions_in_bulk(setUp):
+    test_db.add(wallet_models.Wallet(id="wallet", organization_id="org", currency_code="NGN", balance=0))
+    test_db.commit()
+
+    async def post(db):
+        await wallet.post_wallet_transactions(transactions=[
+            {"wallet_id": "wallet", "amount": 300, "currency_code": "NGN", "transaction_ref": "top up"},
+            {"wallet_id": "wallet", "amount": -100, "currency_code": "NGN", "transaction_ref": "sms"},
+            {"wallet_id": "wallet", "amount": -50, "currency_code": "NGN", "transaction_ref": "email"},
+        ], db=db)
+        await db.commit()
+        return await wallet.reconcile_wallet_balances(db=db)
+
+    assert run(post) == []
+    test_db.expire_all()
+    assert test_db.query(wallet_models.Wallet).get("wallet").balance == 150
+    assert test_db.query(wallet_transaction_models.WalletTransaction).filter_by(
+        wallet_id="admin-wallet").count() == 2
+
+
+def test_webhooks_are_stored_once(setUp):
+    assert webhook().status_code == 200
+    assert webhook().status_code == 200
+    assert client.post("/credits/webhook/flutterwave", headers={"verif-hash": "wrong"},
+                       data=json.dumps({"event": "charge.completed", "data": {"id": "1234"}})).status_code == 401
+    assert events() == [("1234", "pending", 0)]
+    # nothing is applied until a worker runs
+    assert state()["credits"] == 10
+
+
+def test_workers_apply_events(setUp):
+    webhook()
+    assert process_payment_events() == 1
+    assert events() == [("1234", "done", 1)]
+    assert state() == {"wallet": 0, "admin": 1000, "credits": 510, "history": 1, "transactions": 3}
+    assert process_payment_events() == 0
+
+
+def test_failed_events_are_retried_then_dead_lettered(setUp, monkeypatch):
+    monkeypatch.setattr(settings, "PAYMENT_EVENT_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(settings, "PAYMENT_EVENT_BACKOFF_SECONDS", 0)
+    setUp.failures = 2
+    webhook()
+
+    assert process_payment_events() == 1
+    assert events() == [("1234", "pending", 1)]
+    assert process_payment_events() == 1
+    assert events() == [("1234", "dead", 2)]
+    assert state()["credits"] == 10
+
+    event = test_db.query(payment_event_models.PaymentEvent).first()
+    run(credit.retry_payment_event, event_id=event.id, user=SimpleNamespace(is_superuser=True))
+    process_payment_events()
+    assert events() == [("1234", "done", 1)]
+    assert state()["credits"] == 510
+
+
+def test_unknown_payments_are_dead_lettered_at_once(setUp):
+    setUp.transactions["5678"] = dict(setUp.transactions["1234"], status="failed")
+    webhook("5678")
+    process_payment_events()
+    assert events() == [("5678", "dead", 1)]
+
+
+def test_queued_callbacks(setUp, monkeypatch):
+    monkeypatch.setattr(settings, "PAYMENT_CALLBACKS_QUEUED", True)
+    response = callback()
+    assert "status=pending" in response.headers["location"]
+    assert events() == [("1234", "pending", 0)]
+    process_payment_events()
+    assert state()["credits"] == 510
@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import bigfastapi.db.database as database
+from bigfastapi import credit
+from bigfastapi.models import credit_wallet_history_models, credit_wallet_models, organisation_models
+from bigfastapi.schemas.credit_wallet_schemas import CreditUsagePeriod
+
+engine = create_engine("sqlite:///./test.db", connect_args={'check_same_thread': False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
+test_db = TestingSessionLocal()
+
+tables = [organisation_models.Organization.__table__, credit_wallet_models.CreditWallet.__table__,
+          credit_wallet_history_models.CreditWalletHistory.__table__,
+          credit_wallet_history_models.CreditWalletSnapshot.__table__]
+user = SimpleNamespace(id="user")
+
+# (day, amount): 100 credits bought on each of three days, some used in between
+ledger = [(1, 100), (1, -30), (2, -20), (2, 100), (3, -45), (33, 100), (33, -5)]
+
+
+def run(service, *args, **kwargs):
+    async def call():
+        async with AsyncTestingSessionLocal() as db:
+            return await service(*args, db=db, **kwargs)
+    return asyncio.run(call())
+
+
+def history(limit, cursor=None):
+    return run(credit.get_credit_history, organization_id="org", user=user, cursor=cursor, limit=limit)
+
+
+@pytest.fixture
+def setUp():
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+    database.Base.metadata.create_all(bind=engine, tables=tables)
+    test_db.add(organisation_models.Organization(id="org", creator="user", name="org"))
+    test_db.add(credit_wallet_models.CreditWallet(id="credit", organization_id="org", amount=200))
+    start = datetime.datetime(2022, 1, 1)
+    for number, (day, amount) in enumerate(ledger):
+        test_db.add(credit_wallet_history_models.CreditWalletHistory(
+            id="row%d" % number, credit_wallet_id="credit", amount=amount,
+            date=start + datetime.timedelta(days=day - 1, minutes=number)))
+    test_db.commit()
+
+    yield
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+
+
+def test_history_has_running_balances(setUp):
+    first = history(limit=3)
+    assert [(row.id, row.balance) for row in first["items"]] == [("row6", 200), ("row5", 205), ("row4", 105)]
+    second = history(limit=3, cursor=first["next_cursor"])
+    assert [(row.id, row.balance) for row in second["items"]] == [("row3", 150), ("row2", 50), ("row1", 70)]
+
+
+def test_running_balances_start_from_snapshots(setUp):
+    assert run(credit.snapshot_credit_balances) == 1
+    assert run(credit.snapshot_credit_balances) == 0
+
+    # rows before the snapshot are not summed again
+    test_db.add(credit_wallet_history_models.CreditWalletHistory(
+        id="row7", credit_wallet_id="credit", amount=-50, date=datetime.datetime(2022, 3, 1)))
+    test_db.commit()
+    assert run(credit.snapshot_credit_balances) == 1
+    snapshots = test_db.query(credit_wallet_history_models.CreditWalletSnapshot).order_by(
+        credit_wallet_history_models.CreditWalletSnapshot.date).all()
+    assert [(snapshot.history_id, snapshot.balance) for snapshot in snapshots] == [("row6", 200), ("row7", 150)]
+
+    page = history(limit=2)
+    assert [(row.id, row.balance) for row in page["items"]] == [("row7", 150), ("row6", 200)]
+    page = history(limit=10, cursor=page["next_cursor"])
+    assert [row.balance for row in page["items"]] == [205, 105, 150, 50, 70, 100]
+
+
+def test_history_rows_cannot_be_changed(setUp):
+    row = test_db.query(credit_wallet_history_models.CreditWalletHistory).first()
+    row.amount = 1000
+    with pytest.raises(ValueError):
+        test_db.commit()
+    test_db.rollback()
+
+
+def test_credit_usage_per_day_and_month(setUp):
+    usage = run(credit.get_credit_usage, organization_id="org", period=CreditUsagePeriod.DAY, user=user,
+                start=datetime.datetime(2022, 1, 2), end=None)
+    assert usage == [{"period": "2022-01-02", "credits_added": 100, "credits_used": 20},
+                     {"period": "2022-01-03", "credits_added": 0, "credits_used": 45},
+                     {"period": "2022-02-02", "credits_added": 100, "credits_used": 5}]
+
+    usage = run(credit.get_credit_usage, organization_id="org", period=CreditUsagePeriod.MONTH, user=user,
+                start=None, end=None)
+    assert usage == [{"period": "2022-01", "credits_added": 200, "credits_used": 95},
+                     {"period": "2022-02", "credits_added": 100, "credits_used": 5}]
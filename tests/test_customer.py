@@ -2,8 +2,9 @@ from http import client
 from main import app
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from bigfastapi.db.database import Base, get_db
+from bigfastapi.db.database import Base, get_db, get_async_db, get_async_read_db
 from bigfastapi.auth import is_authenticated
 from uuid import uuid4
 from bigfastapi.schemas.users_schemas import User
@@ -14,7 +15,10 @@ SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
 
 
 Base.metadata.drop_all(bind=engine)
@@ -27,10 +31,17 @@ def override_get_db():
         yield db
     finally:
         db.close()
+
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
 client = TestClient(app)
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_async_read_db] = override_get_async_db
 
 
 
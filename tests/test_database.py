@@ -0,0 +1,100 @@
+import time
+
+import fastapi
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Column, String, create_engine, pool
+from sqlalchemy.ext.declarative import declarative_base
+
+import bigfastapi.db.database as database
+
+primary = create_engine("sqlite://", poolclass=pool.StaticPool, connect_args={"check_same_thread": False})
+replica = create_engine("sqlite://", poolclass=pool.StaticPool, connect_args={"check_same_thread": False})
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "routing_test_items"
+    id = Column(String(255), primary_key=True)
+
+
+@pytest.fixture
+def setUp():
+    for engine in (primary, replica):
+        Item.__table__.create(bind=engine)
+    with primary.begin() as connection:
+        connection.execute(Item.__table__.insert(), {"id": "on-primary"})
+    with replica.begin() as connection:
+        connection.execute(Item.__table__.insert(), {"id": "on-replica"})
+    token = database._client_writes.set(database.ClientWrites())
+
+    yield
+
+    database._client_writes.reset(token)
+
+    for engine in (primary, replica):
+        Item.__table__.drop(bind=engine)
+
+
+def test_reads_go_to_replica(setUp):
+    db = database.RoutingSession(bind=primary, replicas=[replica])
+    assert [item.id for item in db.query(Item).all()] == ["on-replica"]
+    db.close()
+
+
+def test_reads_stay_on_primary_after_commit(setUp):
+    db = database.RoutingSession(bind=primary, replicas=[replica])
+    db.add(Item(id="written"))
+    db.commit()
+    assert database.read_from_primary()
+    assert sorted(item.id for item in db.query(Item).all()) == ["on-primary", "written"]
+    db.close()
+
+
+def test_other_clients_writes_do_not_pin_reads(setUp):
+    db = database.RoutingSession(bind=primary, replicas=[replica])
+    db.add(Item(id="written"))
+    db.commit()
+    database._client_writes.set(database.ClientWrites())
+    assert not database.read_from_primary()
+    assert [item.id for item in db.query(Item).all()] == ["on-replica"]
+    db.close()
+
+
+def test_reads_go_to_primary_without_replicas(setUp):
+    db = database.RoutingSession(bind=primary)
+    assert [item.id for item in db.query(Item).all()] == ["on-primary"]
+    db.close()
+
+
+api = fastapi.FastAPI()
+api.add_middleware(database.ReadYourWritesMiddleware)
+
+
+@api.post("/write")
+def write():
+    database.mark_primary_write()
+
+
+@api.get("/read")
+def read():
+    return database.read_from_primary()
+
+
+def test_the_middleware_keeps_a_client_on_the_primary_after_it_wrote():
+    client, other_client = TestClient(api), TestClient(api)
+    assert client.get("/read").json() is False
+
+    response = client.post("/write")
+    assert database.LAST_WRITE_COOKIE in response.cookies
+    assert client.get("/read").json() is True
+    assert other_client.get("/read").json() is False
+
+    # clients without cookies can send the header back
+    last_write = response.headers[database.LAST_WRITE_HEADER]
+    assert other_client.get("/read", headers={database.LAST_WRITE_HEADER: last_write}).json() is True
+    stale = str(time.time() - database.DB_REPLICA_STICKY_SECONDS - 1)
+    assert other_client.get("/read", headers={database.LAST_WRITE_HEADER: stale}).json() is False
+    future = str(time.time() + 3600)
+    assert other_client.get("/read", headers={database.LAST_WRITE_HEADER: future}).json() is False
@@ -0,0 +1,180 @@
+import asyncio
+import email as email_parser
+
+import fastapi
+import pytest
+from fastapi.testclient import TestClient
+from fastapi_mail import ConnectionConfig
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import bigfastapi.db.database as database
+from bigfastapi import email
+from bigfastapi.auth_api import is_authenticated
+from bigfastapi.db.database import get_async_db
+from bigfastapi.schemas import users_schemas
+from bigfastapi.models import customer_models, email_models, organisation_models, scheduled_job_models, user_models
+from bigfastapi.utils import mail_sender, settings
+from bigfastapi.utils.scheduler import scheduler
+from tests.fake_smtp import FakeSMTP
+
+engine = create_engine("sqlite:///./test.db", connect_args={'check_same_thread': False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
+test_db = TestingSessionLocal()
+
+tables = [user_models.User.__table__, organisation_models.Organization.__table__, customer_models.Customer.__table__,
+          email_models.OutboxEmail.__table__, email_models.EmailCampaign.__table__,
+          email_models.CampaignRecipient.__table__, scheduled_job_models.ScheduledJob.__table__]
+
+
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
+def authenticated_as(user_id):
+    async def override_is_authenticated():
+        return users_schemas.User(id=user_id, first_name="Ada", last_name="Shop", email=user_id + "@example.com",
+                                  password="-", is_active=True, is_verified=True, is_superuser=False,
+                                  phone_number="", organization="", is_deleted=False,
+                                  date_created="2022-01-01T00:00:00", last_updated="2022-01-01T00:00:00")
+    return override_is_authenticated
+
+
+api = fastapi.FastAPI()
+api.include_router(email.app)
+api.dependency_overrides[get_async_db] = override_get_async_db
+api.dependency_overrides[is_authenticated] = authenticated_as("owner")
+client = TestClient(api)
+
+campaign = {"organization_id": "org", "subject": "Big sale", "title": "Everything must go", "body": "Hi there",
+            "template": "base_email.html", "template_body": {"sender": "The Shop"}}
+
+
+def send_outbox_emails():
+    async def call():
+        try:
+            return await email.send_outbox_emails()
+        finally:
+            await email.smtp_pool.close()
+    return asyncio.run(call())
+
+
+def run_scheduled_jobs():
+    async def call():
+        while await scheduler.run_due_jobs():
+            pass
+    asyncio.run(call())
+
+
+def html(message):
+    [part] = email_parser.message_from_string(message["data"]).get_payload()
+    return part.get_payload(decode=True).decode()
+
+
+@pytest.fixture
+def setUp(monkeypatch):
+    smtp = FakeSMTP().start()
+    config = ConnectionConfig(MAIL_USERNAME="user", MAIL_PASSWORD="password", MAIL_FROM="noreply@example.com",
+                              MAIL_PORT=smtp.port, MAIL_SERVER="127.0.0.1", MAIL_TLS=False, MAIL_SSL=False,
+                              USE_CREDENTIALS=True, TEMPLATE_FOLDER=email.conf.TEMPLATE_FOLDER)
+    monkeypatch.setattr(email, "smtp_pool", mail_sender.SMTPPool(config, size=2))
+    monkeypatch.setattr(settings, "EMAIL_CAMPAIGN_CHUNK_SIZE", 2)
+    monkeypatch.setattr(database, "AsyncSessionLocal", AsyncTestingSessionLocal)
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+    database.Base.metadata.create_all(bind=engine, tables=tables)
+    test_db.add(organisation_models.Organization(id="org", creator="owner", name="The Shop"))
+    for id, address, first_name, is_deleted in [("c1", "ada@example.com", "Ada", False),
+                                                ("c2", "grace@example.com", "Grace", False),
+                                                ("c3", "", "Nomail", False),
+                                                ("c4", "alan@example.com", "Alan", False),
+                                                ("c5", "gone@example.com", "Gone", True)]:
+        test_db.add(customer_models.Customer(id=id, customer_id=id, organization_id="org", email=address,
+                                             first_name=first_name, last_name="Doe", unique_id=id,
+                                             is_deleted=is_deleted))
+    test_db.commit()
+
+    yield smtp
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+    smtp.stop()
+
+
+def test_a_campaign_is_sent_to_each_customer(setUp):
+    response = client.post("/email/campaigns", json=campaign)
+    assert response.status_code == 201, response.text
+    campaign_id = response.json()["id"]
+    # customers are queued by the scheduler, a chunk per job
+    assert response.json()["recipients"] == {}
+    assert test_db.query(scheduled_job_models.ScheduledJob).count() == 1
+
+    run_scheduled_jobs()
+    assert client.get("/email/campaigns/" + campaign_id).json()["recipients"] == {"pending": 3}
+    assert test_db.query(scheduled_job_models.ScheduledJob).filter_by(status="done").count() == 3
+
+    assert send_outbox_emails() == 3
+    assert client.get("/email/campaigns/" + campaign_id).json()["recipients"] == {"sent": 3}
+
+    messages = {message["to"][0]: html(message) for message in setUp.messages}
+    assert sorted(messages) == ["ada@example.com", "alan@example.com", "grace@example.com"]
+    assert "Ada" in messages["ada@example.com"] and "Grace" not in messages["ada@example.com"]
+    assert "Everything must go" in messages["grace@example.com"]
+    assert "The Shop" in messages["alan@example.com"]
+
+    # campaign emails keep only their own values
+    outbox_email = test_db.query(email_models.OutboxEmail).first()
+    assert outbox_email.subject is None
+    assert "Everything must go" not in outbox_email.template_body
+
+
+def test_csv_recipients_are_added_to_a_campaign(setUp):
+    campaign_id = client.post("/email/campaigns", json={**campaign, "source": "csv"}).json()["id"]
+    rows = "email,first_name\nann@example.com,Ann\nnot-an-email,Bad\nbob@example.com,Bob\ncy@example.com,Cy\n"
+
+    response = client.post("/email/campaigns/%s/recipients" % campaign_id,
+                           files={"file": ("recipients.csv", rows, "text/csv")})
+    assert response.status_code == 200, response.text
+    assert response.json()["recipients"] == {"pending": 3}
+
+    setUp.refused.add("bob@example.com")
+    send_outbox_emails()
+    assert client.get("/email/campaigns/" + campaign_id).json()["recipients"] == {"sent": 2, "dead": 1}
+    assert sorted(message["to"][0] for message in setUp.messages) == ["ann@example.com", "cy@example.com"]
+
+
+def test_csv_recipients_need_an_email_column(setUp):
+    campaign_id = client.post("/email/campaigns", json={**campaign, "source": "csv"}).json()["id"]
+    response = client.post("/email/campaigns/%s/recipients" % campaign_id,
+                           files={"file": ("recipients.csv", "name\nAnn\n", "text/csv")})
+    assert response.status_code == 406
+
+
+def test_only_members_run_an_organizations_campaigns(setUp):
+    campaign_id = client.post("/email/campaigns", json={**campaign, "source": "csv"}).json()["id"]
+    api.dependency_overrides[is_authenticated] = authenticated_as("stranger")
+    try:
+        assert client.post("/email/campaigns", json=campaign).status_code == 403
+        assert client.get("/email/campaigns/" + campaign_id).status_code == 403
+        response = client.post("/email/campaigns/%s/recipients" % campaign_id,
+                               files={"file": ("recipients.csv", "email\nann@example.com\n", "text/csv")})
+        assert response.status_code == 403
+    finally:
+        api.dependency_overrides[is_authenticated] = authenticated_as("owner")
+    assert test_db.query(email_models.OutboxEmail).count() == 0
+
+    del api.dependency_overrides[is_authenticated]
+    try:
+        assert client.get("/email/campaigns/" + campaign_id).status_code == 401
+    finally:
+        api.dependency_overrides[is_authenticated] = authenticated_as("owner")
+
+
+def test_unknown_campaigns_and_organizations(setUp):
+    assert client.get("/email/campaigns/missing").status_code == 404
+    assert client.post("/email/campaigns", json={**campaign, "organization_id": "missing"}).status_code == 404
@@ -0,0 +1,155 @@
+import asyncio
+import email as email_parser
+from types import SimpleNamespace
+
+import pytest
+from fastapi_mail import ConnectionConfig
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import bigfastapi.db.database as database
+from bigfastapi import email
+from bigfastapi.models import email_models
+from bigfastapi.schemas import email_schema
+from bigfastapi.utils import mail_sender, settings
+from tests.fake_smtp import FakeSMTP
+
+engine = create_engine("sqlite:///./test.db", connect_args={'check_same_thread': False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
+test_db = TestingSessionLocal()
+
+tables = [email_models.Email.__table__, email_models.OutboxEmail.__table__]
+
+user = SimpleNamespace(first_name="Ada")
+
+
+def run(service, *args, **kwargs):
+    async def call():
+        try:
+            return await service(*args, **kwargs)
+        finally:
+            await email.smtp_pool.close()
+    return asyncio.run(call())
+
+
+def outbox():
+    test_db.expire_all()
+    return [(json_recipients, status, attempts) for json_recipients, status, attempts in
+            test_db.query(email_models.OutboxEmail.recipients, email_models.OutboxEmail.status,
+                          email_models.OutboxEmail.attempts).order_by(email_models.OutboxEmail.date_created)]
+
+
+def queue_password_resets(*addresses):
+    for address in addresses:
+        run(email.send_email_user, address, user, template="password_reset.html", title="Password Reset",
+            code="1234")
+
+
+@pytest.fixture
+def setUp(monkeypatch):
+    smtp = FakeSMTP().start()
+    config = ConnectionConfig(MAIL_USERNAME="user", MAIL_PASSWORD="password", MAIL_FROM="noreply@example.com",
+                              MAIL_PORT=smtp.port, MAIL_SERVER="127.0.0.1", MAIL_FROM_NAME="BigFastAPI",
+                              MAIL_TLS=False, MAIL_SSL=False, USE_CREDENTIALS=True,
+                              TEMPLATE_FOLDER=email.conf.TEMPLATE_FOLDER)
+    monkeypatch.setattr(email, "smtp_pool", mail_sender.SMTPPool(config, size=2))
+    monkeypatch.setattr(settings, "EMAIL_OUTBOX_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(database, "AsyncSessionLocal", AsyncTestingSessionLocal)
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+    database.Base.metadata.create_all(bind=engine, tables=tables)
+
+    yield smtp
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+    smtp.stop()
+
+
+def test_emails_are_queued_until_the_worker_sends_them(setUp):
+    queue_password_resets("one@example.com")
+    assert outbox() == [('["one@example.com"]', "pending", 0)]
+    assert setUp.messages == []
+
+    assert run(email.send_outbox_emails) == 1
+    assert outbox() == [('["one@example.com"]', "sent", 1)]
+    [message] = setUp.messages
+    assert message["to"] == ["one@example.com"]
+    parsed = email_parser.message_from_string(message["data"])
+    assert parsed["Subject"] == "Password Reset"
+    assert parsed["From"] == "BigFastAPI <noreply@example.com>"
+    [html] = parsed.get_payload()
+    assert "<strong>1234</strong>" in html.get_payload(decode=True).decode()
+
+
+def test_a_batch_reuses_pooled_connections(setUp):
+    queue_password_resets(*("user%d@example.com" % i for i in range(6)))
+
+    assert run(email.send_outbox_emails) == 6
+    assert len(setUp.messages) == 6
+    assert setUp.connections <= 2
+    assert setUp.logins == setUp.connections
+    assert run(email.send_outbox_emails) == 0
+
+
+def test_send_email_archives_and_queues_in_one_commit(setUp):
+    details = email_schema.Email(subject="Invoice", recipient=["one@example.com"], title="Invoice",
+                                 first_name="Ada", amount="$10", sender_address="1 Road", sender_city="Lagos",
+                                 sender_state="Lagos")
+    with TestingSessionLocal() as db:
+        email.send_email(email_details=details, background_tasks=None, template="invoice_email.html", db=db)
+
+    archived = test_db.query(email_models.Email).one()
+    queued = test_db.query(email_models.OutboxEmail).one()
+    assert queued.email_id == archived.id
+    assert queued.template == "invoice_email.html"
+    assert archived.template == "invoice_email.html"
+    assert archived.recipient_hash == email_models.recipient_hash(["One@Example.com "])
+    details = archived.details
+    assert details["recipient"] == ["one@example.com"]
+    assert details["amount"] == "$10"
+    assert "receipt_id" not in details
+
+    run(email.send_outbox_emails)
+    assert outbox() == [('["one@example.com"]', "sent", 1)]
+
+
+def test_failed_emails_are_retried_then_dead_lettered(setUp):
+    queue_password_resets("one@example.com")
+    setUp.failures = 2
+
+    run(email.send_outbox_emails)
+    assert outbox() == [('["one@example.com"]', "pending", 1)]
+    run(email.send_outbox_emails)
+    assert outbox() == [('["one@example.com"]', "dead", 2)]
+    assert setUp.messages == []
+    assert "451" in test_db.query(email_models.OutboxEmail).one().last_error
+
+
+def test_refused_recipients_are_dead_lettered_at_once(setUp):
+    setUp.refused.add("gone@example.com")
+    queue_password_resets("gone@example.com", "one@example.com")
+
+    assert run(email.send_outbox_emails) == 2
+    assert outbox() == [('["gone@example.com"]', "dead", 1), ('["one@example.com"]', "sent", 1)]
+
+
+def test_a_worker_past_its_lease_leaves_reclaimed_emails_alone(setUp, monkeypatch):
+    queue_password_resets("one@example.com")
+    send = email._send_outbox_email
+
+    async def send_then_lose_the_lease(outbox_email, campaign=None):
+        error = await send(outbox_email, campaign=campaign)
+        # another worker claims the email again while this one is sending
+        test_db.query(email_models.OutboxEmail).update({"claim_id": "other-worker"})
+        test_db.commit()
+        return error
+
+    monkeypatch.setattr(email, "_send_outbox_email", send_then_lose_the_lease)
+    assert run(email.send_outbox_emails) == 1
+    assert outbox() == [('["one@example.com"]', "sending", 1)]
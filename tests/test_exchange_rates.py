@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import bigfastapi.db.database as database
+from bigfastapi.models import credit_wallet_conversion_models
+from bigfastapi.utils import exchange_rates, http_client, settings
+from bigfastapi.utils.exchange_rates import rate_cache
+from tests.fake_provider import FakeProvider
+
+engine = create_engine("sqlite:///./test.db", connect_args={'check_same_thread': False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
+test_db = TestingSessionLocal()
+
+table = credit_wallet_conversion_models.CreditWalletConversion.__table__
+
+
+def run(service, *args, **kwargs):
+    async def call():
+        try:
+            async with AsyncTestingSessionLocal() as db:
+                return await service(*args, db=db, **kwargs)
+        finally:
+            await http_client.close_client()
+    return asyncio.run(call())
+
+
+def rows():
+    test_db.expire_all()
+    return {rate.currency_code: (rate.rate, rate.is_market_rate)
+            for rate in test_db.query(credit_wallet_conversion_models.CreditWalletConversion).all()}
+
+
+@pytest.fixture
+def setUp(monkeypatch):
+    provider = FakeProvider().start()
+    monkeypatch.setattr(settings, "FREECURRENCY_API_URL", provider.url)
+    monkeypatch.setattr(settings, "FREECURRENCY_API_KEY", "key")
+    monkeypatch.setattr(database, "AsyncSessionLocal", AsyncTestingSessionLocal)
+    table.drop(bind=engine, checkfirst=True)
+    table.create(bind=engine)
+    rate_cache.clear()
+
+    yield provider
+
+    table.drop(bind=engine)
+    provider.stop()
+
+
+def test_refresh_stores_the_whole_table(setUp):
+    run(exchange_rates.refresh_market_rates)
+    assert rows() == {"NGN": (415.5, True), "EUR": (0.9, True), "USD": (1, True)}
+    assert setUp.requests[0]["path"] == "/api/v2/latest?apikey=key"
+
+    setUp.rates["NGN"] = 420
+    run(exchange_rates.refresh_market_rates)
+    assert rows()["NGN"] == (420, True)
+    assert len(rows()) == 3
+
+
+def test_refresh_keeps_rates_set_by_hand(setUp):
+    test_db.add(credit_wallet_conversion_models.CreditWalletConversion(id="ngn", currency_code="NGN", rate=500,
+                                                                       is_market_rate=False))
+    test_db.commit()
+    run(exchange_rates.refresh_market_rates)
+    assert rows()["NGN"] == (500, False)
+    assert run(rate_cache.get, "NGN").rate == 500
+
+
+def test_cached_rates_do_not_query(setUp):
+    run(exchange_rates.refresh_market_rates)
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    try:
+        assert run(rate_cache.get, "eur").rate == 0.9
+        assert run(rate_cache.get, "GBP") is None
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+    assert statements == []
+
+
+def test_stale_rates_are_served_while_reloading(setUp):
+    run(exchange_rates.refresh_market_rates)
+    test_db.query(credit_wallet_conversion_models.CreditWalletConversion).filter_by(currency_code="EUR").update(
+        {"rate": 0.95})
+    test_db.commit()
+    rate_cache.loaded_at -= settings.EXCHANGE_RATE_CACHE_SECONDS + 1
+
+    async def get_twice(db):
+        stale = await rate_cache.get("EUR", db=db)
+        await rate_cache._reloading
+        return stale.rate, (await rate_cache.get("EUR", db=db)).rate
+
+    assert run(get_twice) == (0.9, 0.95)
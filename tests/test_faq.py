@@ -5,7 +5,7 @@ from main import app
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from bigfastapi.db.database import Base, get_db
+from bigfastapi.db.database import Base, get_db, get_read_db
 from bigfastapi.auth import is_authenticated
 from uuid import uuid4
 from bigfastapi.schemas.users_schemas import User
@@ -32,6 +32,7 @@ client = TestClient(app)
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 
 
 
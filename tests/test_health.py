@@ -0,0 +1,27 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, pool
+
+import bigfastapi.db.database as database
+from main import app
+
+client = TestClient(app)
+
+
+def test_database_health():
+    response = client.get("/health/db")
+    assert response.status_code == 200
+    assert response.json()["sync"].get("pool")
+    assert response.json()["async"].get("pool")
+
+
+def test_pool_status_reports_usage():
+    engine = create_engine("sqlite://", poolclass=pool.QueuePool, pool_size=3, max_overflow=2)
+    connection = engine.connect()
+    status = database.pool_status(engine)
+    assert status.get("pool") == "QueuePool"
+    assert status.get("size") == 3
+    assert status.get("checked_out") == 1
+    assert status.get("max_overflow") == 2
+    assert status.get("available") == 4
+    connection.close()
+    assert database.pool_status(engine).get("checked_out") == 0
@@ -0,0 +1,82 @@
+import asyncio
+import datetime
+
+import httpx
+import pytest
+import stripe
+
+from bigfastapi.schemas.wallet_schemas import PaymentProvider
+from bigfastapi.schemas.users_schemas import User
+from bigfastapi.utils import http_client, settings
+from bigfastapi.utils.utils import generate_payment_link
+from tests.fake_provider import FakeProvider
+
+user = User(id="user", email="user@example.com", first_name="Ada", last_name="Obi", phone_number="0800",
+            is_active=True, is_verified=True, is_superuser=False, is_deleted=False,
+            date_created=datetime.datetime.utcnow(), last_updated=datetime.datetime.utcnow())
+
+
+def run(coroutine):
+    async def call():
+        try:
+            return await coroutine
+        finally:
+            await http_client.close_client()
+    return asyncio.run(call())
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = FakeProvider().start()
+    monkeypatch.setattr(settings, "FLUTTERWAVE_API_URL", provider.url)
+    monkeypatch.setattr(settings, "FLUTTERWAVE_SEC_KEY", "flw_test")
+    # the Stripe SDK reads its settings once, at import
+    monkeypatch.setattr(stripe, "api_base", provider.url)
+    monkeypatch.setattr(stripe, "api_key", "sk_test")
+    monkeypatch.setattr(settings, "HTTP_BACKOFF_SECONDS", 0.01)
+
+    yield provider
+
+    provider.stop()
+
+
+def test_connections_are_reused(provider):
+    async def fetch():
+        return [(await http_client.get(provider.url + "/api/v2/latest")).status_code for _ in range(3)]
+
+    assert run(fetch()) == [200, 200, 200]
+    assert len({request["client"] for request in provider.requests}) == 1
+
+
+def test_get_is_retried(provider):
+    provider.failures = 2
+    response = run(http_client.get(provider.url + "/api/v2/latest"))
+    assert response.status_code == 200
+    assert len(provider.requests) == 3
+
+
+def test_post_is_not_retried_after_an_answer(provider):
+    provider.failures = 1
+    response = run(http_client.post(provider.url + "/v3/payments/", json={"tx_ref": "ref"}))
+    assert response.status_code == 503
+    assert len(provider.requests) == 1
+
+
+def test_unreachable_provider_raises(provider):
+    provider.stop()
+    with pytest.raises(httpx.ConnectError):
+        run(http_client.get(provider.url + "/api/v2/latest", retries=1))
+
+
+def test_flutterwave_payment_link(provider):
+    link = run(generate_payment_link(api_redirect_url="https://api.test/callback", user=user, currency="NGN",
+                                     tx_ref="ref", amount=100, provider=PaymentProvider.FLUTTERWAVE))
+    assert link == "https://checkout.flutterwave.test/ref"
+    assert provider.requests[0]["headers"]["Authorization"] == "Bearer flw_test"
+
+
+def test_stripe_payment_link(provider):
+    link = run(generate_payment_link(api_redirect_url="https://api.test/callback", user=user, currency="usd",
+                                     tx_ref="ref", amount=100, provider=PaymentProvider.STRIPE))
+    assert link == "https://checkout.stripe.test/cs_test"
+    assert provider.requests[0]["headers"]["Authorization"] == "Bearer sk_test"
@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from bigfastapi import notification
+from bigfastapi.utils import settings
+from bigfastapi.utils.notification_hub import InMemoryBroker, NotificationHub
+
+
+def test_messages_reach_the_recipients_subscribers():
+    hub = NotificationHub(InMemoryBroker())
+
+    async def main():
+        async with hub.subscribe("ada@example.com") as first, hub.subscribe("ada@example.com") as second, \
+                hub.subscribe("alan@example.com") as other:
+            await hub.publish("ada@example.com", "hello")
+            assert first.get_nowait() == second.get_nowait() == "hello"
+            assert other.empty()
+            assert hub.subscriber_count("ada@example.com") == 2
+        assert hub.subscriber_count("ada@example.com") == 0
+
+    asyncio.run(main())
+
+
+def test_slow_subscribers_lose_the_oldest_messages():
+    hub = NotificationHub(InMemoryBroker(), queue_size=2)
+
+    async def main():
+        async with hub.subscribe("ada@example.com") as messages:
+            for i in range(3):
+                await hub.publish("ada@example.com", str(i))
+            return [messages.get_nowait() for _ in range(messages.qsize())]
+
+    assert asyncio.run(main()) == ["1", "2"]
+
+
+class Request:
+    """Disconnects after checks calls to is_disconnected"""
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    async def is_disconnected(self):
+        self.checks -= 1
+        return self.checks < 0
+
+
+def test_notification_events_are_server_sent_events(monkeypatch):
+    hub = NotificationHub(InMemoryBroker())
+    monkeypatch.setattr(notification, "hub", hub)
+    monkeypatch.setattr(settings, "NOTIFICATION_STREAM_HEARTBEAT_SECONDS", 0.01)
+
+    async def main():
+        stream = notification.notification_events(Request(checks=2), recipient="ada@example.com")
+        events = [await stream.__anext__()]
+        await hub.publish("ada@example.com", json.dumps({"id": "n1"}))
+        events += [event async for event in stream]
+        return events
+
+    assert asyncio.run(main()) == [": connected\n\n", 'event: notification\ndata: {"id": "n1"}\n\n',
+                                   ": keep-alive\n\n"]
+    assert hub.subscriber_count("ada@example.com") == 0
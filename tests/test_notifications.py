@@ -1,21 +1,36 @@
+from datetime import datetime, timedelta
+import json
 import pytest
 from fastapi.testclient import TestClient
+import asyncio
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from bigfastapi.schemas import notification_schemas, users_schemas
-from bigfastapi.models import notification_models
+from bigfastapi.models import notification_models, organisation_models, role_models, scheduled_job_models, store_user_model, user_models
+from bigfastapi.utils import settings
+from bigfastapi.utils.scheduler import scheduler
 import bigfastapi.db.database as database
-from bigfastapi.notification import is_authenticated
+from bigfastapi.notification import archive_notifications, is_authenticated, purge_archived_notifications
+from bigfastapi.utils.notification_hub import InMemoryBroker, hub as notification_hub
 from main import app
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./database.db"
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread': False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./database.db")
 
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
 test_db = TestingSessionLocal()
 
+tables = [notification_models.Notification.__table__, notification_models.NotificationCounter.__table__,
+          notification_models.ArchivedNotification.__table__,
+          user_models.User.__table__, organisation_models.Organization.__table__, role_models.Role.__table__,
+          store_user_model.StoreUser.__table__, scheduled_job_models.ScheduledJob.__table__]
+
 async def override_is_authenticated():
     user_data = {
         "id":"9cd87677378946d88dc7903b6710ae55", 
@@ -27,7 +42,10 @@ async def override_is_authenticated():
         "is_verified":True, 
         "is_superuser":True, 
         "phone_number":"123456789000", 
-        "organization":"test"
+        "organization":"test",
+        "is_deleted": False,
+        "date_created": datetime(2022, 1, 1),
+        "last_updated": datetime(2022, 1, 1)
     }
     return users_schemas.User(**user_data)
 
@@ -38,13 +56,21 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
 client = TestClient(app)
 
 
 @pytest.fixture
-def setUp():
-    database.Base.metadata.create_all(bind=engine, tables=[notification_models.Notification.__table__])
+def setUp(monkeypatch):
+    monkeypatch.setattr(database, "AsyncSessionLocal", AsyncTestingSessionLocal)
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+    database.Base.metadata.create_all(bind=engine, tables=tables)
     app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
+    app.dependency_overrides[database.get_async_db] = override_get_async_db
     app.dependency_overrides[is_authenticated] = override_is_authenticated
 
     notification1 = notification_models.Notification(
@@ -56,12 +82,13 @@ def setUp():
     )
 
     test_db.add(notification1)
+    test_db.add(notification_models.NotificationCounter(recipient="admin@gmail.com", unread=1))
     test_db.commit()
     test_db.refresh(notification1)
 
     yield notification_schemas.Notification.from_orm(notification1)
 
-    database.Base.metadata.drop_all(bind=engine, tables=[notification_models.Notification.__table__])
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
 
 def test_system_creating_a_notification(setUp):
     response = client.post("/notification", json={"creator": "support@admin.com", "content":"Testing", "reference":"comment-9cd87677378946d88dc7903b6710ae66", "recipient":"hello@test.com"})
@@ -85,6 +112,33 @@ def test_get_all_notifications(setUp):
     assert response.status_code == 200
     assert len(response.json()) == 1
 
+def test_get_notifications_by_cursor(setUp):
+    for i in range(4):
+        test_db.add(notification_models.Notification(id=f"paged-{i}", creator="support@admin.com", content=f"Paged {i}", reference=f"page-{i}", recipient="admin@gmail.com"))
+    test_db.commit()
+
+    response = client.get("/notifications?limit=2")
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page.get("items")) == 2
+    assert first_page.get("next_cursor")
+
+    response = client.get("/notifications", params={"limit": 2, "cursor": first_page.get("next_cursor")})
+    second_page = response.json()
+    assert len(second_page.get("items")) == 2
+
+    response = client.get("/notifications", params={"limit": 2, "cursor": second_page.get("next_cursor")})
+    last_page = response.json()
+    assert len(last_page.get("items")) == 1
+    assert last_page.get("next_cursor") is None
+
+    ids = [n.get("id") for page in (first_page, second_page, last_page) for n in page.get("items")]
+    assert len(set(ids)) == 5
+
+def test_get_notifications_with_invalid_cursor(setUp):
+    response = client.get("/notifications?cursor=not-a-cursor")
+    assert response.status_code == 400
+
 def test_mark_a_notification_read(setUp):
     response = client.put("/notification/9cd87677378946d88dc7903b6710ae77/read")
     assert response.status_code == 200
@@ -92,11 +146,34 @@ def test_mark_a_notification_read(setUp):
     assert response.json().get('content') == "new comment has been created"
 
 def test_mark_all_notifications_read(setUp):
+    for i in range(3):
+        test_db.add(notification_models.Notification(id=f"mine-{i}", creator="support@admin.com", content=f"Mine {i}", reference=f"mine-{i}", recipient="test@gmail.com"))
+    test_db.add(notification_models.NotificationCounter(recipient="test@gmail.com", unread=3))
+    test_db.commit()
+
     response = client.put("/notifications/read")
     assert response.status_code == 200
-    assert len(response.json()) == 1
-    for n in response.json():
-        assert n.get("has_read") == True
+    assert response.json().get("updated") == 3
+    test_db.expire_all()
+    assert all(n.has_read for n in test_db.query(notification_models.Notification).filter_by(recipient="test@gmail.com"))
+    # other recipients' notifications are left alone
+    assert not notification_models.notification_selector(id="9cd87677378946d88dc7903b6710ae77", db=test_db).has_read
+    assert client.put("/notifications/read").json().get("updated") == 0
+
+def test_mark_notifications_read_by_id_and_age(setUp):
+    for i in range(4):
+        test_db.add(notification_models.Notification(id=f"mine-{i}", creator="support@admin.com", content=f"Mine {i}", reference=f"mine-{i}", recipient="test@gmail.com", date_created=datetime(2022, 1, 1 + i)))
+    test_db.add(notification_models.NotificationCounter(recipient="test@gmail.com", unread=4))
+    test_db.commit()
+
+    response = client.put("/notifications/read", json={"ids": ["mine-0", "mine-3", "9cd87677378946d88dc7903b6710ae77"]})
+    assert response.json().get("updated") == 2
+    assert unread_count() == 2
+
+    response = client.put("/notifications/read", json={"before": "2022-01-03T00:00:00"})
+    assert response.json().get("updated") == 1
+    assert unread_count() == 1
+    assert [n.get("id") for n in client.get("/notifications/inbox", params={"has_read": False}).json().get("items")] == ["mine-2"]
     
 def test_update_a_notification_content(setUp):
     response = client.put("/notifications/9cd87677378946d88dc7903b6710ae77", json={"content":"Testing!!!", "reference":"", "recipient":""})
@@ -116,4 +193,176 @@ def test_update_a_notification_recipient(setUp):
 def test_delete_a_notification(setUp):
     response = client.delete("/notification/9cd87677378946d88dc7903b6710ae77")
     assert response.status_code == 200
-    assert response.json().get("message") == "successfully deleted"
\ No newline at end of file
+    assert response.json().get("message") == "successfully deleted"
+def unread_count():
+    return client.get("/notifications/inbox/unread-count").json().get("unread")
+
+def test_inbox_only_has_the_users_notifications(setUp):
+    for i in range(3):
+        test_db.add(notification_models.Notification(id=f"inbox-{i}", creator="support@admin.com", content=f"Inbox {i}", reference=f"inbox-{i}", recipient="test@gmail.com", has_read=i == 0))
+    test_db.commit()
+
+    response = client.get("/notifications/inbox", params={"limit": 2})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [n.get("id") for n in first_page.get("items")] == ["inbox-2", "inbox-1"]
+    last_page = client.get("/notifications/inbox", params={"limit": 2, "cursor": first_page.get("next_cursor")}).json()
+    assert [n.get("id") for n in last_page.get("items")] == ["inbox-0"]
+    assert last_page.get("next_cursor") is None
+
+    unread = client.get("/notifications/inbox", params={"has_read": False}).json()
+    assert [n.get("id") for n in unread.get("items")] == ["inbox-2", "inbox-1"]
+
+def test_unread_count_follows_notifications(setUp):
+    assert unread_count() == 0
+    created = [client.post("/notification", json={"creator": "", "content": f"Hi {i}", "reference": f"ref-{i}", "recipient": "test@gmail.com"}).json() for i in range(3)]
+    assert unread_count() == 3
+
+    client.put(f"/notification/{created[0].get('id')}/read")
+    client.put(f"/notification/{created[0].get('id')}/read")
+    assert unread_count() == 2
+
+    client.put(f"/notifications/{created[1].get('id')}", json={"content": "", "reference": "", "recipient": "other@test.com"})
+    assert unread_count() == 1
+    assert test_db.get(notification_models.NotificationCounter, "other@test.com").unread == 1
+
+    client.delete(f"/notification/{created[2].get('id')}")
+    client.delete(f"/notification/{created[0].get('id')}")
+    assert unread_count() == 0
+
+def test_created_notifications_are_published(setUp, monkeypatch):
+    published = []
+
+    class RecordingBroker(InMemoryBroker):
+        async def publish(self, channel, message):
+            published.append((channel, json.loads(message)))
+
+    monkeypatch.setattr(notification_hub, "broker", RecordingBroker())
+    response = client.post("/notification", json={"creator": "", "content": "Pushed", "reference": "push-1", "recipient": "ada@test.com"})
+    assert response.status_code == 200
+    assert published == [("ada@test.com", response.json())]
+
+def inbox_of(recipient):
+    test_db.expire_all()
+    return test_db.query(notification_models.Notification).filter_by(recipient=recipient).all()
+
+def add_organization():
+    for user_id in ("owner", "member-1", "member-2", "member-3", "left"):
+        test_db.add(user_models.User(id=user_id, email=f"{user_id}@org.com", password="-", is_deleted=False))
+    test_db.add(organisation_models.Organization(id="org", creator="owner", name="org"))
+    test_db.add(organisation_models.Organization(id="other-org", creator="owner", name="other org"))
+    test_db.add(role_models.Role(id="admin-role", organization_id="org", role_name="admin"))
+    test_db.add(role_models.Role(id="user-role", organization_id="org", role_name="user"))
+    for user_id, role_id, is_deleted in (("member-1", "admin-role", False), ("member-2", "user-role", False),
+                                         ("member-3", "user-role", False), ("left", "admin-role", True),
+                                         # the authenticated user
+                                         ("9cd87677378946d88dc7903b6710ae55", "admin-role", False)):
+        test_db.add(store_user_model.StoreUser(id=f"store-{user_id}", store_id="org", user_id=user_id,
+                                               role_id=role_id, is_deleted=is_deleted))
+    test_db.commit()
+
+def record_commits(commit, commits):
+    async def recording_commit(self):
+        commits.append(self)
+        return await commit(self)
+    return recording_commit
+
+def test_fan_out_to_recipients(setUp, monkeypatch):
+    monkeypatch.setattr(settings, "NOTIFICATION_FANOUT_CHUNK_SIZE", 2)
+    response = client.post("/notifications/fan-out", json={"content": "Hello all", "reference": "announce-1",
+                                                           "recipients": ["a@test.com", "admin@gmail.com", "a@test.com", "b@test.com", "c@test.com", "d@test.com"]})
+    assert response.status_code == 200
+    assert response.json() == {"created": 2, "background": True}
+    assert [n.creator for n in inbox_of("a@test.com")] == ["test@gmail.com"]
+    assert inbox_of("b@test.com") == []
+
+    # a chunk per job, each committed on its own
+    commits = []
+    monkeypatch.setattr(AsyncSession, "commit", record_commits(AsyncSession.commit, commits))
+    assert asyncio.run(scheduler.run_due_jobs()) == 2
+    assert len(commits) == 3  # the claim, then one per job
+    assert [n.content for n in inbox_of("b@test.com")] == ["Hello all"]
+    assert [n.content for n in inbox_of("d@test.com")] == ["Hello all"]
+    assert test_db.get(notification_models.NotificationCounter, "a@test.com").unread == 1
+    assert test_db.get(notification_models.NotificationCounter, "admin@gmail.com").unread == 2
+
+def test_fan_out_to_an_organization(setUp, monkeypatch):
+    add_organization()
+    monkeypatch.setattr(settings, "NOTIFICATION_FANOUT_CHUNK_SIZE", 3)
+    response = client.post("/notifications/fan-out", json={"content": "Hello org", "reference": "announce-2", "organization_id": "org"})
+    assert response.json() == {"created": 3, "background": True}
+
+    while asyncio.run(scheduler.run_due_jobs()):
+        pass
+    for user_id in ("owner", "member-1", "member-2", "member-3"):
+        assert [n.content for n in inbox_of(f"{user_id}@org.com")] == ["Hello org"]
+    assert inbox_of("left@org.com") == []
+
+def test_fan_out_to_a_role(setUp):
+    add_organization()
+    response = client.post("/notifications/fan-out", json={"content": "Hello users", "reference": "announce-3",
+                                                           "organization_id": "org", "role": "User"})
+    assert response.json() == {"created": 2, "background": False}
+    assert test_db.query(scheduled_job_models.ScheduledJob).count() == 0
+    assert sorted(n.recipient for n in test_db.query(notification_models.Notification).filter_by(reference="announce-3")) == ["member-2@org.com", "member-3@org.com"]
+
+def test_fan_out_needs_an_audience(setUp):
+    assert client.post("/notifications/fan-out", json={"content": "Hi", "reference": "r"}).status_code == 400
+    assert client.post("/notifications/fan-out", json={"content": "Hi", "reference": "r", "recipients": ["a@test.com"], "role": "admin"}).status_code == 400
+    assert client.post("/notifications/fan-out", json={"content": "Hi", "reference": "r", "organization_id": "nowhere"}).status_code == 404
+
+def test_only_members_fan_out_to_an_organization(setUp):
+    add_organization()
+    response = client.post("/notifications/fan-out", json={"content": "Hi", "reference": "r", "organization_id": "other-org"})
+    assert response.status_code == 403
+    assert inbox_of("owner@org.com") == []
+
+def add_aged_notification(id, reference, days, has_read=True):
+    created = datetime.utcnow() - timedelta(days=days)
+    test_db.add(notification_models.Notification(id=id, creator="support@admin.com", content=id, reference=reference, recipient="test@gmail.com",
+                                                 has_read=has_read, date_created=created, last_updated=created))
+
+def test_expired_read_notifications_are_archived(setUp, monkeypatch):
+    monkeypatch.setattr(settings, "NOTIFICATION_TTL_DAYS", 30)
+    monkeypatch.setattr(settings, "NOTIFICATION_TTL_DAYS_BY_TYPE", {"comment": 7, "blog": 0})
+    monkeypatch.setattr(settings, "NOTIFICATION_RETENTION_BATCH_SIZE", 2)
+    add_aged_notification("old-comment", "comment-1", days=10)
+    add_aged_notification("new-comment", "comment-2", days=3)
+    add_aged_notification("unread-comment", "comment-3", days=10, has_read=False)
+    add_aged_notification("old-blog", "blog-1", days=400)
+    add_aged_notification("old-other", "invoice-1", days=40)
+    add_aged_notification("old-untyped", None, days=40)
+    add_aged_notification("new-other", "invoice-2", days=10)
+    test_db.commit()
+
+    assert asyncio.run(archive_notifications()) == 2
+    assert asyncio.run(archive_notifications()) == 1
+    assert asyncio.run(archive_notifications()) == 0
+
+    test_db.expire_all()
+    archived = test_db.query(notification_models.ArchivedNotification).all()
+    assert sorted(n.id for n in archived) == ["old-comment", "old-other", "old-untyped"]
+    assert {n.recipient for n in archived} == {"test@gmail.com"}
+    assert sorted(n.id for n in inbox_of("test@gmail.com")) == ["new-comment", "new-other", "old-blog", "unread-comment"]
+
+def test_expired_read_notifications_can_be_deleted(setUp, monkeypatch):
+    monkeypatch.setattr(settings, "NOTIFICATION_TTL_DAYS", 30)
+    monkeypatch.setattr(settings, "NOTIFICATION_ARCHIVE_EXPIRED", False)
+    add_aged_notification("old-other", "invoice-1", days=40)
+    test_db.commit()
+
+    assert asyncio.run(archive_notifications()) == 1
+    assert inbox_of("test@gmail.com") == []
+    assert test_db.query(notification_models.ArchivedNotification).count() == 0
+
+def test_archived_notifications_are_purged(setUp, monkeypatch):
+    for id, days in (("old", 40), ("new", 10)):
+        test_db.add(notification_models.ArchivedNotification(id=id, recipient="test@gmail.com", date_archived=datetime.utcnow() - timedelta(days=days)))
+    test_db.commit()
+
+    monkeypatch.setattr(settings, "NOTIFICATION_ARCHIVE_TTL_DAYS", 0)
+    assert asyncio.run(purge_archived_notifications()) == 0
+    monkeypatch.setattr(settings, "NOTIFICATION_ARCHIVE_TTL_DAYS", 30)
+    assert asyncio.run(purge_archived_notifications()) == 1
+    test_db.expire_all()
+    assert [n.id for n in test_db.query(notification_models.ArchivedNotification)] == ["new"]
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from fastapi_pagination import Params
+from sqlalchemy import Column, Integer, create_engine, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from bigfastapi.utils.utils import paginate_data_query, paginate_query
+
+engine = create_engine("sqlite:///./test.db", connect_args={'check_same_thread': False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
+
+Base = declarative_base()
+
+
+class Row(Base):
+    __tablename__ = "pagination_test_rows"
+    id = Column(Integer, primary_key=True)
+
+
+@pytest.fixture
+def setUp():
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(Row.__table__.insert(), [{"id": id} for id in range(1, 8)])
+
+    yield
+
+    Base.metadata.drop_all(bind=engine)
+
+
+def test_paginate_query_with_async_session(setUp):
+    async def fetch():
+        async with AsyncTestingSessionLocal() as db:
+            return await paginate_query(db, select(Row).order_by(Row.id), Params(page=2, size=3))
+
+    page = asyncio.run(fetch())
+    assert page.total == 7
+    assert [row.id for row in page.items] == [4, 5, 6]
+
+
+def test_paginate_query_with_session(setUp):
+    with TestingSessionLocal() as db:
+        page = asyncio.run(paginate_query(db, select(Row).order_by(Row.id), Params(page=3, size=3)))
+    assert page.total == 7
+    assert [row.id for row in page.items] == [7]
+
+
+def test_paginate_data_query(setUp):
+    with TestingSessionLocal() as db:
+        page = asyncio.run(paginate_data_query(db, select(Row).order_by(Row.id.desc()), 2, 1))
+    assert page["total_documents"] == 7
+    assert page["page_limit"] == 2
+    assert [row.id for row in page["data"]] == [7, 6]
+
+
+def test_paginate_data_query_before_the_first_page(setUp):
+    with TestingSessionLocal() as db:
+        page = asyncio.run(paginate_data_query(db, select(Row).order_by(Row.id), 2, 0))
+    assert [row.id for row in page["data"]] == [1, 2]
@@ -50,6 +50,7 @@ client = TestClient(app)
 def setUp():
     database.Base.metadata.create_all(engine, tables=[plan_models.Plan.__table__])
     app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
     app.dependency_overrides[is_authenticated] = override_is_authenticated
 
     plan_data_one = {
@@ -0,0 +1,155 @@
+import asyncio
+import datetime as _dt
+
+import fastapi
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import bigfastapi.db.database as database
+from bigfastapi import email
+from bigfastapi.db.database import get_db
+from bigfastapi.models import email_models, scheduled_job_models
+from bigfastapi.utils import settings
+from bigfastapi.utils.scheduler import Scheduler, scheduler
+
+engine = create_engine("sqlite:///./test.db", connect_args={'check_same_thread': False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
+test_db = TestingSessionLocal()
+
+tables = [email_models.Email.__table__, email_models.OutboxEmail.__table__,
+          scheduled_job_models.ScheduledJob.__table__]
+
+
+def override_get_db():
+    with TestingSessionLocal() as db:
+        yield db
+
+
+api = fastapi.FastAPI()
+api.include_router(email.app)
+api.dependency_overrides[get_db] = override_get_db
+client = TestClient(api)
+
+email_details = {"subject": "Promo", "recipient": ["one@example.com"], "title": "Promo", "first_name": "Ada",
+                 "sender_address": "1 Road", "sender_city": "Lagos", "sender_state": "Lagos"}
+
+
+def jobs():
+    test_db.expire_all()
+    return [(job.job_type, job.status, job.attempts)
+            for job in test_db.query(scheduled_job_models.ScheduledJob).order_by(
+                scheduled_job_models.ScheduledJob.run_at)]
+
+
+def add_job(job_type, payload, run_at, scheduler=scheduler):
+    with TestingSessionLocal() as db:
+        scheduler.schedule(job_type, payload, run_at=run_at, db=db)
+        db.commit()
+
+
+@pytest.fixture
+def setUp(monkeypatch):
+    monkeypatch.setattr(database, "AsyncSessionLocal", AsyncTestingSessionLocal)
+    monkeypatch.setattr(settings, "SCHEDULED_JOB_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(settings, "SCHEDULED_JOB_MAX_ATTEMPTS", 2)
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+    database.Base.metadata.create_all(bind=engine, tables=tables)
+
+    yield
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+
+
+def test_scheduling_a_marketing_email_returns_at_once(setUp):
+    schedule_at = (_dt.datetime.now() + _dt.timedelta(hours=5)).isoformat()
+    response = client.post("/email/send/marketing-email/schedule", params={"schedule_at": schedule_at},
+                           json=email_details)
+
+    assert response.status_code == 200, response.text
+    assert jobs() == [("marketing_email", "pending", 0)]
+    assert asyncio.run(scheduler.run_due_jobs()) == 0
+    assert test_db.query(email_models.OutboxEmail).count() == 0
+
+
+def test_scheduling_in_the_past_is_refused(setUp):
+    schedule_at = (_dt.datetime.now() - _dt.timedelta(minutes=1)).isoformat()
+    response = client.post("/email/send/marketing-email/schedule", params={"schedule_at": schedule_at},
+                           json=email_details)
+    assert response.status_code == 404
+    assert jobs() == []
+
+
+def test_due_marketing_emails_are_queued_in_the_outbox(setUp):
+    add_job("marketing_email", {"email_details": email_details, "template": "marketing_email.html"},
+            run_at=_dt.datetime.now() - _dt.timedelta(seconds=1))
+    add_job("marketing_email", {"email_details": email_details, "template": "marketing_email.html"},
+            run_at=_dt.datetime.now() + _dt.timedelta(hours=1))
+
+    assert asyncio.run(scheduler.run_due_jobs()) == 1
+    assert jobs() == [("marketing_email", "done", 1), ("marketing_email", "pending", 0)]
+    queued = test_db.query(email_models.OutboxEmail).one()
+    assert queued.template == "marketing_email.html"
+    assert queued.email_id == test_db.query(email_models.Email).one().id
+
+
+def test_failed_jobs_are_retried_then_dead_lettered(setUp):
+    failing = Scheduler()
+
+    @failing.handler("broken")
+    async def broken(payload, db):
+        db.add(email_models.OutboxEmail(subject="never committed"))
+        raise ValueError(payload["reason"])
+
+    add_job("broken", {"reason": "nope"}, run_at=_dt.datetime.now(), scheduler=failing)
+    add_job("unknown", {}, run_at=_dt.datetime.now(), scheduler=failing)
+
+    assert asyncio.run(failing.run_due_jobs()) == 2
+    assert sorted(jobs()) == [("broken", "pending", 1), ("unknown", "dead", 1)]
+    asyncio.run(failing.run_due_jobs())
+    assert sorted(jobs()) == [("broken", "dead", 2), ("unknown", "dead", 1)]
+    assert test_db.query(email_models.OutboxEmail).count() == 0
+
+
+def test_the_loop_wakes_for_a_sooner_job(setUp, monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULER_MAX_SLEEP_SECONDS", 60)
+    ran = Scheduler()
+    payloads = []
+
+    @ran.handler("record")
+    async def record(payload, db):
+        payloads.append(payload)
+
+    async def main():
+        sleeping = asyncio.Event()
+
+        # the loop asks for the next job once it has run the due ones, right before it sleeps
+        next_run_at = ran.next_run_at
+        async def found_next_run_at():
+            try:
+                return await next_run_at()
+            finally:
+                sleeping.set()
+        monkeypatch.setattr(ran, "next_run_at", found_next_run_at)
+
+        await ran.start()
+        try:
+            await asyncio.wait_for(sleeping.wait(), 10)
+            sleeping.clear()
+            run_at = _dt.datetime.now()
+            add_job("record", {"n": 1}, run_at=run_at, scheduler=ran)
+            ran.wake(run_at)
+            await asyncio.wait_for(sleeping.wait(), 10)
+        finally:
+            await ran.stop()
+
+    asyncio.run(main())
+    assert payloads == [{"n": 1}]
+    assert jobs() == [("record", "done", 1)]
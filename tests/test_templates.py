@@ -0,0 +1,50 @@
+import os
+
+from bigfastapi import email, receipts
+from bigfastapi.utils import settings, templates
+
+
+def write(folder, name, content):
+    path = folder / name
+    path.write_text(content)
+    # make the change visible to mtime checks within the same second
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime + 5, stat.st_mtime + 5))
+
+
+def test_configs_share_one_environment():
+    assert email.conf.template_engine() is email.conf.template_engine()
+    assert receipts.conf.template_engine() is receipts.conf.template_engine()
+    assert email.conf.template_engine().auto_reload is False
+
+
+def test_precompile_compiles_every_template(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "TEMPLATE_BYTECODE_CACHE_DIR", str(tmp_path / "cache"))
+    (tmp_path / "email").mkdir()
+    write(tmp_path / "email", "hello.html", "Hello {{ first_name }}")
+    write(tmp_path / "email", "broken.html", "{% if %}")
+    write(tmp_path / "email", "notes.txt", "not a template")
+
+    assert templates.precompile(tmp_path / "email") == 1
+    assert os.listdir(tmp_path / "cache")
+
+    environment = templates.get_environment(str(tmp_path / "email"))
+    assert environment.get_template("hello.html").render(first_name="Ada") == "Hello Ada"
+
+
+def test_templates_are_only_reloaded_when_asked_to(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "TEMPLATE_BYTECODE_CACHE_DIR", str(tmp_path / "cache"))
+    for name in ("cached", "reloaded"):
+        (tmp_path / name).mkdir()
+        write(tmp_path / name, "hello.html", "Hello {{ first_name }}")
+
+    cached = templates.get_environment(str(tmp_path / "cached"))
+    monkeypatch.setattr(settings, "TEMPLATE_AUTO_RELOAD", True)
+    reloaded = templates.get_environment(str(tmp_path / "reloaded"))
+    for environment in (cached, reloaded):
+        environment.get_template("hello.html")
+
+    write(tmp_path / "cached", "hello.html", "Bye {{ first_name }}")
+    write(tmp_path / "reloaded", "hello.html", "Bye {{ first_name }}")
+    assert cached.get_template("hello.html").render(first_name="Ada") == "Hello Ada"
+    assert reloaded.get_template("hello.html").render(first_name="Ada") == "Bye Ada"
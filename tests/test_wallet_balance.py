@@ -0,0 +1,152 @@
+import asyncio
+
+import fastapi
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import bigfastapi.db.database as database
+from bigfastapi import wallet
+from bigfastapi.models import organisation_models, user_models, wallet_models, wallet_transaction_models
+
+engine = create_engine("sqlite:///./test.db", connect_args={'check_same_thread': False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
+test_db = TestingSessionLocal()
+
+tables = [user_models.User.__table__, organisation_models.Organization.__table__,
+          wallet_models.Wallet.__table__, wallet_models.WalletBalanceShard.__table__,
+          wallet_transaction_models.WalletTransaction.__table__]
+
+
+def run(service, *args, **kwargs):
+    async def call():
+        async with AsyncTestingSessionLocal() as db:
+            return await service(*args, db=db, **kwargs)
+    return asyncio.run(call())
+
+
+def update_wallet(amount, **kwargs):
+    async def call():
+        async with AsyncTestingSessionLocal() as db:
+            wallet_in_db = await db.get(wallet_models.Wallet, "wallet")
+            return await wallet.update_wallet(wallet=wallet_in_db, amount=amount, db=db, currency="NGN", **kwargs)
+    return asyncio.run(call())
+
+
+def balance(wallet_id):
+    test_db.expire_all()
+    return test_db.query(wallet_models.Wallet).filter_by(id=wallet_id).first().balance
+
+
+@pytest.fixture
+def setUp():
+    database.Base.metadata.create_all(bind=engine, tables=tables)
+    test_db.add(user_models.User(id="admin", email="admin@example.com", password="-", is_superuser=True,
+                                 is_deleted=False))
+    test_db.add(organisation_models.Organization(id="admin-org", creator="admin", name="admin org"))
+    test_db.add(wallet_models.Wallet(id="wallet", organization_id="org", currency_code="NGN", balance=0))
+    test_db.add(wallet_transaction_models.WalletTransaction(id="pending", wallet_id="wallet", currency_code="NGN",
+                                                            amount=150, status=False))
+    test_db.commit()
+    wallet._super_admin_wallets.clear()
+
+    yield
+
+    database.Base.metadata.drop_all(bind=engine, tables=tables)
+
+
+def test_settling_a_transaction_updates_the_balance(setUp):
+    updated = update_wallet(150, wallet_transaction_id="pending")
+    assert updated.balance == 150
+    assert balance("wallet") == 150
+
+
+def test_a_transaction_is_settled_once(setUp):
+    update_wallet(150, wallet_transaction_id="pending")
+    with pytest.raises(fastapi.HTTPException) as error:
+        update_wallet(150, wallet_transaction_id="pending")
+    assert error.value.status_code == 409
+    assert balance("wallet") == 150
+
+
+def test_debits_are_paid_to_the_admin_wallet(setUp):
+    update_wallet(150, wallet_transaction_id="pending")
+    update_wallet(-100, reason="credits")
+    update_wallet(-20, reason="credits")
+    admin_wallet = test_db.query(wallet_models.Wallet).filter_by(organization_id="admin-org").first()
+    assert balance("wallet") == 30
+    # the admin wallet is credited through its shard rows
+    assert admin_wallet.balance == 0
+    shards = test_db.query(wallet_models.WalletBalanceShard).filter_by(wallet_id=admin_wallet.id).all()
+    assert sum(shard.balance for shard in shards) == 120
+    assert list(wallet._super_admin_wallets.values()) == [admin_wallet.id]
+
+    [admin_wallet_schema] = run(wallet._with_shard_balances, wallets=[admin_wallet])
+    assert admin_wallet_schema.balance == 120
+    assert run(wallet.reconcile_wallet_balances) == []
+
+
+def test_reconciliation_flags_and_fixes_drift(setUp):
+    update_wallet(150, wallet_transaction_id="pending")
+    test_db.query(wallet_models.Wallet).filter_by(id="wallet").update({"balance": 90})
+    test_db.commit()
+
+    drift = run(wallet.reconcile_wallet_balances, fix=True)
+    assert drift == [{"wallet_id": "wallet", "balance": 90, "ledger_balance": 150}]
+    assert balance("wallet") == 150
+    assert run(wallet.reconcile_wallet_balances) == []
+
+
+def test_reconciliation_accounts_for_shards(setUp):
+    update_wallet(150, wallet_transaction_id="pending")
+    update_wallet(-100, reason="credits")
+    admin_wallet_id = test_db.query(wallet_models.Wallet).filter_by(organization_id="admin-org").first().id
+    test_db.query(wallet_models.WalletBalanceShard).update({"balance": 0})
+    test_db.add(wallet_models.WalletBalanceShard(wallet_id=admin_wallet_id, shard=99, balance=40))
+    test_db.commit()
+
+    drift = run(wallet.reconcile_wallet_balances, fix=True)
+    assert drift == [{"wallet_id": admin_wallet_id, "balance": 40, "ledger_balance": 100}]
+    assert balance(admin_wallet_id) == 60
+    assert run(wallet.reconcile_wallet_balances) == []
+
+
+def test_a_concurrently_created_admin_wallet_is_reused(setUp):
+    async def call():
+        async with AsyncTestingSessionLocal() as db:
+            execute = db.execute
+
+            async def execute_then_race(*args, **kwargs):
+                result = await execute(*args, **kwargs)
+                if db.execute is execute_then_race:
+                    # another payment creates the wallet right after this one looked it up
+                    db.execute = execute
+                    test_db.add(wallet_models.Wallet(id="raced", organization_id="admin-org", currency_code="USD",
+                                                     balance=0))
+                    test_db.commit()
+                return result
+
+            db.execute = execute_then_race
+            wallet_id = await wallet._get_super_admin_wallet_id(db=db, currency="USD")
+            await db.commit()
+            return wallet_id
+
+    assert asyncio.run(call()) == "raced"
+    assert test_db.query(wallet_models.Wallet).filter_by(currency_code="USD").count() == 1
+
+
+def test_deleted_admin_wallets_are_forgotten(setUp):
+    update_wallet(150, wallet_transaction_id="pending")
+    update_wallet(-100, reason="credits")
+    update_wallet(-20, reason="credits")
+    [admin_wallet_id] = wallet._super_admin_wallets.values()
+
+    test_db.query(wallet_models.WalletBalanceShard).delete()
+    test_db.delete(test_db.get(wallet_models.Wallet, admin_wallet_id))
+    test_db.commit()
+    assert wallet._super_admin_wallets == {}
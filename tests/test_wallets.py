@@ -4,6 +4,7 @@ from time import sleep
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from bigfastapi.schemas import users_schemas
 from bigfastapi.models import organisation_models
@@ -18,7 +19,11 @@ SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread': False})
 
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False,
+                                        bind=async_engine, class_=AsyncSession)
 test_db = TestingSessionLocal()
 
 walletID = ''
@@ -49,6 +54,11 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
 client = TestClient(app)
 
 
@@ -57,6 +67,7 @@ def setUp():
     database.Base.metadata.create_all(bind=engine, tables=[wallet_models.Wallet.__table__,
                                                            organisation_models.Organization.__table__])
     app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_async_db] = override_get_async_db
     app.dependency_overrides[is_authenticated] = override_is_authenticated
 
     organization = organisation_models.Organization(